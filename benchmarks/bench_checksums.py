@@ -0,0 +1,179 @@
+#! /usr/bin/env python
+#  -*- coding: utf-8 -*-
+#
+# This file is part of ofunctions package
+
+"""
+checksums benchmark suite
+Times sha256sum() across block sizes and file sizes, with readinto() and mmap, against a plain read() loop
+and hashlib.file_digest() when available, so the defaults of ofunctions.checksums are chosen from data
+
+Usage:
+python -m benchmarks.bench_checksums --file-sizes 4096,1048576,67108864 --output results.json
+
+Versioning semantics:
+    Major version: backward compatibility breaking changes
+    Minor version: New functionality
+    Patch version: Backwards compatible bug fixes
+
+"""
+
+__intname__ = "benchmarks.bench_checksums"
+__author__ = "Orsiris de Jong"
+__copyright__ = "Copyright (C) 2026 Orsiris de Jong"
+__licence__ = "BSD 3 Clause"
+__build__ = "2026101901"
+
+import argparse
+import hashlib
+import os
+import shutil
+import sys
+
+from ofunctions import checksums
+from benchmarks.measure import run_benchmark, environment, write_results
+from benchmarks.synthetic_tree import get_benchmark_dir
+
+DEFAULT_FILE_SIZES = [4096, 1048576, 67108864, 536870912]
+DEFAULT_BLOCK_SIZES = [16384, 65536, 262144, 1048576, 4194304]
+
+
+def _read_loop(file, block_size):
+    # type: (str, int) -> str
+    """
+    Baseline: what sha256sum() used to do, allocating a new bytes object per read
+    """
+    sha256 = hashlib.sha256()
+    with open(file, "rb") as file_handle:
+        while True:
+            data = file_handle.read(block_size)
+            if not data:
+                break
+            sha256.update(data)
+    return sha256.hexdigest()
+
+
+def _file_digest(file):
+    # type: (str) -> str
+    with open(file, "rb") as file_handle:
+        return hashlib.file_digest(file_handle, "sha256").hexdigest()
+
+
+def bench_checksums(
+    root,  # type: str
+    file_sizes=None,  # type: list
+    block_sizes=None,  # type: list
+    runs=3,  # type: int
+):
+    # type: (...) -> dict
+    """
+    Runs sha256sum benchmarks with test files created in root
+    """
+    file_sizes = file_sizes or DEFAULT_FILE_SIZES
+    block_sizes = block_sizes or DEFAULT_BLOCK_SIZES
+    results = {
+        "package": "ofunctions.checksums",
+        "version": checksums.__version__,
+        "environment": environment(),
+        "defaults": {
+            "block_size": checksums.BLOCK_SIZE,
+            "mmap_threshold": checksums.MMAP_THRESHOLD,
+        },
+        "results": [],
+    }
+    mmap_threshold = checksums.MMAP_THRESHOLD
+    for file_size in file_sizes:
+        file = os.path.join(root, "bench_{}.bin".format(file_size))
+        with open(file, "wb") as file_handle:
+            remaining = file_size
+            while remaining > 0:
+                chunk = min(remaining, 16777216)
+                file_handle.write(os.urandom(chunk))
+                remaining -= chunk
+        # Small files need more runs to get meaningful timings
+        file_runs = max(runs, min(200, 67108864 // max(file_size, 1)))
+
+        cases = []
+        for block_size in block_sizes:
+            cases.append(("read", block_size, lambda b=block_size: _read_loop(file, b)))
+            cases.append(
+                (
+                    "readinto",
+                    block_size,
+                    lambda b=block_size: checksums.sha256sum(file, block_size=b),
+                )
+            )
+            cases.append(
+                (
+                    "mmap",
+                    block_size,
+                    lambda b=block_size: checksums.sha256sum(
+                        file, block_size=b, use_mmap=True
+                    ),
+                )
+            )
+        if hasattr(hashlib, "file_digest"):
+            cases.append(("file_digest", None, lambda: _file_digest(file)))
+
+        # Benchmark mmap for every file size regardless of threshold
+        checksums.MMAP_THRESHOLD = 0
+        try:
+            for method, block_size, fn in cases:
+                result = run_benchmark(fn, runs=file_runs)
+                result.update(
+                    {
+                        "method": method,
+                        "file_size": file_size,
+                        "block_size": block_size,
+                        "throughput": (
+                            file_size / result["min"] if result["min"] else None
+                        ),
+                    }
+                )
+                results["results"].append(result)
+        finally:
+            checksums.MMAP_THRESHOLD = mmap_threshold
+        os.remove(file)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ofunctions.checksums benchmarks")
+    parser.add_argument(
+        "--root",
+        default=None,
+        help="Directory for test files, defaults to a tmpfs temp dir",
+    )
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument(
+        "--file-sizes",
+        default=",".join(str(size) for size in DEFAULT_FILE_SIZES),
+        help="Comma separated file sizes in bytes",
+    )
+    parser.add_argument(
+        "--block-sizes",
+        default=",".join(str(size) for size in DEFAULT_BLOCK_SIZES),
+        help="Comma separated block sizes in bytes",
+    )
+    parser.add_argument(
+        "--output", default=None, help="JSON result file, defaults to stdout"
+    )
+    args = parser.parse_args()
+
+    root = args.root if args.root else get_benchmark_dir()
+    try:
+        results = bench_checksums(
+            root,
+            file_sizes=[int(size) for size in args.file_sizes.split(",")],
+            block_sizes=[int(size) for size in args.block_sizes.split(",")],
+            runs=args.runs,
+        )
+    finally:
+        if not args.root:
+            shutil.rmtree(root, ignore_errors=True)
+    write_results(results, args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
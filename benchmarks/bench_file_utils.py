@@ -0,0 +1,165 @@
+#! /usr/bin/env python
+#  -*- coding: utf-8 -*-
+#
+# This file is part of ofunctions package
+
+"""
+file_utils benchmark suite
+Generates a synthetic tree, then times get_paths_recursive, glob_paths, remove_files_on_timestamp_delta,
+grep and replace_in_file, and outputs machine readable json results
+
+Usage:
+python -m benchmarks.bench_file_utils --depth 4 --fan-out 5 --files-per-dir 20 --output results.json
+
+Versioning semantics:
+    Major version: backward compatibility breaking changes
+    Minor version: New functionality
+    Patch version: Backwards compatible bug fixes
+
+"""
+
+__intname__ = "benchmarks.bench_file_utils"
+__author__ = "Orsiris de Jong"
+__copyright__ = "Copyright (C) 2026 Orsiris de Jong"
+__licence__ = "BSD 3 Clause"
+__build__ = "2026101901"
+
+import argparse
+import os
+import shutil
+import sys
+
+from ofunctions import file_utils
+from benchmarks.measure import run_benchmark, environment, write_results
+from benchmarks.synthetic_tree import generate_tree, get_benchmark_dir, TEXT_LINE
+
+
+def bench_file_utils(
+    root,  # type: str
+    runs=5,  # type: int
+    depth=3,  # type: int
+    fan_out=4,  # type: int
+    files_per_dir=10,  # type: int
+    mean_size=4096,  # type: int
+    size_distribution="lognormal",  # type: str
+    seed=0,  # type: int
+):
+    # type: (...) -> dict
+    """
+    Runs the file_utils benchmarks in root, which must be an empty directory
+    """
+    tree_kwargs = {
+        "depth": depth,
+        "fan_out": fan_out,
+        "files_per_dir": files_per_dir,
+        "mean_size": mean_size,
+        "size_distribution": size_distribution,
+        "seed": seed,
+    }
+    tree = os.path.join(root, "tree")
+    dataset = generate_tree(tree, **tree_kwargs)
+    results = {
+        "package": "ofunctions.file_utils",
+        "version": file_utils.__version__,
+        "environment": environment(),
+        "dataset": dataset,
+        "results": {},
+    }
+
+    results["results"]["get_paths_recursive"] = run_benchmark(
+        lambda: sum(1 for _ in file_utils.get_paths_recursive(tree)), runs=runs
+    )
+    results["results"]["get_paths_recursive_filtered"] = run_benchmark(
+        lambda: sum(
+            1
+            for _ in file_utils.get_paths_recursive(
+                tree,
+                d_include_list=["dir_000*"],
+                ext_include_list=[".log"],
+                exclude_dirs=True,
+            )
+        ),
+        runs=runs,
+    )
+    if hasattr(file_utils, "glob_paths"):
+        results["results"]["glob_paths"] = run_benchmark(
+            lambda: sum(1 for _ in file_utils.glob_paths(tree, "dir_000/**/*.log")),
+            runs=runs,
+        )
+
+    # Removal is destructive, so every run gets a fresh copy of the tree
+    removal_tree = os.path.join(root, "removal_tree")
+
+    def _setup_removal():
+        shutil.rmtree(removal_tree, ignore_errors=True)
+        generate_tree(removal_tree, **tree_kwargs)
+
+    results["results"]["remove_files_on_timestamp_delta"] = run_benchmark(
+        lambda: file_utils.remove_files_on_timestamp_delta(
+            removal_tree, mac_type="mtime", days=-15
+        ),
+        runs=runs,
+        setup=_setup_removal,
+    )
+    shutil.rmtree(removal_tree, ignore_errors=True)
+
+    # grep and replace work on a single big text file
+    text_file = os.path.join(root, "big_text_file.txt")
+    with open(text_file, "wb") as file_handle:
+        file_handle.write(
+            TEXT_LINE * max(1, (mean_size * dataset["files"]) // len(TEXT_LINE))
+        )
+    results["results"]["grep"] = run_benchmark(
+        lambda: file_utils.grep(text_file, "lazy dog 01"), runs=runs
+    )
+    results["results"]["replace_in_file"] = run_benchmark(
+        lambda: file_utils.replace_in_file(
+            text_file, "lazy", "lazy", dest_file=text_file + ".out"
+        ),
+        runs=runs,
+    )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ofunctions.file_utils benchmarks")
+    parser.add_argument(
+        "--root", default=None, help="Dataset directory, defaults to a tmpfs temp dir"
+    )
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--fan-out", type=int, default=4)
+    parser.add_argument("--files-per-dir", type=int, default=10)
+    parser.add_argument("--mean-size", type=int, default=4096)
+    parser.add_argument(
+        "--size-distribution",
+        choices=["fixed", "uniform", "lognormal"],
+        default="lognormal",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--output", default=None, help="JSON result file, defaults to stdout"
+    )
+    args = parser.parse_args()
+
+    root = args.root if args.root else get_benchmark_dir()
+    try:
+        results = bench_file_utils(
+            root,
+            runs=args.runs,
+            depth=args.depth,
+            fan_out=args.fan_out,
+            files_per_dir=args.files_per_dir,
+            mean_size=args.mean_size,
+            size_distribution=args.size_distribution,
+            seed=args.seed,
+        )
+    finally:
+        if not args.root:
+            shutil.rmtree(root, ignore_errors=True)
+    write_results(results, args.output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,177 @@
+#! /usr/bin/env python
+#  -*- coding: utf-8 -*-
+#
+# This file is part of ofunctions package
+
+"""
+Timing and syscall counting helpers for benchmarks
+
+Versioning semantics:
+    Major version: backward compatibility breaking changes
+    Minor version: New functionality
+    Patch version: Backwards compatible bug fixes
+
+"""
+
+__intname__ = "benchmarks.measure"
+__author__ = "Orsiris de Jong"
+__copyright__ = "Copyright (C) 2026 Orsiris de Jong"
+__licence__ = "BSD 3 Clause"
+__build__ = "2026101901"
+
+import builtins
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from contextlib import contextmanager
+
+try:
+    from typing import Callable, Optional
+except ImportError:
+    pass
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+# Filesystem functions we count calls of, os.path.isfile() & co end up in os.stat()
+COUNTED_FUNCTIONS = [
+    (os, "stat"),
+    (os, "lstat"),
+    (os, "scandir"),
+    (os, "listdir"),
+    (os, "remove"),
+    (os, "unlink"),
+    (os, "replace"),
+    (os, "rename"),
+    (os, "lseek"),
+    (builtins, "open"),
+]
+
+
+@contextmanager
+def count_calls():
+    """
+    Counts calls to filesystem related functions while in context
+    Python level wrappers slow things down, so never time code while counting
+    Calls made from C code (DirEntry.stat(), file object reads) are not seen here, use io counters for those
+
+    Use as:
+    with count_calls() as counts:
+        your_code
+    print(counts)
+    """
+    counts = {}
+    originals = []
+
+    def _wrap(module, name, function):
+        def wrapper(*args, **kwargs):
+            counts[name] = counts.get(name, 0) + 1
+            return function(*args, **kwargs)
+
+        return wrapper
+
+    for module, name in COUNTED_FUNCTIONS:
+        function = getattr(module, name, None)
+        if function is None:
+            continue
+        originals.append((module, name, function))
+        setattr(module, name, _wrap(module, name, function))
+    try:
+        yield counts
+    finally:
+        for module, name, function in originals:
+            setattr(module, name, function)
+
+
+def io_counters():
+    # type: () -> Optional[dict]
+    """
+    Returns process io counters, on Linux read_count / write_count are the number of read / write syscalls
+    """
+    if psutil is None:
+        return None
+    try:
+        return psutil.Process().io_counters()._asdict()
+    except (AttributeError, NotImplementedError, psutil.Error):
+        return None
+
+
+def _io_delta(before, after):
+    # type: (Optional[dict], Optional[dict]) -> Optional[dict]
+    if before is None or after is None:
+        return None
+    return {key: after[key] - before[key] for key in after if key in before}
+
+
+def run_benchmark(
+    fn,  # type: Callable
+    runs=5,  # type: int
+    setup=None,  # type: Optional[Callable]
+):
+    # type: (...) -> dict
+    """
+    Runs fn several times and returns timings, then runs it once more while counting calls
+
+    :param fn: (callable) function to benchmark, without arguments
+    :param runs: (int) number of timed runs
+    :param setup: (callable) optional untimed function run before every run, ex: to recreate deleted files
+    :return: (dict) timings in seconds, call counts and io counters of the counted run
+    """
+    timings = []
+    for _ in range(runs):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+
+    if setup is not None:
+        setup()
+    io_before = io_counters()
+    with count_calls() as calls:
+        fn()
+    io_after = io_counters()
+
+    return {
+        "runs": runs,
+        "timings": timings,
+        "min": min(timings),
+        "median": statistics.median(timings),
+        "max": max(timings),
+        "calls": calls,
+        "io": _io_delta(io_before, io_after),
+    }
+
+
+def environment():
+    # type: () -> dict
+    """
+    Describes the machine results were produced on
+    """
+    return {
+        "python": sys.version.split()[0],
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "timestamp": time.time(),
+    }
+
+
+def write_results(results, output=None):
+    # type: (dict, Optional[str]) -> None
+    """
+    Writes results as json to output file, or stdout if output is None or "-"
+    """
+    content = json.dumps(results, indent=2, sort_keys=True, default=str)
+    if output is None or output == "-":
+        print(content)
+    else:
+        with open(output, "w", encoding="utf-8") as file_handle:
+            file_handle.write(content)
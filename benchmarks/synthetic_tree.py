@@ -0,0 +1,126 @@
+#! /usr/bin/env python
+#  -*- coding: utf-8 -*-
+#
+# This file is part of ofunctions package
+
+"""
+Synthetic filesystem dataset generator
+
+Versioning semantics:
+    Major version: backward compatibility breaking changes
+    Minor version: New functionality
+    Patch version: Backwards compatible bug fixes
+
+"""
+
+__intname__ = "benchmarks.synthetic_tree"
+__author__ = "Orsiris de Jong"
+__copyright__ = "Copyright (C) 2026 Orsiris de Jong"
+__licence__ = "BSD 3 Clause"
+__build__ = "2026101901"
+
+import os
+import random
+import tempfile
+import time
+
+try:
+    from typing import Optional
+except ImportError:
+    pass
+
+
+# Text line used as file content so grep / replace benchmarks have something to find
+TEXT_LINE = b"The quick brown fox jumps over the lazy dog 0123456789 ofunctions\n"
+
+
+def get_benchmark_dir():
+    # type: () -> str
+    """
+    Returns a fresh directory to generate datasets in, on tmpfs when available so we don't
+    benchmark the disk instead of our code
+    """
+    for candidate in ["/dev/shm", None]:
+        if candidate is None or (
+            os.path.isdir(candidate) and os.access(candidate, os.W_OK)
+        ):
+            return tempfile.mkdtemp(prefix="ofunctions.bench.", dir=candidate)
+    return tempfile.mkdtemp(prefix="ofunctions.bench.")
+
+
+def _file_size(rng, size_distribution, mean_size):
+    # type: (random.Random, str, int) -> int
+    if size_distribution == "fixed":
+        return mean_size
+    if size_distribution == "uniform":
+        return rng.randint(0, 2 * mean_size)
+    if size_distribution == "lognormal":
+        # Many small files and a few big ones, like real world trees
+        return int(rng.lognormvariate(0, 1) * mean_size / 1.6487)
+    raise ValueError("Unknown size distribution {}".format(size_distribution))
+
+
+def generate_tree(
+    root,  # type: str
+    depth=3,  # type: int
+    fan_out=4,  # type: int
+    files_per_dir=10,  # type: int
+    mean_size=4096,  # type: int
+    size_distribution="lognormal",  # type: str
+    mtime_spread=86400 * 30,  # type: int
+    extensions=(".txt", ".log", ".bin"),  # type: tuple
+    seed=0,  # type: Optional[int]
+):
+    # type: (...) -> dict
+    """
+    Creates a reproducible synthetic directory tree
+
+    :param root: (str) directory to create the tree in
+    :param depth: (int) number of directory levels below root
+    :param fan_out: (int) number of subdirectories per directory
+    :param files_per_dir: (int) number of files per directory
+    :param mean_size: (int) mean file size in bytes
+    :param size_distribution: (str) fixed, uniform or lognormal
+    :param mtime_spread: (int) file modification times are spread between now and now - mtime_spread seconds
+    :param extensions: (tuple) file extensions to pick from
+    :param seed: (int) random seed, same seed gives same tree
+    :return: (dict) dataset description
+    """
+    rng = random.Random(seed)
+    now = time.time()
+    stats = {
+        "depth": depth,
+        "fan_out": fan_out,
+        "files_per_dir": files_per_dir,
+        "mean_size": mean_size,
+        "size_distribution": size_distribution,
+        "mtime_spread": mtime_spread,
+        "seed": seed,
+        "dirs": 0,
+        "files": 0,
+        "bytes": 0,
+    }
+
+    def _populate(directory, level):
+        os.makedirs(directory, exist_ok=True)
+        stats["dirs"] += 1
+        for index in range(files_per_dir):
+            path = os.path.join(
+                directory, "file_{:04d}{}".format(index, rng.choice(extensions))
+            )
+            size = _file_size(rng, size_distribution, mean_size)
+            with open(path, "wb") as file_handle:
+                lines, remainder = divmod(size, len(TEXT_LINE))
+                file_handle.write(TEXT_LINE * lines + TEXT_LINE[:remainder])
+            mtime = now - rng.random() * mtime_spread
+            os.utime(path, (mtime, mtime))
+            stats["files"] += 1
+            stats["bytes"] += size
+        if level < depth:
+            for index in range(fan_out):
+                _populate(
+                    os.path.join(directory, "dir_{:03d}".format(index)), level + 1
+                )
+
+    _populate(root, 0)
+    return stats
@@ -21,20 +21,53 @@ __author__ = "Orsiris de Jong"
 __copyright__ = "Copyright (C) 2019-2024 Orsiris de Jong"
 __description__ = "SHA256 Checksumming, manifest file creation and verification"
 __licence__ = "BSD 3 Clause"
-__version__ = "1.1.0"
-__build__ = "2022070501"
+__version__ = "1.2.0"
+__build__ = "2026101901"
 __compat__ = "python2.7+"
 
 
 import os
 import sys
+import asyncio
 import hashlib
+import heapq
+import json
+import logging
+import math
+import mmap
+import pickle
+import random
+import sqlite3
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+from bisect import bisect_left
+from collections import deque
+from functools import partial
 from datetime import datetime
-from ofunctions.file_utils import get_paths_recursive
+from ofunctions.file_utils import (
+    get_paths_recursive,
+    get_file_extents,
+    write_json_to_file,
+    read_json_from_file,
+)
 
 # python 2.7 compat fixes
 if sys.version_info[0] < 3:
     from io import open as open
+try:
+    from typing import Any, Callable, Iterable, List, Optional, Tuple, Union
+except ImportError:
+    pass
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    pass
+
+
+logger = logging.getLogger(__intname__)
 
 
 def sha256sum_data(data):
@@ -47,54 +80,789 @@ def sha256sum_data(data):
     return sha256.hexdigest()
 
 
-def sha256sum(file):
-    # type: (str) -> str
+# Hash algorithm registry, {name: factory returning a hashlib like object}
+HASH_ALGORITHMS = {}
+# Manifest header line used to record the hash algorithm, sha256sum -c ignores comment lines
+MANIFEST_ALGORITHM_HEADER = "# Algorithm: "
+
+
+def register_hash_algorithm(name, factory):
+    # type: (str, Callable) -> None
+    """
+    Registers a hash algorithm usable by hash_file() and manifest functions
+    factory must return an object with update() and hexdigest() methods, like hashlib objects
+
+    Example:
+    register_hash_algorithm('crc32', MyCrc32Hasher)
+    """
+    HASH_ALGORITHMS[name.lower()] = factory
+
+
+def unregister_hash_algorithm(name):
+    # type: (str) -> bool
+    """
+    Removes a hash algorithm registered with register_hash_algorithm()
+    Returns False if the algorithm wasn't registered
+    """
+    return HASH_ALGORITHMS.pop(name.lower(), None) is not None
+
+
+def get_hash_algorithms():
+    # type: () -> List[str]
+    """
+    Returns the names of registered hash algorithms
+    """
+    return sorted(HASH_ALGORITHMS)
+
+
+def _new_hasher(algorithm):
+    # type: (str) -> Any
+    try:
+        return HASH_ALGORITHMS[algorithm.lower()]()
+    except KeyError:
+        raise ValueError(
+            "Unknown hash algorithm {}. Available algorithms are: {}".format(
+                algorithm, ", ".join(get_hash_algorithms())
+            )
+        )
+
+
+def _register_default_hash_algorithms():
+    # type: () -> None
+    for name in [
+        "sha1",
+        "sha224",
+        "sha256",
+        "sha384",
+        "sha512",
+        "blake2b",
+        "blake2s",
+        "sha3_256",
+        "sha3_512",
+    ]:
+        if name in hashlib.algorithms_available:
+            register_hash_algorithm(name, getattr(hashlib, name))
+    # md5 is only used for legacy change detection, so it's allowed on FIPS systems
+    try:
+        hashlib.md5(usedforsecurity=False)
+        register_hash_algorithm("md5", partial(hashlib.md5, usedforsecurity=False))
+    except TypeError:
+        # Python < 3.9
+        register_hash_algorithm("md5", hashlib.md5)
+    except ValueError:
+        pass
+
+    # Optional fast non cryptographic hashes
+    try:
+        import xxhash
+
+        for name in ["xxh32", "xxh64", "xxh3_64", "xxh3_128", "xxh128"]:
+            if hasattr(xxhash, name):
+                register_hash_algorithm(name, getattr(xxhash, name))
+    except ImportError:
+        pass
+    try:
+        import blake3
+
+        register_hash_algorithm("blake3", blake3.blake3)
+    except ImportError:
+        pass
+
+
+_register_default_hash_algorithms()
+
+
+# Defaults chosen from benchmarks/bench_checksums.py results: 256KiB reads are the fastest readinto() block size
+# for all file sizes, and mmap is ~10% faster than readinto() once files reach a few dozen MiB
+BLOCK_SIZE = 262144
+MMAP_THRESHOLD = 33554432
+# Shared read-only buffer used to feed file holes to hash functions
+_ZEROS_SIZE = 1048576
+_ZEROS = memoryview(bytes(_ZEROS_SIZE))
+# Per thread reusable read buffers, so hashing doesn't allocate memory per read nor per file
+_BUFFERS = threading.local()
+
+
+def _get_buffer(block_size):
+    # type: (int) -> memoryview
+    """
+    Returns a reusable writable buffer of block_size for the current thread
+    """
+    buffer = getattr(_BUFFERS, "buffer", None)
+    if buffer is None or len(buffer) != block_size:
+        buffer = memoryview(bytearray(block_size))
+        _BUFFERS.buffer = buffer
+    return buffer
+
+
+# With nocache, already hashed pages are dropped from page cache every NOCACHE_DROP_INTERVAL bytes
+NOCACHE_DROP_INTERVAL = 8388608
+
+
+class BandwidthLimiter(object):
+    """
+    Thread safe token bucket limiting read throughput, one instance can be shared by all hashing threads
+    so the limit applies to their total bandwidth
+
+    Example:
+    limiter = BandwidthLimiter(50 * 1024 * 1024)
+    sha256sum('/data/file1', bandwidth_limit=limiter)
+    """
+
+    def __init__(self, bytes_per_second, burst=None):
+        # type: (int, Optional[int]) -> None
+        """
+        :param bytes_per_second: (int) max average throughput
+        :param burst: (int) max number of bytes that can be read at once after being idle,
+                      defaults to a tenth of a second worth of data
+        """
+        if bytes_per_second <= 0:
+            raise ValueError("Bandwidth limit must be positive")
+        self.rate = float(bytes_per_second)
+        self.burst = burst or max(BLOCK_SIZE, bytes_per_second // 10)
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, amount):
+        # type: (int) -> None
+        """
+        Accounts for amount bytes, sleeping as long as needed to stay under the limit
+        Tokens can go negative, so concurrent callers queue up behind each other's debt
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._last) * self.rate
+            )
+            self._last = now
+            self._tokens -= amount
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+
+def _open_limiter(bandwidth_limit):
+    # type: (Optional[Union[BandwidthLimiter, int]]) -> Optional[BandwidthLimiter]
+    """
+    Returns a BandwidthLimiter from a BandwidthLimiter or a bytes per second value
+    """
+    if not bandwidth_limit or isinstance(bandwidth_limit, BandwidthLimiter):
+        return bandwidth_limit or None
+    return BandwidthLimiter(bandwidth_limit)
+
+
+def _fadvise(fd, offset, length, advice):
+    # type: (int, int, int, str) -> None
+    """
+    posix_fadvise wrapper, silently does nothing where not available (Windows, macOS)
+    """
+    if hasattr(os, "posix_fadvise"):
+        try:
+            os.posix_fadvise(fd, offset, length, getattr(os, advice))
+        except OSError:
+            pass
+
+
+def _hash_file(
+    file,  # type: str
+    hashers,  # type: List[Any]
+    block_size=None,  # type: Optional[int]
+    sparse=False,  # type: bool
+    use_mmap=False,  # type: bool
+    nocache=False,  # type: bool
+    bandwidth_limit=None,  # type: Optional[BandwidthLimiter]
+):
+    # type: (...) -> int
+    """
+    Hashing core: reads a file once and updates all given hash objects with its content
+
+    Data is read with readinto() into a reused per thread buffer, so no memory gets allocated per read
+    When use_mmap is set, files bigger than MMAP_THRESHOLD are mapped in memory and hashed without any copy
+    Beware that mmapped files being truncated while hashed will get the process killed by SIGBUS, hence
+    mmap is opt-in
+
+    :param file: (str) path to file
+    :param hashers: (list) hashlib like objects having an update() method
+    :param block_size: (int) read size, defaults to BLOCK_SIZE
+    :param sparse: (bool) don't read holes of sparse files from disk, feed zeros to the hashers instead
+    :param use_mmap: (bool) use mmap for big files
+    :param nocache: (bool) ask the kernel for sequential readahead and drop hashed pages from page cache,
+                    so hashing doesn't evict other processes' working sets (disables mmap)
+                    Beware that pages of the hashed file that were already cached get dropped too
+    :param bandwidth_limit: (BandwidthLimiter) optional read throughput limiter
+    :return: (int) number of hashed bytes
+    """
+    if not block_size:
+        block_size = BLOCK_SIZE
+    hashed_bytes = 0
+    with open(file, "rb", buffering=0) as file_handle:
+        fd = file_handle.fileno()
+        size = os.fstat(fd).st_size
+        if nocache:
+            _fadvise(fd, 0, 0, "POSIX_FADV_SEQUENTIAL")
+        if use_mmap and not sparse and not nocache and size >= MMAP_THRESHOLD:
+            with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mapped_file:
+                with memoryview(mapped_file) as mapped_view:
+                    for offset in range(0, len(mapped_view), block_size):
+                        chunk = mapped_view[offset : offset + block_size]
+                        for hasher in hashers:
+                            hasher.update(chunk)
+                        chunk.release()
+                        hashed_bytes += min(block_size, size - offset)
+                        if bandwidth_limit is not None:
+                            bandwidth_limit.consume(min(block_size, size - offset))
+            return hashed_bytes
+
+        buffer = _get_buffer(block_size)
+        if sparse:
+            extents = get_file_extents(fd, size)
+        else:
+            # Read until EOF, file might grow while being read
+            extents = [(0, None, True)]
+        for offset, length, is_data in extents:
+            if not is_data:
+                while length > 0:
+                    zeros = _ZEROS[: min(_ZEROS_SIZE, length)]
+                    for hasher in hashers:
+                        hasher.update(zeros)
+                    length -= len(zeros)
+                    hashed_bytes += len(zeros)
+                continue
+            # get_file_extents() moves file offset around, so always seek
+            file_handle.seek(offset)
+            position = dropped_position = offset
+            while length is None or length > 0:
+                read_size = block_size if length is None else min(block_size, length)
+                read_bytes = file_handle.readinto(buffer[:read_size])
+                if not read_bytes:
+                    break
+                data = buffer[:read_bytes]
+                for hasher in hashers:
+                    hasher.update(data)
+                hashed_bytes += read_bytes
+                position += read_bytes
+                if length is not None:
+                    length -= read_bytes
+                if bandwidth_limit is not None:
+                    bandwidth_limit.consume(read_bytes)
+                if nocache and position - dropped_position >= NOCACHE_DROP_INTERVAL:
+                    _fadvise(
+                        fd,
+                        dropped_position,
+                        position - dropped_position,
+                        "POSIX_FADV_DONTNEED",
+                    )
+                    dropped_position = position
+            if nocache and position > dropped_position:
+                _fadvise(
+                    fd,
+                    dropped_position,
+                    position - dropped_position,
+                    "POSIX_FADV_DONTNEED",
+                )
+    return hashed_bytes
+
+
+class HashCache(object):
+    """
+    Persistent file checksum cache, so unchanged files don't need to be read again
+
+    Entries are keyed by (device, inode, size, mtime_ns, ctime_ns), any change of those invalidates the cached digest
+    Two backends are available:
+    - sqlite: a sidecar SQLite database file, which is the default
+    - xattr: digests are stored in a user.ofunctions.<algorithm> extended attribute of the file itself (Linux only)
+             Since setting an attribute changes the file ctime, ctime is not part of the key for this backend
+             Files we can't write attributes to are simply not cached
+
+    Example:
+
+    with HashCache('/var/cache/manifest.db') as cache:
+        create_manifest_from_dir('/tmp/manifest.txt', '/data', cache=cache)
+    """
+
+    # Commit every n cache updates so a crash doesn't lose everything, but we don't fsync for every file
+    COMMIT_INTERVAL = 1000
+
+    def __init__(self, path=None, backend="sqlite"):
+        # type: (Optional[str], str) -> None
+        if backend not in ["sqlite", "xattr"]:
+            raise ValueError("Unknown hash cache backend {}".format(backend))
+        if backend == "sqlite" and not path:
+            raise ValueError("sqlite hash cache needs a database path")
+        if backend == "xattr" and not hasattr(os, "setxattr"):
+            raise OSError("xattr hash cache backend is not available on this platform")
+        self.path = path
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._uncommitted = 0
+        self._db = None
+        if backend == "sqlite":
+            # Connection is shared between hashing threads, access is serialized by self._lock
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS hashes (device INTEGER, inode INTEGER, algorithm TEXT, "
+                "size INTEGER, mtime_ns INTEGER, ctime_ns INTEGER, digest TEXT, "
+                "PRIMARY KEY (device, inode, algorithm))"
+            )
+            # Subtree digests used by directory_digest(), with their children for change detection
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS directories (path BLOB, algorithm TEXT, device INTEGER, "
+                "inode INTEGER, mtime_ns INTEGER, ctime_ns INTEGER, digest TEXT, entries TEXT, "
+                "PRIMARY KEY (path, algorithm))"
+            )
+            self._db.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get(self, file, algorithm="sha256", stat=None):
+        # type: (str, str, Optional[os.stat_result]) -> Optional[str]
+        """
+        Returns cached digest of file if its metadata didn't change, None otherwise
+        """
+        if stat is None:
+            stat = os.stat(file)
+        digest = None
+        if self.backend == "sqlite":
+            with self._lock:
+                row = self._db.execute(
+                    "SELECT size, mtime_ns, ctime_ns, digest FROM hashes "
+                    "WHERE device = ? AND inode = ? AND algorithm = ?",
+                    (stat.st_dev, stat.st_ino, algorithm),
+                ).fetchone()
+            if row and tuple(row[:3]) == (
+                stat.st_size,
+                stat.st_mtime_ns,
+                stat.st_ctime_ns,
+            ):
+                digest = row[3]
+        else:
+            try:
+                value = os.getxattr(file, "user.ofunctions." + algorithm).decode(
+                    "ascii"
+                )
+                size, mtime_ns, cached_digest = value.split(":")
+                if (int(size), int(mtime_ns)) == (stat.st_size, stat.st_mtime_ns):
+                    digest = cached_digest
+            except (OSError, ValueError, UnicodeDecodeError):
+                pass
+        with self._lock:
+            if digest:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return digest
+
+    def set(self, file, digest, algorithm="sha256", stat=None):
+        # type: (str, str, str, Optional[os.stat_result]) -> None
+        """
+        Stores digest of file
+        When stat is given, it must be the file stat before hashing, so files modified while being hashed
+        don't get cached
+        """
+        current_stat = os.stat(file)
+        if stat is not None and (
+            stat.st_size,
+            stat.st_mtime_ns,
+            stat.st_ctime_ns,
+        ) != (current_stat.st_size, current_stat.st_mtime_ns, current_stat.st_ctime_ns):
+            logger.debug(
+                'File "{}" changed while being hashed, not caching'.format(file)
+            )
+            return
+        if self.backend == "sqlite":
+            with self._lock:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        current_stat.st_dev,
+                        current_stat.st_ino,
+                        algorithm,
+                        current_stat.st_size,
+                        current_stat.st_mtime_ns,
+                        current_stat.st_ctime_ns,
+                        digest,
+                    ),
+                )
+                self._uncommitted += 1
+                if self._uncommitted >= self.COMMIT_INTERVAL:
+                    self._db.commit()
+                    self._uncommitted = 0
+        else:
+            try:
+                os.setxattr(
+                    file,
+                    "user.ofunctions." + algorithm,
+                    "{}:{}:{}".format(
+                        current_stat.st_size, current_stat.st_mtime_ns, digest
+                    ).encode("ascii"),
+                )
+            except OSError as exc:
+                logger.debug('Cannot store hash in xattr of "{}": {}'.format(file, exc))
+
+    def get_directory(self, path, algorithm="sha256"):
+        # type: (str, str) -> Optional[Tuple[tuple, str, list]]
+        """
+        Returns ((device, inode, mtime_ns, ctime_ns), digest, entries) of a cached directory, or None
+        """
+        if self._db is None:
+            return None
+        with self._lock:
+            row = self._db.execute(
+                "SELECT device, inode, mtime_ns, ctime_ns, digest, entries FROM directories "
+                "WHERE path = ? AND algorithm = ?",
+                (os.fsencode(path), algorithm),
+            ).fetchone()
+        if not row:
+            return None
+        return tuple(row[:4]), row[4], json.loads(row[5])
+
+    def set_directory(self, path, digest, entries, algorithm="sha256", stat=None):
+        # type: (str, str, list, str, Optional[os.stat_result]) -> None
+        """
+        Stores digest and [type, name, digest] entries of a directory
+        """
+        if self._db is None:
+            return
+        if stat is None:
+            stat = os.stat(path)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO directories VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    os.fsencode(path),
+                    algorithm,
+                    stat.st_dev,
+                    stat.st_ino,
+                    stat.st_mtime_ns,
+                    stat.st_ctime_ns,
+                    digest,
+                    json.dumps(entries),
+                ),
+            )
+            self._uncommitted += 1
+            if self._uncommitted >= self.COMMIT_INTERVAL:
+                self._db.commit()
+                self._uncommitted = 0
+
+    def commit(self):
+        # type: () -> None
+        if self._db is not None:
+            with self._lock:
+                self._db.commit()
+                self._uncommitted = 0
+
+    def close(self):
+        # type: () -> None
+        if self._db is not None:
+            self.commit()
+            self._db.close()
+            self._db = None
+
+
+def _open_cache(cache):
+    # type: (Optional[Union[HashCache, str]]) -> Tuple[Optional[HashCache], bool]
+    """
+    Returns a HashCache instance from a HashCache or a sqlite database path, and whether we own it
+    """
+    if cache is None or isinstance(cache, HashCache):
+        return cache, False
+    return HashCache(cache), True
+
+
+def sha256sum(
+    file,  # type: str
+    sparse=False,  # type: bool
+    cache=None,  # type: Optional[HashCache]
+    paranoid=False,  # type: bool
+    block_size=None,  # type: Optional[int]
+    use_mmap=False,  # type: bool
+    nocache=False,  # type: bool
+    bandwidth_limit=None,  # type: Optional[Union[BandwidthLimiter, int]]
+):
+    # type: (...) -> str
     """
     Returns the sha256 sum of a file
 
     :param file: (str) path to file
+    :param sparse: (bool) don't read holes of sparse files from disk, feed zeros to the digest instead
+    :param cache: (HashCache) optional cache which digest is reused when file metadata didn't change
+    :param paranoid: (bool) always rehash file, even if cache has a digest for it, and update the cache
+    :param block_size: (int) read block size, defaults to BLOCK_SIZE
+    :param use_mmap: (bool) mmap files bigger than MMAP_THRESHOLD instead of reading them
+    :param nocache: (bool) don't pollute page cache, see _hash_file()
+    :param bandwidth_limit: (BandwidthLimiter/int) max read throughput in bytes per second
     :return: (str) checksum
     """
-    sha256 = hashlib.sha256()
+    return hash_file(
+        file,
+        "sha256",
+        sparse=sparse,
+        cache=cache,
+        paranoid=paranoid,
+        block_size=block_size,
+        use_mmap=use_mmap,
+        nocache=nocache,
+        bandwidth_limit=bandwidth_limit,
+    )
+
+
+def hash_file(
+    file,  # type: str
+    algorithms="sha256",  # type: Union[str, Iterable[str]]
+    sparse=False,  # type: bool
+    cache=None,  # type: Optional[HashCache]
+    paranoid=False,  # type: bool
+    block_size=None,  # type: Optional[int]
+    use_mmap=False,  # type: bool
+    nocache=False,  # type: bool
+    bandwidth_limit=None,  # type: Optional[Union[BandwidthLimiter, int]]
+):
+    # type: (...) -> Union[str, dict]
+    """
+    Returns digests of a file for one or more registered hash algorithms, reading the file only once
+
+    Example:
+    hash_file('/tmp/file', ['sha256', 'md5', 'xxh64'])
+    -> {'sha256': '...', 'md5': '...', 'xxh64': '...'}
+
+    :param file: (str) path to file
+    :param algorithms: (str/list) algorithm name, or list of algorithm names, see get_hash_algorithms()
+    :param sparse: (bool) don't read holes of sparse files from disk, feed zeros to the digest instead
+    :param cache: (HashCache) optional cache which digests are reused when file metadata didn't change
+    :param paranoid: (bool) always rehash file, even if cache has digests for it, and update the cache
+    :param block_size: (int) read block size, defaults to BLOCK_SIZE
+    :param use_mmap: (bool) mmap files bigger than MMAP_THRESHOLD instead of reading them
+    :param nocache: (bool) don't pollute page cache, see _hash_file()
+    :param bandwidth_limit: (BandwidthLimiter/int) max read throughput in bytes per second
+    :return: (str/dict) digest if a single algorithm name was given, else dict of {algorithm: digest}
+    """
+    single_algorithm = isinstance(algorithms, str)
+    if single_algorithm:
+        algorithms = [algorithms]
+    algorithms = [algorithm.lower() for algorithm in algorithms]
+    hashers = {algorithm: _new_hasher(algorithm) for algorithm in algorithms}
+    digests = {}
 
     try:
-        with open(file, "rb") as file_handle:
-            while True:
-                data = file_handle.read(65536)
-                if not data:
-                    break
-                sha256.update(data)
-        return sha256.hexdigest()
-    except IOError as exc:
-        raise IOError('Cannot create SHA256 sum for file "%s": %s' % (file, exc))
+        stat = os.stat(file) if cache is not None else None
+        if cache is not None and not paranoid:
+            for algorithm in algorithms:
+                digest = cache.get(file, algorithm, stat)
+                if digest:
+                    digests[algorithm] = digest
+                    del hashers[algorithm]
+        if hashers:
+            _hash_file(
+                file,
+                list(hashers.values()),
+                block_size=block_size,
+                sparse=sparse,
+                use_mmap=use_mmap,
+                nocache=nocache,
+                bandwidth_limit=_open_limiter(bandwidth_limit),
+            )
+    except (IOError, OSError) as exc:
+        raise IOError(
+            'Cannot create {} sum for file "{}": {}'.format(
+                ", ".join(algorithms), file, exc
+            )
+        )
+    for algorithm, hasher in hashers.items():
+        digests[algorithm] = hasher.hexdigest()
+        if cache is not None:
+            cache.set(file, digests[algorithm], algorithm, stat)
+
+    if single_algorithm:
+        return digests[algorithms[0]]
+    return digests
+
+
+def _iter_stream_blocks(source, block_size):
+    # type: (Any, int) -> Iterable[Any]
+    """
+    Yields data blocks from a readable object, socket like object, bytes like object or iterator of bytes
+    Blocks read with readinto() / recv_into() share the same per thread buffer, and are only valid
+    until next block is read
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        yield source
+        return
+    if hasattr(source, "readinto") or hasattr(source, "recv_into"):
+        read_into = getattr(source, "readinto", None) or source.recv_into
+        buffer = _get_buffer(block_size)
+        while True:
+            read_bytes = read_into(buffer)
+            if not read_bytes:
+                # readinto() returns None on non blocking objects without data, which we treat as end of stream
+                break
+            yield buffer[:read_bytes]
+    elif hasattr(source, "read"):
+        while True:
+            data = source.read(block_size)
+            if not data:
+                break
+            yield data
+    else:
+        for data in source:
+            if data:
+                yield data
 
 
-def check_file_hash(file, hashsum):
-    # type: (str, str) -> bool
+def hash_stream(
+    source,  # type: Any
+    algorithms="sha256",  # type: Union[str, Iterable[str]]
+    tee=None,  # type: Optional[Any]
+    progress_callback=None,  # type: Optional[Callable]
+    block_size=None,  # type: Optional[int]
+    progress_interval=1.0,  # type: float
+):
+    # type: (...) -> Union[str, dict]
+    """
+    Hashes a stream without keeping it in memory, optionally writing the data to a destination at the same time
+
+    Example, hashing a download while saving it:
+    response = requests.get(url, stream=True)
+    with open('/tmp/file', 'wb') as fp:
+        digest = hash_stream(response.iter_content(BLOCK_SIZE), tee=fp,
+                             progress_callback=lambda done, speed: print(done, speed))
+
+    :param source: file like object with readinto() or read(), socket like object with recv_into(),
+                   bytes like object or iterable of bytes
+    :param algorithms: (str/list) algorithm name, or list of algorithm names, see get_hash_algorithms()
+    :param tee: file like object with a write() method, or callable, which receives every data block
+                Sockets have no write() method, give their sendall method as callable instead
+                write() methods get views of a reused buffer, while callables get bytes copies
+                they may keep references to
+    :param progress_callback: (callable) called with (bytes_read, bytes_per_second) every progress_interval
+                              seconds, and once at end of stream
+    :param block_size: (int) read block size, defaults to BLOCK_SIZE
+    :param progress_interval: (float) minimal interval in seconds between progress_callback calls
+    :return: (str/dict) digest if a single algorithm name was given, else dict of {algorithm: digest}
+    """
+    single_algorithm = isinstance(algorithms, str)
+    if single_algorithm:
+        algorithms = [algorithms]
+    algorithms = [algorithm.lower() for algorithm in algorithms]
+    hashers = [_new_hasher(algorithm) for algorithm in algorithms]
+    # write() methods consume data immediately, so they can get views of our reused buffer
+    # while callables may keep references to the data blocks they're given (list, queue...)
+    copy_blocks = tee is not None and callable(tee)
+    if tee is not None and not callable(tee):
+        tee = tee.write
+
+    total_bytes = 0
+    start_time = last_progress = time.monotonic()
+    for data in _iter_stream_blocks(source, block_size or BLOCK_SIZE):
+        for hasher in hashers:
+            hasher.update(data)
+        if tee is not None:
+            tee(bytes(data) if copy_blocks and isinstance(data, memoryview) else data)
+        total_bytes += len(data)
+        if progress_callback is not None:
+            now = time.monotonic()
+            if now - last_progress >= progress_interval:
+                last_progress = now
+                progress_callback(
+                    total_bytes, total_bytes / max(now - start_time, 1e-9)
+                )
+    if progress_callback is not None:
+        progress_callback(
+            total_bytes, total_bytes / max(time.monotonic() - start_time, 1e-9)
+        )
+
+    digests = {
+        algorithm: hasher.hexdigest() for algorithm, hasher in zip(algorithms, hashers)
+    }
+    if single_algorithm:
+        return digests[algorithms[0]]
+    return digests
+
+
+def check_file_hash(file, hashsum, algorithm="sha256"):
+    # type: (str, str, str) -> bool
     """
     Checks a file against given sha256sum
 
     :param file: (str) path to file
     :param hashsum: (str) sha256 sum
+    :param algorithm: (str) optional hash algorithm if hashsum isn't a sha256 sum
     :return: (bool)
     """
 
     hashsum = hashsum.lower()
     if os.path.isfile(file):
-        calculated_hashsum = sha256sum(file).lower()
+        calculated_hashsum = hash_file(file, algorithm).lower()
         if hashsum == calculated_hashsum:
             return True
 
         raise ValueError(
-            'File "%s" has an invalid sha256sum "%s". Reference sum is "%s".'
-            % (file, calculated_hashsum, hashsum)
+            'File "%s" has an invalid %s sum "%s". Reference sum is "%s".'
+            % (file, algorithm, calculated_hashsum, hashsum)
         )
 
     return False
 
 
-def create_sha256sum_file(directory, sumfile="SHA256SUMS.TXT", depth=1):
-    # type: (str, str, int) -> None
+def hash_files_ordered(files, hash_fn=sha256sum, workers=1, max_pending=None):
+    # type: (Iterable[str], Callable, int, Optional[int]) -> Iterable[tuple]
+    """
+    Hashes files concurrently and yields (file, checksum) tuples in the same order as files
+    hashlib releases the GIL while hashing big buffers, so threads can use multiple cores
+
+    Results are kept in a reorder buffer of at most max_pending entries, so memory usage stays bounded
+    regardless of the number of files, and a slow file only delays output, not the other workers
+
+    :param files: (iterable) file paths
+    :param hash_fn: (callable) function returning the checksum of a file path
+    :param workers: (int) number of concurrent hashing threads, 1 hashes in current thread
+    :param max_pending: (int) maximum number of files being hashed or waiting to be yielded,
+                        defaults to 4 times the number of workers
+    :return: iterator of (file, checksum) tuples
+    """
+    if workers is None or workers <= 1:
+        for file in files:
+            yield file, hash_fn(file)
+        return
+
+    if not max_pending:
+        max_pending = workers * 4
+    pending = deque()
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        for file in files:
+            pending.append((file, executor.submit(hash_fn, file)))
+            if len(pending) >= max_pending:
+                file, future = pending.popleft()
+                yield file, future.result()
+        while pending:
+            file, future = pending.popleft()
+            yield file, future.result()
+    finally:
+        # Don't keep hashing files nobody will read results of
+        for _, future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+
+def create_sha256sum_file(
+    directory,  # type: str
+    sumfile="SHA256SUMS.TXT",  # type: str
+    depth=1,  # type: int
+    workers=1,  # type: int
+    cache=None,  # type: Optional[Union[HashCache, str]]
+    paranoid=False,  # type: bool
+    algorithm="sha256",  # type: str
+    nocache=False,  # type: bool
+    bandwidth_limit=None,  # type: Optional[Union[BandwidthLimiter, int]]
+):
+    # type: (...) -> None
     """
     Create a checksum file for a given directory
     This function creates the file on the fly because we yield results
@@ -102,66 +870,120 @@ def create_sha256sum_file(directory, sumfile="SHA256SUMS.TXT", depth=1):
     :param directory: (str) path to the directory to create the sumfile for
     :param sumfile: (str) alternative sumfile name
     :param depth: (int) recursivity depth, 0 = infinite
+    :param workers: (int) number of files to hash concurrently
+    :param cache: (HashCache/str) optional hash cache or sqlite cache path, so unchanged files aren't rehashed
+    :param paranoid: (bool) rehash all files even if cached
+    :param algorithm: (str) hash algorithm, see get_hash_algorithms(), recorded in sum file header
+    :param nocache: (bool) don't pollute page cache while hashing, see _hash_file()
+    :param bandwidth_limit: (BandwidthLimiter/int) max total read throughput of all workers in bytes per second
     :return:
     """
 
     directory = os.path.normpath(directory)
+    _new_hasher(algorithm)
     files = get_paths_recursive(directory, exclude_dirs=True, max_depth=depth)
+    cache, own_cache = _open_cache(cache)
+    hash_fn = partial(
+        hash_file,
+        algorithms=algorithm,
+        cache=cache,
+        paranoid=paranoid,
+        nocache=nocache,
+        # Single limiter shared by all workers
+        bandwidth_limit=_open_limiter(bandwidth_limit),
+    )
     try:
         sumfile = os.path.join(directory, sumfile)
         with open(sumfile, "w", encoding="utf-8") as file_handle:
             # python 2.7 compat 'u' replaced by unicode_literals
-            file_content = "# Generated on %s UTC\n\n" % datetime.utcnow()
+            file_content = "# Generated on %s UTC\n%s%s\n\n" % (
+                datetime.utcnow(),
+                MANIFEST_ALGORITHM_HEADER,
+                algorithm.lower(),
+            )
             file_handle.write(file_content)
 
             def _get_file_sum(files):
-                for file in files:
-                    if file != sumfile:
-                        sha256 = sha256sum(file)
-                        yield "{}  {}\n".format(
-                            sha256, os.path.relpath(file, directory)
-                        )
+                for file, sha256 in hash_files_ordered(
+                    (file for file in files if file != sumfile),
+                    hash_fn=hash_fn,
+                    workers=workers,
+                ):
+                    yield _format_manifest_line(
+                        sha256, os.path.relpath(file, directory)
+                    )
 
+            # Output is buffered and flushed once when file gets closed
             for line in _get_file_sum(files):
                 if sys.version_info[0] < 3:
                     file_handle.write(line.decode("unicode-escape"))
                 else:
                     file_handle.write(line)
-                file_handle.flush()
     except (IOError, OSError):
         raise OSError('Cannot create sum file in "%s".' % directory)
+    finally:
+        if own_cache:
+            cache.close()
 
 
-def create_manifest_from_dict(manifest_file, manifest_dict):
-    # type: (str, dict) -> None
+def create_manifest_from_dict(manifest_file, manifest_dict, algorithm=None):
+    # type: (str, dict, Optional[str]) -> None
     """
     Creates a manifest file in the way sha256sum would do under linux
 
     :param manifest_file: Target file for manifest
     :param manifest_dict: Manifest dict like {sha256sum : filename}
+    :param algorithm: Optional hash algorithm name to record in manifest header
     :return:
     """
     try:
         with open(manifest_file, "w", encoding="utf-8") as file_handle:
+            if algorithm:
+                file_handle.write(
+                    "{}{}\n".format(MANIFEST_ALGORITHM_HEADER, algorithm.lower())
+                )
             for key, value in manifest_dict.items():
-                # python 2.7 compat 'u' replaced by unicode_literals
-                content = "{}  {}\n".format(key, value)
-                file_handle.write(content)
+                file_handle.write(_format_manifest_line(key, value))
     except IOError as exc:
         raise IOError('Cannot write manifest file "%s": %s' % (manifest_file, exc))
 
 
+def _skip_file(files, skipped_file):
+    # type: (Iterable[str], str) -> Iterable[str]
+    """
+    Filters out skipped_file from paths, even when reached through another path
+    Other files with the same name are kept
+    """
+    skipped_path = os.path.realpath(skipped_file)
+    skipped_name = os.path.basename(skipped_path)
+    for file in files:
+        if (
+            os.path.basename(file) == skipped_name
+            and os.path.realpath(file) == skipped_path
+        ):
+            continue
+        yield file
+
+
 def create_manifest_from_dir(
     manifest_file,  # type: str
     path,  # type: str
     remove_prefixes=None,  # type: list
     f_exclude_list=None,  # type: list
     d_exclude_list=None,  # type: list
+    workers=1,  # type: int
+    cache=None,  # type: Optional[Union[HashCache, str]]
+    paranoid=False,  # type: bool
+    algorithm="sha256",  # type: str
+    nocache=False,  # type: bool
+    bandwidth_limit=None,  # type: Optional[Union[BandwidthLimiter, int]]
 ):
     # type: (...) -> None
     """
     Creates a bash like file manifest with sha256sum and filenames
     Just like create_sha256sum_file() except we keep full paths and may remove prefixes
+    Manifest lines keep directory walk order regardless of the number of workers
+    The manifest file itself is never listed, even when written inside path
 
 
     :param manifest_file: path of resulting manifest file
@@ -169,23 +991,2084 @@ def create_manifest_from_dir(
     :param remove_prefixes: optional path prefix to remove from files in manifest
     :param f_exclude_list: optional file exclude list
     :param d_exclude_list: optional directory exclude list
+    :param workers: optional number of files to hash concurrently
+    :param cache: optional HashCache or sqlite cache path, so unchanged files aren't rehashed
+    :param paranoid: rehash all files even if cached
+    :param algorithm: hash algorithm, see get_hash_algorithms(), recorded in manifest header
+    :param nocache: don't pollute page cache while hashing, see _hash_file()
+    :param bandwidth_limit: max total read throughput of all workers in bytes per second, or BandwidthLimiter
     :return:
     """
     if not os.path.isdir(path):
         raise NotADirectoryError("Path [%s] does not exist." % path)
+    _new_hasher(algorithm)
+
+    files = _skip_file(
+        get_paths_recursive(
+            path,
+            f_exclude_list=f_exclude_list,
+            d_exclude_list=d_exclude_list,
+            exclude_dirs=True,
+        ),
+        manifest_file,
+    )
+    cache, own_cache = _open_cache(cache)
+    hash_fn = partial(
+        hash_file,
+        algorithms=algorithm,
+        cache=cache,
+        paranoid=paranoid,
+        nocache=nocache,
+        # Single limiter shared by all workers
+        bandwidth_limit=_open_limiter(bandwidth_limit),
+    )
+    try:
+        with open(manifest_file, "w", encoding="utf-8") as file_handle:
+            file_handle.write(
+                "{}{}\n".format(MANIFEST_ALGORITHM_HEADER, algorithm.lower())
+            )
+            for file, sha256 in hash_files_ordered(
+                files, hash_fn=hash_fn, workers=workers
+            ):
+                for prefix in remove_prefixes if remove_prefixes is not None else []:
+                    if file.startswith(prefix):
+                        file = file[len(prefix) :].lstrip(os.sep)
+                file_handle.write(_format_manifest_line(sha256, file))
+    finally:
+        if own_cache:
+            cache.close()
+
+
+def _unescape_manifest_path(path):
+    # type: (str) -> str
+    """
+    sha256sum escapes backslashes and newlines in filenames, and prefixes such lines with a backslash
+    """
+    result = []
+    index = 0
+    while index < len(path):
+        char = path[index]
+        if char == "\\" and index + 1 < len(path):
+            next_char = path[index + 1]
+            result.append("\n" if next_char == "n" else next_char)
+            index += 2
+            continue
+        result.append(char)
+        index += 1
+    return "".join(result)
+
+
+def _format_manifest_line(digest, path):
+    # type: (str, str) -> str
+    """
+    Formats a manifest line like sha256sum does, escaping backslashes and newlines in filenames
+    """
+    if "\\" in path or "\n" in path:
+        return "\\{}  {}\n".format(
+            digest, path.replace("\\", "\\\\").replace("\n", "\\n")
+        )
+    return "{}  {}\n".format(digest, path)
+
+
+def read_manifest(manifest_file):
+    # type: (str) -> Iterable[Tuple[str, str]]
+    """
+    Streams a sha256sum like manifest file, yielding (digest, path) tuples
+    Comment lines and empty lines are skipped, binary mode markers and escaped filenames are handled
+
+    :param manifest_file: (str) path to manifest file
+    :return: iterator of (digest, path) tuples
+    """
+    with open(manifest_file, "r", encoding="utf-8") as file_handle:
+        for line in file_handle:
+            line = line.rstrip("\r\n")
+            if not line or line.startswith("#"):
+                continue
+            escaped = line.startswith("\\")
+            if escaped:
+                line = line[1:]
+            try:
+                digest, path = line.split(" ", 1)
+            except ValueError:
+                logger.warning(
+                    'Improperly formatted line in manifest "{}": {}'.format(
+                        manifest_file, line
+                    )
+                )
+                continue
+            # Second char is a space in text mode, an asterisk in binary mode
+            path = path[1:] if path[:1] in (" ", "*") else path
+            if escaped:
+                path = _unescape_manifest_path(path)
+            yield digest.lower(), path
+
+
+def get_manifest_algorithm(manifest_file):
+    # type: (str) -> str
+    """
+    Returns the hash algorithm of a manifest from its header
+    Manifests without header are guessed from their digest length, like sha256sum / md5sum files
+
+    :param manifest_file: (str) path to manifest file
+    :return: (str) algorithm name
+    """
+    with open(manifest_file, "r", encoding="utf-8") as file_handle:
+        for line in file_handle:
+            if line.startswith(MANIFEST_ALGORITHM_HEADER):
+                return line[len(MANIFEST_ALGORITHM_HEADER) :].strip().lower()
+            if line.strip() and not line.startswith("#"):
+                break
+    for digest, _ in read_manifest(manifest_file):
+        return {32: "md5", 40: "sha1", 56: "sha224", 96: "sha384", 128: "sha512"}.get(
+            len(digest), "sha256"
+        )
+    return "sha256"
+
+
+def _check_manifest_entry_metadata(full_path, digest, empty_digest):
+    # type: (str, str, str) -> Tuple[Optional[Tuple[str, str]], Optional[os.stat_result]]
+    """
+    Checks a manifest entry without reading it
+    Returns ((status, report category), None) for missing, unreadable or obviously broken files
+    (empty files with a non empty file digest and vice versa), else (None, stat)
+    """
+    try:
+        stat = os.stat(full_path)
+    except FileNotFoundError:
+        return ("MISSING", "missing"), None
+    except OSError:
+        return ("UNREADABLE", "unreadable"), None
+    if not os.path.isfile(full_path) or not os.access(full_path, os.R_OK):
+        return ("UNREADABLE", "unreadable"), None
+    if (stat.st_size == 0) != (digest == empty_digest):
+        return ("FAILED", "mismatched"), None
+    return None, stat
+
+
+def verify_manifest(
+    manifest_file,  # type: str
+    root=None,  # type: Optional[str]
+    workers=1,  # type: int
+    fail_fast=False,  # type: bool
+    check_extra=False,  # type: bool
+    algorithm=None,  # type: Optional[str]
+    fn_on_result=None,  # type: Optional[Callable]
+    block_size=None,  # type: Optional[int]
+    nocache=False,  # type: bool
+    bandwidth_limit=None,  # type: Optional[Union[BandwidthLimiter, int]]
+):
+    # type: (...) -> dict
+    """
+    Verifies files against a sha256sum like manifest, on a pool of workers
+
+    The manifest is streamed twice:
+    - a first metadata pass stats every entry and flags missing, unreadable or obviously broken files
+      (empty files with a non empty file digest and vice versa) before reading any file content
+    - a second pass hashes remaining files concurrently
+
+    Example:
+    result = verify_manifest('/backup/MANIFEST', '/backup', workers=8)
+    if not result['success']:
+        print(result['mismatched'], result['missing'])
+
+    :param manifest_file: (str) path to manifest file
+    :param root: (str) directory relative paths in manifest refer to, defaults to manifest directory
+    :param workers: (int) number of concurrent hashing threads
+    :param fail_fast: (bool) stop on first problem
+    :param check_extra: (bool) also report files in root that aren't in manifest
+                        (keeps all manifest paths in memory)
+    :param algorithm: (str) hash algorithm, read from manifest header when not given
+    :param fn_on_result: (callable) optional function called with (path, status) for every entry,
+                         status being OK, FAILED, MISSING, UNREADABLE or EXTRA
+    :param block_size: (int) read block size, defaults to BLOCK_SIZE
+    :param nocache: (bool) don't pollute page cache while hashing, see _hash_file()
+    :param bandwidth_limit: (BandwidthLimiter/int) max total read throughput of all workers in bytes per second
+    :return: (dict) verification report with lists of problematic paths, counters and throughput
+    """
+    start_time = time.monotonic()
+    if root is None:
+        root = os.path.dirname(os.path.abspath(manifest_file))
+    if algorithm is None:
+        algorithm = get_manifest_algorithm(manifest_file)
+    empty_digest = _new_hasher(algorithm).hexdigest()
+    report = {
+        "algorithm": algorithm,
+        "total": 0,
+        "ok": 0,
+        "missing": [],
+        "mismatched": [],
+        "unreadable": [],
+        "extra": [],
+        "bytes": 0,
+        "elapsed": 0,
+        "throughput": 0,
+        "success": False,
+    }
+    # Paths flagged by the metadata pass, they won't be hashed
+    flagged = set()
+
+    def _flag(path, status, category):
+        flagged.add(path)
+        report[category].append(path)
+        if fn_on_result is not None:
+            fn_on_result(path, status)
+
+    def _finish():
+        report["elapsed"] = time.monotonic() - start_time
+        if report["elapsed"] > 0:
+            report["throughput"] = report["bytes"] / report["elapsed"]
+        report["success"] = not (
+            report["missing"]
+            or report["mismatched"]
+            or report["unreadable"]
+            or report["extra"]
+        )
+        return report
+
+    # Metadata pass
+    manifest_paths = set() if check_extra else None
+    for digest, path in read_manifest(manifest_file):
+        report["total"] += 1
+        full_path = os.path.join(root, path)
+        if manifest_paths is not None:
+            manifest_paths.add(os.path.normcase(os.path.abspath(full_path)))
+        problem, _ = _check_manifest_entry_metadata(full_path, digest, empty_digest)
+        if problem:
+            _flag(path, *problem)
+        if fail_fast and flagged:
+            return _finish()
+
+    bandwidth_limit = _open_limiter(bandwidth_limit)
+
+    def _hash(entry):
+        # type: (tuple) -> Tuple[Optional[str], int]
+        hasher = _new_hasher(algorithm)
+        try:
+            size = _hash_file(
+                os.path.join(root, entry[1]),
+                [hasher],
+                block_size,
+                nocache=nocache,
+                bandwidth_limit=bandwidth_limit,
+            )
+        except (IOError, OSError):
+            return None, 0
+        return hasher.hexdigest(), size
+
+    # Content pass
+    entries = (
+        entry for entry in read_manifest(manifest_file) if entry[1] not in flagged
+    )
+    for (digest, path), (calculated_digest, size) in hash_files_ordered(
+        entries, hash_fn=_hash, workers=workers
+    ):
+        report["bytes"] += size
+        if calculated_digest is None:
+            _flag(path, "UNREADABLE", "unreadable")
+        elif calculated_digest != digest:
+            _flag(path, "FAILED", "mismatched")
+        else:
+            report["ok"] += 1
+            if fn_on_result is not None:
+                fn_on_result(path, "OK")
+        if fail_fast and flagged:
+            return _finish()
+
+    if manifest_paths is not None:
+        manifest_abspath = os.path.normcase(os.path.abspath(manifest_file))
+        for file in get_paths_recursive(root, exclude_dirs=True):
+            normalized_file = os.path.normcase(os.path.abspath(file))
+            if (
+                normalized_file not in manifest_paths
+                and normalized_file != manifest_abspath
+            ):
+                path = os.path.relpath(file, root)
+                report["extra"].append(path)
+                if fn_on_result is not None:
+                    fn_on_result(path, "EXTRA")
+                if fail_fast:
+                    break
+    return _finish()
+
+
+# Merkle trees hash files by fixed size chunks, stored in json sidecar files next to hashed files
+MERKLE_CHUNK_SIZE = 4194304
+MERKLE_SIDECAR_EXTENSION = ".merkle"
+
+
+def _read_chunk(file, fd, offset, size):
+    # type: (str, int, int, int) -> memoryview
+    """
+    Reads a chunk at offset into the per thread buffer without moving shared file offset
+    """
+    buffer = _get_buffer(size)
+    if hasattr(os, "preadv"):
+        read_bytes = os.preadv(fd, [buffer], offset)
+        return buffer[:read_bytes]
+    # Windows has no positional reads, and duplicated descriptors share their offset,
+    # so every read reopens the file to get a private offset
+    with open(file, "rb", buffering=0) as file_handle:
+        file_handle.seek(offset)
+        read_bytes = file_handle.readinto(buffer)
+    return buffer[: read_bytes or 0]
+
+
+def _merkle_leaf(algorithm, data):
+    # type: (str, Any) -> bytes
+    # Leaves and nodes use different prefixes so a node can never be passed off as a leaf
+    hasher = _new_hasher(algorithm)
+    hasher.update(b"\x00")
+    hasher.update(data)
+    return hasher.digest()
+
+
+def _merkle_root(algorithm, leaves):
+    # type: (str, List[bytes]) -> bytes
+    level = leaves
+    while len(level) > 1:
+        next_level = []
+        for index in range(0, len(level) - 1, 2):
+            hasher = _new_hasher(algorithm)
+            hasher.update(b"\x01")
+            hasher.update(level[index])
+            hasher.update(level[index + 1])
+            next_level.append(hasher.digest())
+        if len(level) % 2:
+            # Odd node gets promoted to next level
+            next_level.append(level[-1])
+        level = next_level
+    return level[0]
+
+
+def _hash_chunks(file, algorithm, chunk_size, indexes, workers):
+    # type: (str, str, int, Iterable[int], int) -> Iterable[Tuple[int, bytes]]
+    """
+    Yields (index, leaf digest) of given chunk indexes, hashed concurrently
+    """
+    with open(file, "rb", buffering=0) as file_handle:
+        fd = file_handle.fileno()
+
+        def _hash_chunk(index):
+            return _merkle_leaf(
+                algorithm, _read_chunk(file, fd, index * chunk_size, chunk_size)
+            )
+
+        for index, leaf in hash_files_ordered(
+            indexes, hash_fn=_hash_chunk, workers=workers
+        ):
+            yield index, leaf
+
+
+def create_merkle_tree(
+    file,  # type: str
+    chunk_size=MERKLE_CHUNK_SIZE,  # type: int
+    algorithm="sha256",  # type: str
+    workers=1,  # type: int
+    tree_file=None,  # type: Optional[str]
+    file_algorithm=None,  # type: Optional[str]
+):
+    # type: (...) -> dict
+    """
+    Hashes a file by fixed size chunks concurrently, and combines chunk digests into a merkle tree
+    Leaf digests are kept so later verifications can check byte ranges, or update the tree by only
+    rehashing changed chunks
+    With file_algorithm, the whole file digest is also computed (one more sequential read) and stored,
+    which binds the tree to manifest entries, see quick_verify_manifest()
+
+    Example:
+    tree = create_merkle_tree('/vm/disk.img', workers=8, tree_file='/vm/disk.img' + MERKLE_SIDECAR_EXTENSION)
+    print(tree['root'])
+
+    :param file: (str) path to file
+    :param chunk_size: (int) chunk size in bytes
+    :param algorithm: (str) hash algorithm, see get_hash_algorithms()
+    :param workers: (int) number of chunks to hash concurrently
+    :param tree_file: (str) optional json sidecar file to store the tree in
+    :param file_algorithm: (str) optional hash algorithm of the whole file digest to store in the tree
+    :return: (dict) tree with algorithm, chunk_size, size, root digest and leaf digests, and
+                    file_algorithm and file_digest when file_algorithm is given
+    """
+    size = os.path.getsize(file)
+    chunks = max(1, -(-size // chunk_size))
+    leaves = [
+        leaf
+        for _, leaf in _hash_chunks(file, algorithm, chunk_size, range(chunks), workers)
+    ]
+    file_digest = None
+    if file_algorithm:
+        file_digest = hash_file(file, file_algorithm)
+    return _build_merkle_tree(
+        algorithm, chunk_size, size, leaves, tree_file, file_algorithm, file_digest
+    )
+
+
+def _build_merkle_tree(
+    algorithm,
+    chunk_size,
+    size,
+    leaves,
+    tree_file=None,
+    file_algorithm=None,
+    file_digest=None,
+):
+    # type: (str, int, int, List[bytes], Optional[str], Optional[str], Optional[str]) -> dict
+    tree = {
+        "algorithm": algorithm.lower(),
+        "chunk_size": chunk_size,
+        "size": size,
+        "root": _merkle_root(algorithm, leaves).hex(),
+        "leaves": [leaf.hex() for leaf in leaves],
+    }
+    if file_algorithm and file_digest:
+        tree["file_algorithm"] = file_algorithm.lower()
+        tree["file_digest"] = file_digest
+    if tree_file:
+        write_json_to_file(tree_file, tree)
+    return tree
+
+
+def load_merkle_tree(tree_file):
+    # type: (str) -> dict
+    """
+    Loads a merkle tree sidecar file created by create_merkle_tree()
+    """
+    tree = read_json_from_file(tree_file)
+    if not tree or not all(
+        key in tree for key in ["algorithm", "chunk_size", "size", "root", "leaves"]
+    ):
+        raise ValueError('File "{}" is not a merkle tree file.'.format(tree_file))
+    if (
+        _merkle_root(
+            tree["algorithm"], [bytes.fromhex(leaf) for leaf in tree["leaves"]]
+        ).hex()
+        != tree["root"]
+    ):
+        raise ValueError('Merkle tree file "{}" is corrupted.'.format(tree_file))
+    return tree
+
+
+def verify_merkle_range(
+    file,  # type: str
+    tree,  # type: Union[dict, str]
+    offset=0,  # type: int
+    length=None,  # type: Optional[int]
+    workers=1,  # type: int
+):
+    # type: (...) -> List[int]
+    """
+    Verifies a byte range of a file against its merkle tree, only reading chunks covering the range
+
+    :param file: (str) path to file
+    :param tree: (dict/str) tree from create_merkle_tree() or path to its sidecar file
+    :param offset: (int) start of range to verify
+    :param length: (int) length of range to verify, None means up to end of file
+    :param workers: (int) number of chunks to hash concurrently
+    :return: (list) indexes of chunks that don't match, empty list means range is valid
+    """
+    if not isinstance(tree, dict):
+        tree = load_merkle_tree(tree)
+    chunk_size = tree["chunk_size"]
+    if length is None:
+        length = max(tree["size"] - offset, 0)
+    first_chunk = offset // chunk_size
+    last_chunk = min(
+        (offset + max(length, 1) - 1) // chunk_size, len(tree["leaves"]) - 1
+    )
+    indexes = range(first_chunk, last_chunk + 1)
+
+    if os.path.getsize(file) != tree["size"]:
+        # Size changed, chunks from the last common one are invalid anyway
+        size_limit = min(os.path.getsize(file), tree["size"]) // chunk_size
+        indexes = [index for index in indexes if index < size_limit]
+        bad_chunks = [
+            index for index in range(first_chunk, last_chunk + 1) if index >= size_limit
+        ]
+    else:
+        bad_chunks = []
+    for index, leaf in _hash_chunks(
+        file, tree["algorithm"], chunk_size, indexes, workers
+    ):
+        if leaf.hex() != tree["leaves"][index]:
+            bad_chunks.append(index)
+    return sorted(bad_chunks)
+
+
+def update_merkle_tree(
+    file,  # type: str
+    tree,  # type: Union[dict, str]
+    changed_ranges=None,  # type: Optional[List[Tuple[int, int]]]
+    workers=1,  # type: int
+    tree_file=None,  # type: Optional[str]
+):
+    # type: (...) -> dict
+    """
+    Updates a merkle tree after a file has been modified, by only rehashing chunks covering changed ranges
+    Chunks past the previous end of file, and the previous last chunk, are always rehashed when size changed
+    Without changed_ranges, all chunks get rehashed
+    A whole file digest stored by create_merkle_tree() is dropped, since updating it needs a full read
+
+    :param file: (str) path to file
+    :param tree: (dict/str) tree from create_merkle_tree() or path to its sidecar file
+    :param changed_ranges: (list) list of (offset, length) tuples that were modified
+    :param workers: (int) number of chunks to hash concurrently
+    :param tree_file: (str) optional json sidecar file to store the updated tree in
+    :return: (dict) updated tree
+    """
+    if not isinstance(tree, dict):
+        tree = load_merkle_tree(tree)
+    algorithm = tree["algorithm"]
+    chunk_size = tree["chunk_size"]
+    size = os.path.getsize(file)
+    chunks = max(1, -(-size // chunk_size))
+    leaves = [bytes.fromhex(leaf) for leaf in tree["leaves"][:chunks]]
+
+    if changed_ranges is None:
+        indexes = set(range(chunks))
+    else:
+        indexes = set()
+        for offset, length in changed_ranges:
+            indexes.update(
+                range(
+                    offset // chunk_size,
+                    (offset + max(length, 1) - 1) // chunk_size + 1,
+                )
+            )
+        if size != tree["size"]:
+            # Previous last chunk, new chunks when growing, new partial last chunk when shrinking
+            indexes.update(
+                range(min(max(len(tree["leaves"]) - 1, 0), chunks - 1), chunks)
+            )
+        indexes = set(index for index in indexes if index < chunks)
+    leaves.extend([b""] * (chunks - len(leaves)))
+
+    for index, leaf in _hash_chunks(
+        file, algorithm, chunk_size, sorted(indexes), workers
+    ):
+        leaves[index] = leaf
+    return _build_merkle_tree(algorithm, chunk_size, size, leaves, tree_file)
+
+
+# Content defined chunking defaults, as in FastCDC paper
+CDC_MIN_SIZE = 2048
+CDC_AVG_SIZE = 8192
+CDC_MAX_SIZE = 65536
+CDC_READ_SIZE = 4194304
+# numpy segment size, benchmarked fastest as work arrays fit in L2 cache
+_CDC_NUMPY_SEGMENT = 16384
+
+# Deterministic gear table, chunk boundaries must never change between versions or chunk indexes become useless
+_CDC_GEAR = [
+    int.from_bytes(hashlib.sha256(bytes([index])).digest()[:8], "little")
+    for index in range(256)
+]
+_CDC_GEAR_NUMPY = []
+
+
+def _get_numpy_gear():
+    # type: () -> Optional[Any]
+    """
+    Returns gear table as numpy array, or None if numpy isn't installed
+    """
+    if not _CDC_GEAR_NUMPY:
+        try:
+            import numpy
+
+            _CDC_GEAR_NUMPY.append(numpy.array(_CDC_GEAR, dtype=numpy.uint64))
+        except ImportError:
+            _CDC_GEAR_NUMPY.append(None)
+    return _CDC_GEAR_NUMPY[0]
+
+
+def _cdc_candidates(data, mask_small, mask_large):
+    # type: (bytes, int, int) -> Tuple[List[int], List[int]]
+    """
+    Returns positions where the gear fingerprint matches small and large masks
+    Fingerprint is fp = (fp << 1) + gear[byte] on 64 bits, so it only depends on the last 64 bytes,
+    which allows computing it for every position independently
+    """
+    small = []
+    large = []
+    fingerprint = 0
+    gear = _CDC_GEAR
+    for position, byte in enumerate(data):
+        fingerprint = ((fingerprint << 1) + gear[byte]) & 0xFFFFFFFFFFFFFFFF
+        # Small mask has more bits than large mask
+        if not fingerprint & mask_large:
+            large.append(position)
+            if not fingerprint & mask_small:
+                small.append(position)
+    return small, large
+
+
+def _cdc_candidates_numpy(data, mask_small, mask_large):
+    # type: (bytes, int, int) -> Tuple[List[int], List[int]]
+    """
+    Vectorized _cdc_candidates(), giving identical results
+    Window sums of gear values are built by doubling: fp_2w[i] = fp_w[i] + (fp_w[i - w] << w)
+    Data is processed in small segments (overlapping by 63 bytes) so work arrays stay in CPU cache
+    """
+    import numpy
+
+    gear = _get_numpy_gear()
+    data = numpy.frombuffer(data, dtype=numpy.uint8)
+    length = len(data)
+    fingerprints = numpy.empty(_CDC_NUMPY_SEGMENT + 63, dtype=numpy.uint64)
+    work = numpy.empty(_CDC_NUMPY_SEGMENT + 63, dtype=numpy.uint64)
+    mask_small = numpy.uint64(mask_small)
+    mask_large = numpy.uint64(mask_large)
+    small = []
+    large = []
+    for start in range(0, length, _CDC_NUMPY_SEGMENT):
+        window_start = max(start - 63, 0)
+        end = min(start + _CDC_NUMPY_SEGMENT, length)
+        size = end - window_start
+        segment = fingerprints[:size]
+        numpy.take(gear, data[window_start:end], out=segment)
+        width = 1
+        while width < 64:
+            numpy.left_shift(
+                segment[:-width], numpy.uint64(width), out=work[: size - width]
+            )
+            numpy.add(segment[width:], work[: size - width], out=segment[width:])
+            width *= 2
+        # First 63 fingerprints are only used as window for current segment
+        segment = segment[start - window_start :]
+        numpy.bitwise_and(segment, mask_large, out=work[: len(segment)])
+        segment_large = numpy.flatnonzero(work[: len(segment)] == 0)
+        segment_small = segment_large[(segment[segment_large] & mask_small) == 0]
+        large.extend((segment_large + start).tolist())
+        small.extend((segment_small + start).tolist())
+    return small, large
+
+
+def _cdc_cut_points(
+    small, large, length, min_size, avg_size, max_size, eof
+):  # type: (List[int], List[int], int, int, int, int, bool) -> List[int]
+    """
+    Returns chunk end offsets using FastCDC normalized chunking: before avg_size, a harder small mask is used,
+    after avg_size an easier large mask is used, and chunks are cut at max_size anyway
+    Chunks are only cut once max_size bytes are available, unless we reached end of file
+    """
+    cuts = []
+    start = 0
+    while start < length:
+        if not eof and length - start < max_size:
+            break
+        lowest = start + min_size - 1
+        normal = start + avg_size - 1
+        highest = min(start + max_size, length) - 1
+        cut = highest + 1
+        index = bisect_left(small, lowest)
+        if index < len(small) and small[index] < normal and small[index] <= highest:
+            cut = small[index] + 1
+        else:
+            index = bisect_left(large, max(normal, lowest))
+            if index < len(large) and large[index] <= highest:
+                cut = large[index] + 1
+        cuts.append(cut)
+        start = cut
+    return cuts
+
+
+def chunk_file(
+    file,  # type: str
+    min_size=CDC_MIN_SIZE,  # type: int
+    avg_size=CDC_AVG_SIZE,  # type: int
+    max_size=CDC_MAX_SIZE,  # type: int
+    use_numpy=None,  # type: Optional[bool]
+):
+    # type: (...) -> Iterable[Tuple[int, int, str]]
+    """
+    Splits a file into content defined chunks (FastCDC style gear rolling hash), so inserting or removing data
+    only changes chunks around the modification
+    Yields (offset, length, sha256sum) of every chunk
+
+    Boundaries are computed with numpy when installed, which is an order of magnitude faster than the
+    pure python implementation, both give identical chunks
+
+    :param file: (str) path to file
+    :param min_size: (int) minimal chunk size, at least 64 bytes
+    :param avg_size: (int) average chunk size, rounded down to a power of two
+    :param max_size: (int) maximal chunk size
+    :param use_numpy: (bool) force numpy usage, None means use numpy when available
+    :return: (generator) (offset, length, digest) tuples
+    """
+    if not 64 <= min_size <= avg_size <= max_size:
+        raise ValueError(
+            "Chunk sizes must satisfy 64 <= min_size <= avg_size <= max_size"
+        )
+    if use_numpy is None:
+        use_numpy = _get_numpy_gear() is not None
+    elif use_numpy and _get_numpy_gear() is None:
+        raise ImportError("numpy is not installed")
+    find_candidates = _cdc_candidates_numpy if use_numpy else _cdc_candidates
+
+    # Top aligned masks so every mask bit depends on a full 64 byte window
+    bits = avg_size.bit_length() - 1
+    mask_small = ((1 << (bits + 2)) - 1) << (64 - bits - 2)
+    mask_large = ((1 << (bits - 2)) - 1) << (64 - bits + 2)
+
+    # Absolute offset of data buffer in file
+    base = 0
+    data = b""
+    with open(file, "rb") as file_handle:
+        eof = False
+        while not eof:
+            read_data = file_handle.read(max(CDC_READ_SIZE, max_size))
+            eof = not read_data
+            data += read_data
+            if not eof and len(data) < max_size:
+                continue
+            # Buffer always starts at a chunk boundary, so fingerprints computed on it are the same as if
+            # the whole file was processed in one go
+            small, large = find_candidates(data, mask_small, mask_large)
+            view = memoryview(data)
+            offset = 0
+            for cut in _cdc_cut_points(
+                small, large, len(data), min_size, avg_size, max_size, eof
+            ):
+                yield base + offset, cut - offset, sha256sum_data(view[offset:cut])
+                offset = cut
+            view.release()
+            base += offset
+            data = data[offset:]
+
+
+class ChunkIndex(object):
+    """
+    Persistent index of known chunks, used to measure deduplication across files and file versions
+
+    Example:
+
+    with ChunkIndex('/var/cache/chunks.db') as index:
+        for version in ['/backup/disk.img.1', '/backup/disk.img.2']:
+            print(dedup_file(version, index))
+    """
+
+    COMMIT_INTERVAL = 10000
+
+    def __init__(self, path=None):
+        # type: (Optional[str]) -> None
+        """
+        :param path: (str) sqlite database path, None keeps the index in memory
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._uncommitted = 0
+        self._db = sqlite3.connect(path or ":memory:", check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS chunks (digest TEXT PRIMARY KEY, size INTEGER, refs INTEGER)"
+        )
+        self._db.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __contains__(self, digest):
+        # type: (str) -> bool
+        with self._lock:
+            return (
+                self._db.execute(
+                    "SELECT 1 FROM chunks WHERE digest = ?", (digest,)
+                ).fetchone()
+                is not None
+            )
+
+    def __len__(self):
+        # type: () -> int
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def add(self, digest, size):
+        # type: (str, int) -> bool
+        """
+        Adds a chunk reference to the index
+        Returns True if chunk was not known yet
+        """
+        with self._lock:
+            new_chunk = (
+                self._db.execute(
+                    "INSERT OR IGNORE INTO chunks VALUES (?, ?, 1)", (digest, size)
+                ).rowcount
+                == 1
+            )
+            if not new_chunk:
+                self._db.execute(
+                    "UPDATE chunks SET refs = refs + 1 WHERE digest = ?", (digest,)
+                )
+            self._uncommitted += 1
+            if self._uncommitted >= self.COMMIT_INTERVAL:
+                self._db.commit()
+                self._uncommitted = 0
+        return new_chunk
+
+    def get_stats(self):
+        # type: () -> dict
+        """
+        Returns number of unique chunks, their total size, and total size of all chunk references
+        """
+        with self._lock:
+            chunks, unique_bytes, total_bytes = self._db.execute(
+                "SELECT COUNT(*), SUM(size), SUM(size * refs) FROM chunks"
+            ).fetchone()
+        return {
+            "chunks": chunks,
+            "unique_bytes": unique_bytes or 0,
+            "total_bytes": total_bytes or 0,
+        }
+
+    def commit(self):
+        # type: () -> None
+        if self._db is not None:
+            with self._lock:
+                self._db.commit()
+                self._uncommitted = 0
+
+    def close(self):
+        # type: () -> None
+        if self._db is not None:
+            self.commit()
+            self._db.close()
+            self._db = None
+
+
+def dedup_file(
+    file,  # type: str
+    index=None,  # type: Optional[Union[ChunkIndex, str]]
+    min_size=CDC_MIN_SIZE,  # type: int
+    avg_size=CDC_AVG_SIZE,  # type: int
+    max_size=CDC_MAX_SIZE,  # type: int
+    use_numpy=None,  # type: Optional[bool]
+):
+    # type: (...) -> dict
+    """
+    Chunks a file with chunk_file() and adds its chunks to a chunk index, in order to know how much data
+    is actually new compared to files already indexed
+
+    :param file: (str) path to file
+    :param index: (ChunkIndex/str) chunk index or sqlite database path, None uses a temporary in memory index
+                  which only detects duplicate chunks inside the file
+    :param min_size: (int) minimal chunk size
+    :param avg_size: (int) average chunk size
+    :param max_size: (int) maximal chunk size
+    :param use_numpy: (bool) see chunk_file()
+    :return: (dict) chunks, new_chunks, bytes, new_bytes and dedup_ratio, which is the fraction
+             of bytes that were already known
+    """
+    owned = not isinstance(index, ChunkIndex)
+    if owned:
+        index = ChunkIndex(index)
+    result = {
+        "file": file,
+        "chunks": 0,
+        "new_chunks": 0,
+        "bytes": 0,
+        "new_bytes": 0,
+        "dedup_ratio": 0.0,
+    }
+    try:
+        for _, length, digest in chunk_file(
+            file, min_size, avg_size, max_size, use_numpy=use_numpy
+        ):
+            result["chunks"] += 1
+            result["bytes"] += length
+            if index.add(digest, length):
+                result["new_chunks"] += 1
+                result["new_bytes"] += length
+    finally:
+        if owned:
+            index.close()
+        else:
+            index.commit()
+    if result["bytes"]:
+        result["dedup_ratio"] = (result["bytes"] - result["new_bytes"]) / float(
+            result["bytes"]
+        )
+    return result
+
+
+class ManifestIndex(object):
+    """
+    Indexed manifest store in a SQLite database, for manifests too big to be loaded from text files
+    Paths are the primary key and digests are indexed, so lookups by path or digest are O(log n), and
+    iteration streams entries sorted by path without loading them in memory
+    Digests are stored as binary blobs, which halves the index size
+
+    Example:
+
+    with ManifestIndex('/var/lib/manifest.db') as index:
+        index.import_manifest('/tmp/huge_manifest.sha256')
+        print(index.get('some/path'))
+        print(index.find('4c77f1bd193cac476cea5af2225e8c0177d5a009390aa6e119c211a00cf325c9'))
+        index.export_manifest('/tmp/manifest.sha256')
+    """
+
+    COMMIT_INTERVAL = 100000
+
+    def __init__(self, path, algorithm=None):
+        # type: (str, Optional[str]) -> None
+        """
+        :param path: (str) sqlite database path
+        :param algorithm: (str) hash algorithm of digests, stored in the database, defaults to sha256 for new indexes
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._uncommitted = 0
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS entries (path TEXT PRIMARY KEY, digest BLOB) WITHOUT ROWID"
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS entries_digest ON entries (digest)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+        )
+        if algorithm:
+            self.algorithm = algorithm
+        elif self.algorithm is None:
+            self.algorithm = "sha256"
+        self._db.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def algorithm(self):
+        # type: () -> Optional[str]
+        row = self._db.execute(
+            "SELECT value FROM meta WHERE key = 'algorithm'"
+        ).fetchone()
+        return row[0] if row else None
+
+    @algorithm.setter
+    def algorithm(self, value):
+        # type: (str) -> None
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('algorithm', ?)", (value.lower(),)
+            )
+
+    def __len__(self):
+        # type: () -> int
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def __contains__(self, path):
+        # type: (str) -> bool
+        return self.get(path) is not None
+
+    def __iter__(self):
+        # type: () -> Iterable[Tuple[str, str]]
+        return self.iter_entries()
+
+    def _written(self, count=1):
+        # type: (int) -> None
+        # Needs to be called with self._lock held
+        self._uncommitted += count
+        if self._uncommitted >= self.COMMIT_INTERVAL:
+            self._db.commit()
+            self._uncommitted = 0
+
+    def add(self, path, digest):
+        # type: (str, str) -> None
+        """
+        Adds or replaces a manifest entry
+        """
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?)",
+                (path, bytes.fromhex(digest)),
+            )
+            self._written()
+
+    def add_entries(self, entries):
+        # type: (Iterable[Tuple[str, str]]) -> int
+        """
+        Adds or replaces (digest, path) entries, as yielded by read_manifest(), in batches
+        Returns number of entries added
+        """
+        count = 0
+        batch = []
+        for digest, path in entries:
+            batch.append((path, bytes.fromhex(digest)))
+            if len(batch) >= 10000:
+                count += self._add_batch(batch)
+                batch = []
+        count += self._add_batch(batch)
+        return count
+
+    def _add_batch(self, batch):
+        # type: (List[Tuple[str, bytes]]) -> int
+        with self._lock:
+            self._db.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?)", batch)
+            self._written(len(batch))
+        return len(batch)
+
+    def remove(self, path):
+        # type: (str) -> bool
+        """
+        Removes a manifest entry, returns False if path was not in index
+        """
+        with self._lock:
+            removed = (
+                self._db.execute("DELETE FROM entries WHERE path = ?", (path,)).rowcount
+                > 0
+            )
+            self._written()
+        return removed
+
+    def get(self, path):
+        # type: (str) -> Optional[str]
+        """
+        Returns digest of path, or None if path is not in index
+        """
+        with self._lock:
+            row = self._db.execute(
+                "SELECT digest FROM entries WHERE path = ?", (path,)
+            ).fetchone()
+        return row[0].hex() if row else None
+
+    def find(self, digest):
+        # type: (str) -> List[str]
+        """
+        Returns all paths having given digest
+        """
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT path FROM entries WHERE digest = ? ORDER BY path",
+                (bytes.fromhex(digest),),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def iter_entries(self, prefix=None):
+        # type: (Optional[str]) -> Iterable[Tuple[str, str]]
+        """
+        Streams (digest, path) entries sorted by path, optionally only paths starting with prefix
+        """
+        if prefix:
+            # Range scan on primary key, since LIKE can't use it with arbitrary characters in prefix
+            cursor = self._db.execute(
+                "SELECT path, digest FROM entries WHERE path >= ? AND path < ? ORDER BY path",
+                (prefix, prefix + "\U0010ffff"),
+            )
+        else:
+            cursor = self._db.execute("SELECT path, digest FROM entries ORDER BY path")
+        while True:
+            rows = cursor.fetchmany(1000)
+            if not rows:
+                break
+            for path, digest in rows:
+                yield digest.hex(), path
+
+    def import_manifest(self, manifest_file):
+        # type: (str) -> int
+        """
+        Imports a sha256sum like text manifest, returns number of imported entries
+        """
+        self.algorithm = get_manifest_algorithm(manifest_file)
+        # Building the digest index once after bulk inserts is much faster than maintaining it for every insert
+        with self._lock:
+            self._db.execute("DROP INDEX IF EXISTS entries_digest")
+        count = self.add_entries(read_manifest(manifest_file))
+        with self._lock:
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS entries_digest ON entries (digest)"
+            )
+        self.commit()
+        return count
+
+    def export_manifest(self, manifest_file):
+        # type: (str) -> int
+        """
+        Exports index to a sha256sum like text manifest sorted by path, returns number of exported entries
+        """
+        self.commit()
+        count = 0
+        try:
+            with open(manifest_file, "w", encoding="utf-8") as file_handle:
+                file_handle.write(
+                    "{}{}\n".format(MANIFEST_ALGORITHM_HEADER, self.algorithm)
+                )
+                for digest, path in self.iter_entries():
+                    file_handle.write(_format_manifest_line(digest, path))
+                    count += 1
+        except IOError as exc:
+            raise IOError(
+                'Cannot write manifest file "{}": {}'.format(manifest_file, exc)
+            )
+        return count
+
+    def commit(self):
+        # type: () -> None
+        if self._db is not None:
+            with self._lock:
+                self._db.commit()
+                self._uncommitted = 0
+
+    def close(self):
+        # type: () -> None
+        if self._db is not None:
+            self.commit()
+            self._db.close()
+            self._db = None
+
+
+# Max number of entries sorted in memory by diff_manifests(), bigger manifests are sorted in temporary files
+# 200k entries use roughly 50MB of memory
+EXTERNAL_SORT_RUN_SIZE = 200000
+
+
+def _write_sort_run(run, temp_dir=None):
+    # type: (list, Optional[str]) -> Any
+    # Anonymous temporary file, removed by the OS once closed
+    run_file = tempfile.TemporaryFile(dir=temp_dir)
+    for index in range(0, len(run), 1000):
+        pickle.dump(run[index : index + 1000], run_file, pickle.HIGHEST_PROTOCOL)
+    run_file.seek(0)
+    return run_file
+
+
+def _read_sort_run(run_file):
+    # type: (Any) -> Iterable[Any]
+    while True:
+        try:
+            batch = pickle.load(run_file)
+        except EOFError:
+            break
+        for item in batch:
+            yield item
+
+
+class _ExternalSorter(object):
+    """
+    Sorts items with bounded memory: sorted runs of run_size items are written to temporary files
+    and merged lazily by sorted()
+    """
+
+    def __init__(self, run_size=EXTERNAL_SORT_RUN_SIZE, temp_dir=None):
+        # type: (int, Optional[str]) -> None
+        self.run_size = run_size
+        self.temp_dir = temp_dir
+        self._run = []  # type: list
+        self._run_files = []  # type: list
+
+    def add(self, item):
+        # type: (Any) -> None
+        self._run.append(item)
+        if len(self._run) >= self.run_size:
+            self._run.sort()
+            self._run_files.append(_write_sort_run(self._run, self.temp_dir))
+            self._run = []
+
+    def sorted(self):
+        # type: () -> Iterable[Any]
+        self._run.sort()
+        if not self._run_files:
+            return iter(self._run)
+        if self._run:
+            self._run_files.append(_write_sort_run(self._run, self.temp_dir))
+            self._run = []
+        return heapq.merge(*[_read_sort_run(run_file) for run_file in self._run_files])
+
+    def close(self):
+        # type: () -> None
+        for run_file in self._run_files:
+            run_file.close()
+        self._run_files = []
+        self._run = []
+
+
+def _sorted_manifest_entries(manifest, run_size, temp_dir):
+    # type: (Union[str, ManifestIndex], int, Optional[str]) -> Iterable[Tuple[str, str]]
+    """
+    Yields (path, digest) tuples of a manifest file or ManifestIndex, sorted by path
+    """
+    if isinstance(manifest, ManifestIndex):
+        for digest, path in manifest.iter_entries():
+            yield path, digest
+    else:
+        sorter = _ExternalSorter(run_size, temp_dir)
+        try:
+            for digest, path in read_manifest(manifest):
+                sorter.add((path, digest))
+            for entry in sorter.sorted():
+                yield entry
+        finally:
+            sorter.close()
+
+
+def diff_manifests(
+    old_manifest,  # type: Union[str, ManifestIndex]
+    new_manifest,  # type: Union[str, ManifestIndex]
+    detect_renames=True,  # type: bool
+    run_size=EXTERNAL_SORT_RUN_SIZE,  # type: int
+    temp_dir=None,  # type: Optional[str]
+):
+    # type: (...) -> Iterable[dict]
+    """
+    Streams differences between two manifests with bounded memory usage, regardless of manifest sizes
+
+    Both manifests are sorted by path (externally when bigger than run_size entries) and merge walked,
+    which yields modified entries right away. Paths only present in one manifest are then sorted by digest
+    and merge walked again, so a removed and an added path with the same digest become a rename
+
+    Yields dicts like:
+    {"action": "modified", "path": path, "digest": new_digest, "old_digest": old_digest}
+    {"action": "renamed", "path": new_path, "old_path": old_path, "digest": digest}
+    {"action": "added", "path": path, "digest": digest}
+    {"action": "removed", "path": path, "digest": digest}
+
+    :param old_manifest: (str/ManifestIndex) old manifest file or index
+    :param new_manifest: (str/ManifestIndex) new manifest file or index
+    :param detect_renames: (bool) pair removed and added paths having the same digest as renames
+    :param run_size: (int) max number of entries sorted in memory
+    :param temp_dir: (str) directory for temporary sort files, defaults to system temp dir
+    :return: (generator) difference dicts
+    """
+    algorithms = [
+        (
+            manifest.algorithm
+            if isinstance(manifest, ManifestIndex)
+            else get_manifest_algorithm(manifest)
+        )
+        for manifest in [old_manifest, new_manifest]
+    ]
+    if algorithms[0] != algorithms[1]:
+        raise ValueError(
+            "Cannot compare manifests with different algorithms {} and {}".format(
+                *algorithms
+            )
+        )
+
+    # Paths only present in one manifest are spilled to sorted temporary runs past run_size entries
+    removed_sorter = _ExternalSorter(run_size, temp_dir)
+    added_sorter = _ExternalSorter(run_size, temp_dir)
+    try:
+        old_entries = _sorted_manifest_entries(old_manifest, run_size, temp_dir)
+        new_entries = _sorted_manifest_entries(new_manifest, run_size, temp_dir)
+        old_entry = next(old_entries, None)
+        new_entry = next(new_entries, None)
+        while old_entry is not None or new_entry is not None:
+            if new_entry is None or (
+                old_entry is not None and old_entry[0] < new_entry[0]
+            ):
+                removed_sorter.add((old_entry[1], old_entry[0]))
+                old_entry = next(old_entries, None)
+            elif old_entry is None or new_entry[0] < old_entry[0]:
+                added_sorter.add((new_entry[1], new_entry[0]))
+                new_entry = next(new_entries, None)
+            else:
+                if old_entry[1] != new_entry[1]:
+                    yield {
+                        "action": "modified",
+                        "path": new_entry[0],
+                        "digest": new_entry[1],
+                        "old_digest": old_entry[1],
+                    }
+                old_entry = next(old_entries, None)
+                new_entry = next(new_entries, None)
+
+        # Both streams are now (digest, path) sorted
+        removed = removed_sorter.sorted()
+        added = added_sorter.sorted()
+        old_entry = next(removed, None)
+        new_entry = next(added, None)
+        while old_entry is not None or new_entry is not None:
+            if new_entry is None or (
+                old_entry is not None
+                and (not detect_renames or old_entry[0] < new_entry[0])
+            ):
+                yield {
+                    "action": "removed",
+                    "path": old_entry[1],
+                    "digest": old_entry[0],
+                }
+                old_entry = next(removed, None)
+            elif old_entry is None or new_entry[0] < old_entry[0]:
+                yield {"action": "added", "path": new_entry[1], "digest": new_entry[0]}
+                new_entry = next(added, None)
+            else:
+                yield {
+                    "action": "renamed",
+                    "path": new_entry[1],
+                    "old_path": old_entry[1],
+                    "digest": new_entry[0],
+                }
+                old_entry = next(removed, None)
+                new_entry = next(added, None)
+    finally:
+        removed_sorter.close()
+        added_sorter.close()
+
+
+# Async hashing offloads reads and digest updates to a bounded thread pool, so the event loop never blocks
+ASYNC_WORKERS = 4
+# Amount of data hashed per thread pool job, cancellation takes effect between two jobs
+ASYNC_STEP_SIZE = 4194304
+_ASYNC_EXECUTOR = []
+_ASYNC_EXECUTOR_LOCK = threading.Lock()
+
+
+def _get_async_executor():
+    # type: () -> ThreadPoolExecutor
+    with _ASYNC_EXECUTOR_LOCK:
+        if not _ASYNC_EXECUTOR:
+            _ASYNC_EXECUTOR.append(ThreadPoolExecutor(max_workers=ASYNC_WORKERS))
+        return _ASYNC_EXECUTOR[0]
+
+
+def _hash_file_step(
+    file_handle, hashers, block_size, step_size, nocache=False, bandwidth_limit=None
+):
+    # type: (Any, List[Any], int, int, bool, Optional[BandwidthLimiter]) -> int
+    """
+    Hashes up to step_size bytes from current file position, returns number of bytes hashed, 0 on EOF
+    With nocache, pages hashed by the step are dropped from page cache, see _hash_file()
+    """
+    buffer = _get_buffer(block_size)
+    start_position = file_handle.tell() if nocache else 0
+    hashed_bytes = 0
+    while hashed_bytes < step_size:
+        read_bytes = file_handle.readinto(buffer)
+        if not read_bytes:
+            break
+        data = buffer[:read_bytes]
+        for hasher in hashers:
+            hasher.update(data)
+        hashed_bytes += read_bytes
+        if bandwidth_limit is not None:
+            bandwidth_limit.consume(read_bytes)
+    if nocache and hashed_bytes:
+        _fadvise(
+            file_handle.fileno(), start_position, hashed_bytes, "POSIX_FADV_DONTNEED"
+        )
+    return hashed_bytes
+
+
+async def async_hash_file(
+    file,  # type: str
+    algorithms="sha256",  # type: Union[str, Iterable[str]]
+    block_size=None,  # type: Optional[int]
+    cache=None,  # type: Optional[HashCache]
+    paranoid=False,  # type: bool
+    executor=None,  # type: Optional[ThreadPoolExecutor]
+    nocache=False,  # type: bool
+    bandwidth_limit=None,  # type: Optional[Union[BandwidthLimiter, int]]
+):
+    # type: (...) -> Union[str, dict]
+    """
+    Async version of hash_file(), files are hashed by ASYNC_STEP_SIZE steps in a thread pool,
+    so cancelling the task stops hashing within one step
+
+    Example:
+    digest = await async_hash_file('/data/huge_file')
+
+    :param file: (str) path to file
+    :param algorithms: (str/list) algorithm name, or list of algorithm names, see get_hash_algorithms()
+    :param block_size: (int) read block size, defaults to BLOCK_SIZE
+    :param cache: (HashCache) optional cache which digests are reused when file metadata didn't change
+    :param paranoid: (bool) always rehash file, even if cache has digests for it, and update the cache
+    :param executor: (ThreadPoolExecutor) thread pool to use, defaults to a shared pool of ASYNC_WORKERS threads
+    :param nocache: (bool) don't pollute page cache, see _hash_file()
+    :param bandwidth_limit: (BandwidthLimiter/int) max read throughput in bytes per second, waiting for
+                            bandwidth happens in the thread pool
+    :return: (str/dict) digest if a single algorithm name was given, else dict of {algorithm: digest}
+    """
+    single_algorithm = isinstance(algorithms, str)
+    if single_algorithm:
+        algorithms = [algorithms]
+    algorithms = [algorithm.lower() for algorithm in algorithms]
+    hashers = {algorithm: _new_hasher(algorithm) for algorithm in algorithms}
+    digests = {}
+    executor = executor or _get_async_executor()
+    loop = asyncio.get_running_loop()
+    bandwidth_limit = _open_limiter(bandwidth_limit)
+
+    try:
+        stat = None
+        if cache is not None:
+            stat = await loop.run_in_executor(executor, os.stat, file)
+            if not paranoid:
+                for algorithm in algorithms:
+                    digest = await loop.run_in_executor(
+                        executor, cache.get, file, algorithm, stat
+                    )
+                    if digest:
+                        digests[algorithm] = digest
+                        del hashers[algorithm]
+        if hashers:
+            file_handle = await loop.run_in_executor(
+                executor, partial(open, file, "rb", buffering=0)
+            )
+            future = None
+            try:
+                if nocache:
+                    _fadvise(file_handle.fileno(), 0, 0, "POSIX_FADV_SEQUENTIAL")
+                while True:
+                    future = executor.submit(
+                        _hash_file_step,
+                        file_handle,
+                        list(hashers.values()),
+                        block_size or BLOCK_SIZE,
+                        ASYNC_STEP_SIZE,
+                        nocache,
+                        bandwidth_limit,
+                    )
+                    if not await asyncio.wrap_future(future):
+                        break
+            finally:
+                if future is not None and not future.done():
+                    # Task was cancelled while a step runs, file can only be closed once it's done
+                    future.add_done_callback(lambda _: file_handle.close())
+                else:
+                    file_handle.close()
+    except (IOError, OSError) as exc:
+        raise IOError(
+            'Cannot create {} sum for file "{}": {}'.format(
+                ", ".join(algorithms), file, exc
+            )
+        )
+    for algorithm, hasher in hashers.items():
+        digests[algorithm] = hasher.hexdigest()
+        if cache is not None:
+            await loop.run_in_executor(
+                executor, cache.set, file, digests[algorithm], algorithm, stat
+            )
+
+    if single_algorithm:
+        return digests[algorithms[0]]
+    return digests
+
+
+async def async_sha256sum(
+    file,
+    block_size=None,
+    cache=None,
+    paranoid=False,
+    nocache=False,
+    bandwidth_limit=None,
+):
+    # type: (str, Optional[int], Optional[HashCache], bool, bool, Optional[Union[BandwidthLimiter, int]]) -> str
+    """
+    Async version of sha256sum()
+    """
+    return await async_hash_file(
+        file,
+        "sha256",
+        block_size=block_size,
+        cache=cache,
+        paranoid=paranoid,
+        nocache=nocache,
+        bandwidth_limit=bandwidth_limit,
+    )
+
+
+async def _async_hash_ordered(next_files, hash_coroutine, concurrency, fn_on_result):
+    # type: (Callable, Callable, int, Callable) -> None
+    """
+    Hashes files from next_files() batches with at most concurrency files in flight, calling
+    fn_on_result(file, digest) in input order
+    Remaining files are cancelled on error or cancellation
+    """
+    pending = deque()
+    try:
+        while True:
+            files = await next_files()
+            if not files:
+                break
+            for file in files:
+                pending.append((file, asyncio.ensure_future(hash_coroutine(file))))
+                if len(pending) >= concurrency:
+                    file, task = pending.popleft()
+                    fn_on_result(file, await task)
+        while pending:
+            file, task = pending.popleft()
+            fn_on_result(file, await task)
+    finally:
+        for _, task in pending:
+            task.cancel()
+
+
+async def async_hash_files(
+    files,  # type: Iterable[str]
+    algorithms="sha256",  # type: Union[str, Iterable[str]]
+    concurrency=ASYNC_WORKERS,  # type: int
+    block_size=None,  # type: Optional[int]
+    cache=None,  # type: Optional[HashCache]
+    paranoid=False,  # type: bool
+    executor=None,  # type: Optional[ThreadPoolExecutor]
+    nocache=False,  # type: bool
+    bandwidth_limit=None,  # type: Optional[Union[BandwidthLimiter, int]]
+):
+    # type: (...) -> List[Tuple[str, Union[str, dict]]]
+    """
+    Hashes files concurrently without blocking the event loop
+
+    :param files: (list) file paths
+    :param concurrency: (int) max number of files hashed at the same time
+    :return: (list) (file, digest) tuples in the same order as files
+    See async_hash_file() for other parameters
+    """
+    files = list(files)
+    results = []
+    # A single limiter is shared by all files
+    bandwidth_limit = _open_limiter(bandwidth_limit)
+
+    async def _next_files():
+        batch = files[:]
+        del files[:]
+        return batch
+
+    await _async_hash_ordered(
+        _next_files,
+        partial(
+            async_hash_file,
+            algorithms=algorithms,
+            block_size=block_size,
+            cache=cache,
+            paranoid=paranoid,
+            executor=executor,
+            nocache=nocache,
+            bandwidth_limit=bandwidth_limit,
+        ),
+        concurrency,
+        lambda file, digest: results.append((file, digest)),
+    )
+    return results
+
+
+async def async_create_manifest_from_dir(
+    manifest_file,  # type: str
+    path,  # type: str
+    remove_prefixes=None,  # type: list
+    f_exclude_list=None,  # type: list
+    d_exclude_list=None,  # type: list
+    concurrency=ASYNC_WORKERS,  # type: int
+    cache=None,  # type: Optional[Union[HashCache, str]]
+    paranoid=False,  # type: bool
+    algorithm="sha256",  # type: str
+    executor=None,  # type: Optional[ThreadPoolExecutor]
+    nocache=False,  # type: bool
+    bandwidth_limit=None,  # type: Optional[Union[BandwidthLimiter, int]]
+):
+    # type: (...) -> None
+    """
+    Async version of create_manifest_from_dir(), directory walk and hashing run in a thread pool
+    Manifest lines keep directory walk order
+
+    :param concurrency: (int) max number of files hashed at the same time
+    :param executor: (ThreadPoolExecutor) thread pool to use, defaults to a shared pool of ASYNC_WORKERS threads
+    See create_manifest_from_dir() for other parameters
+    """
+    if not os.path.isdir(path):
+        raise NotADirectoryError("Path [%s] does not exist." % path)
+    _new_hasher(algorithm)
+    executor = executor or _get_async_executor()
+    loop = asyncio.get_running_loop()
+    # A single limiter is shared by all files
+    bandwidth_limit = _open_limiter(bandwidth_limit)
 
-    files = get_paths_recursive(
-        path,
-        f_exclude_list=f_exclude_list,
-        d_exclude_list=d_exclude_list,
-        exclude_dirs=True,
+    files = _skip_file(
+        get_paths_recursive(
+            path,
+            f_exclude_list=f_exclude_list,
+            d_exclude_list=d_exclude_list,
+            exclude_dirs=True,
+        ),
+        manifest_file,
     )
-    with open(manifest_file, "w", encoding="utf-8") as file_handle:
+
+    def _next_batch():
+        # Walking a directory blocks too, so it's done by batches in the thread pool
+        batch = []
         for file in files:
-            sha256 = sha256sum(file)
-            for prefix in remove_prefixes if remove_prefixes is not None else []:
-                if file.startswith(prefix):
-                    file = file[len(prefix) :].lstrip(os.sep)
-            # python 2.7 compat 'u' replaced by unicode_literals
-            file_content = "{}  {}\n".format(sha256, file)
-            file_handle.write(file_content)
+            batch.append(file)
+            if len(batch) >= 1000:
+                break
+        return batch
+
+    async def _next_files():
+        return await loop.run_in_executor(executor, _next_batch)
+
+    cache, own_cache = _open_cache(cache)
+    try:
+        with open(manifest_file, "w", encoding="utf-8") as file_handle:
+            file_handle.write(
+                "{}{}\n".format(MANIFEST_ALGORITHM_HEADER, algorithm.lower())
+            )
+
+            def _write_line(file, digest):
+                for prefix in remove_prefixes if remove_prefixes is not None else []:
+                    if file.startswith(prefix):
+                        file = file[len(prefix) :].lstrip(os.sep)
+                file_handle.write(_format_manifest_line(digest, file))
+
+            await _async_hash_ordered(
+                _next_files,
+                partial(
+                    async_hash_file,
+                    algorithms=algorithm,
+                    cache=cache,
+                    paranoid=paranoid,
+                    executor=executor,
+                    nocache=nocache,
+                    bandwidth_limit=bandwidth_limit,
+                ),
+                concurrency,
+                _write_line,
+            )
+    finally:
+        if own_cache:
+            cache.close()
+
+
+def _is_zip_archive(archive):
+    # type: (Any) -> bool
+    """
+    Zip archives start with a local file header, or an end of central directory record when empty
+    zipfile.is_zipfile() searches the end of file instead, which also matches tar files whose last
+    member is a zip file
+    """
+    try:
+        if isinstance(archive, str):
+            with open(archive, "rb") as file_handle:
+                header = file_handle.read(512)
+        else:
+            # Zip files need random access to their central directory, non seekable streams can only be tar files
+            if not archive.seekable():
+                return False
+            position = archive.tell()
+            header = archive.read(512)
+            archive.seek(position)
+    except (AttributeError, OSError):
+        return False
+    # Uncompressed tar headers have the ustar magic at offset 257
+    if header[257:262] == b"ustar":
+        return False
+    return header[:4] in [b"PK\x03\x04", b"PK\x05\x06"]
+
+
+def hash_archive_members(
+    archive,  # type: Any
+    algorithms="sha256",  # type: Union[str, Iterable[str]]
+    block_size=None,  # type: Optional[int]
+):
+    # type: (...) -> Iterable[Tuple[str, Union[str, dict]]]
+    """
+    Hashes regular file members of a tar (optionally gz / bz2 / xz compressed) or zip archive directly
+    from the archive stream, without extracting them
+    Tar archives are read in stream mode, so they can also be read from pipes or sockets
+
+    Example:
+    for path, digest in hash_archive_members('/tmp/vendor.tar.xz'):
+        print(digest, path)
+
+    :param archive: (str/file) path to archive, or file like object
+    :param algorithms: (str/list) algorithm name, or list of algorithm names, see get_hash_algorithms()
+    :param block_size: (int) read block size, defaults to BLOCK_SIZE
+    :return: (generator) (member path, digest) tuples in archive order, digest being a dict of
+             {algorithm: digest} when a list of algorithms is given
+    """
+    if _is_zip_archive(archive):
+        with zipfile.ZipFile(archive) as zip_file:
+            for member in zip_file.infolist():
+                if member.filename.endswith("/"):
+                    continue
+                with zip_file.open(member) as member_handle:
+                    yield member.filename, hash_stream(
+                        member_handle, algorithms, block_size=block_size
+                    )
+        return
+
+    if isinstance(archive, str):
+        tar_file = tarfile.open(archive, mode="r|*")
+    else:
+        tar_file = tarfile.open(fileobj=archive, mode="r|*")
+    with tar_file:
+        for member in tar_file:
+            # Links, devices and directories have no content
+            if not member.isfile():
+                continue
+            member_handle = tar_file.extractfile(member)
+            path = member.name[2:] if member.name.startswith("./") else member.name
+            yield path, hash_stream(member_handle, algorithms, block_size=block_size)
+
+
+def create_manifest_from_archive(
+    manifest_file,  # type: str
+    archive,  # type: Any
+    remove_prefixes=None,  # type: list
+    algorithm="sha256",  # type: str
+):
+    # type: (...) -> int
+    """
+    Creates a sha256sum like manifest of archive members, which can be checked with sha256sum -c once
+    the archive is extracted
+    Archive members are hashed from the archive stream, nothing gets written to disk
+
+    :param manifest_file: (str) path of resulting manifest file
+    :param archive: (str/file) tar / tar.gz / tar.bz2 / tar.xz / zip archive path, or file like object
+    :param remove_prefixes: (list) optional member path prefixes to remove from manifest paths
+    :param algorithm: (str) hash algorithm, see get_hash_algorithms(), recorded in manifest header
+    :return: (int) number of members in manifest
+    """
+    _new_hasher(algorithm)
+    count = 0
+    try:
+        with open(manifest_file, "w", encoding="utf-8") as file_handle:
+            file_handle.write(
+                "{}{}\n".format(MANIFEST_ALGORITHM_HEADER, algorithm.lower())
+            )
+            for path, digest in hash_archive_members(archive, algorithm):
+                for prefix in remove_prefixes if remove_prefixes is not None else []:
+                    if path.startswith(prefix):
+                        path = path[len(prefix) :].lstrip("/")
+                file_handle.write(_format_manifest_line(digest, path))
+                count += 1
+    except (tarfile.TarError, zipfile.BadZipfile) as exc:
+        raise IOError('Cannot read archive "{}": {}'.format(archive, exc))
+    return count
+
+
+def _directory_digest(path, relative_path, algorithm, cache, trust_dir_mtime, changed):
+    # type: (str, str, str, Optional[HashCache], bool, list) -> str
+    stat = os.stat(path)
+    cached = cache.get_directory(path, algorithm) if cache is not None else None
+    if (
+        trust_dir_mtime
+        and cached is not None
+        and cached[0] == (stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_ctime_ns)
+    ):
+        # Directory entries didn't change, so file digests are reused without looking at the files
+        # Subdirectories still get a stat each since their changes don't show up in this directory
+        entries = []
+        for entry_type, name, entry_digest in cached[2]:
+            if entry_type == "d":
+                entry_digest = _directory_digest(
+                    os.path.join(path, name),
+                    os.path.join(relative_path, name),
+                    algorithm,
+                    cache,
+                    trust_dir_mtime,
+                    changed,
+                )
+            entries.append([entry_type, name, entry_digest])
+    else:
+        # Cache database may live in the tree we hash, and changes on every run
+        cache_files = (
+            [
+                os.path.abspath(cache.path) + suffix
+                for suffix in ["", "-journal", "-wal"]
+            ]
+            if cache is not None and cache.path
+            else []
+        )
+        entries = []
+        for entry in sorted(os.scandir(path), key=lambda entry: entry.name):
+            entry_path = os.path.join(relative_path, entry.name)
+            if entry.is_symlink():
+                hasher = _new_hasher(algorithm)
+                hasher.update(os.fsencode(os.readlink(entry.path)))
+                entries.append(["l", entry.name, hasher.hexdigest()])
+            elif entry.is_dir():
+                entries.append(
+                    [
+                        "d",
+                        entry.name,
+                        _directory_digest(
+                            entry.path,
+                            entry_path,
+                            algorithm,
+                            cache,
+                            trust_dir_mtime,
+                            changed,
+                        ),
+                    ]
+                )
+            elif entry.is_file():
+                if os.path.abspath(entry.path) in cache_files:
+                    continue
+                entries.append(
+                    ["f", entry.name, hash_file(entry.path, algorithm, cache=cache)]
+                )
+
+    # Like git trees, the digest covers entry types, names and digests
+    hasher = _new_hasher(algorithm)
+    for entry_type, name, digest in entries:
+        hasher.update(
+            "{} ".format(entry_type).encode("ascii")
+            + os.fsencode(name)
+            + "\0{}\n".format(digest).encode("ascii")
+        )
+    digest = hasher.hexdigest()
+
+    if cached is not None and cached[1] != digest:
+        previous_entries = {
+            name: (entry_type, entry_digest)
+            for entry_type, name, entry_digest in cached[2]
+        }
+        for entry_type, name, entry_digest in entries:
+            previous = previous_entries.pop(name, None)
+            if previous is None or previous[0] != entry_type:
+                changed.append(os.path.join(relative_path, name))
+            # Changed subdirectories report their own changed entries
+            elif previous[1] != entry_digest and entry_type != "d":
+                changed.append(os.path.join(relative_path, name))
+        for name in previous_entries:
+            changed.append(os.path.join(relative_path, name))
+    if cache is not None:
+        cache.set_directory(path, digest, entries, algorithm, stat)
+    return digest
+
+
+def directory_digest(
+    path,  # type: str
+    algorithm="sha256",  # type: str
+    cache=None,  # type: Optional[Union[HashCache, str]]
+    trust_dir_mtime=False,  # type: bool
+):
+    # type: (...) -> dict
+    """
+    Computes a single digest of a directory tree, like a git tree: every directory digest combines the
+    types, names and digests of its entries, file digests being file content digests
+
+    With a cache, file digests are reused when file metadata didn't change, and subtree digests are stored
+    so the changed paths since the previous run with the same cache can be reported
+    Directory mtime only changes when entries are added, removed or renamed, not when a file is modified
+    in place. When trust_dir_mtime is set, files of a directory whose metadata (device, inode, mtime, ctime)
+    didn't change are not looked at, only its subdirectories get a stat each, so changes deeper in the tree
+    are still found. Files modified in place in such a directory are missed, so this is only safe when
+    files are always replaced (written to a temporary file then renamed), never modified in place
+
+    Example:
+    with HashCache('/var/cache/tree.db') as cache:
+        result = directory_digest('/data', cache=cache)
+        print(result['digest'], result['changed'])
+
+    :param path: (str) directory path
+    :param algorithm: (str) hash algorithm, see get_hash_algorithms()
+    :param cache: (HashCache/str) sqlite HashCache or sqlite cache path
+    :param trust_dir_mtime: (bool) don't look at files of directories whose metadata didn't change
+    :return: (dict) digest of the tree, and changed (added, removed or modified) paths relative to path
+    """
+    if not os.path.isdir(path):
+        raise NotADirectoryError("Path [%s] does not exist." % path)
+    _new_hasher(algorithm)
+    cache, own_cache = _open_cache(cache)
+    if cache is not None and cache.backend != "sqlite":
+        raise ValueError("Directory digests can only be cached in a sqlite HashCache")
+    changed = []  # type: List[str]
+    try:
+        digest = _directory_digest(
+            os.path.abspath(path),
+            "",
+            algorithm.lower(),
+            cache,
+            trust_dir_mtime,
+            changed,
+        )
+    except (IOError, OSError) as exc:
+        raise IOError('Cannot compute digest of directory "{}": {}'.format(path, exc))
+    finally:
+        if own_cache:
+            cache.close()
+        elif cache is not None:
+            cache.commit()
+    return {"digest": digest, "changed": sorted(changed)}
+
+
+def quick_verify_manifest(
+    manifest_file,  # type: str
+    root=None,  # type: Optional[str]
+    confidence=0.99,  # type: float
+    corruption_rate=0.01,  # type: float
+    byte_budget=None,  # type: Optional[int]
+    seed=None,  # type: Optional[int]
+    workers=1,  # type: int
+    algorithm=None,  # type: Optional[str]
+    merkle_ranges=4,  # type: int
+    fn_on_result=None,  # type: Optional[Callable]
+    nocache=False,  # type: bool
+    bandwidth_limit=None,  # type: Optional[Union[BandwidthLimiter, int]]
+):
+    # type: (...) -> dict
+    """
+    Probabilistic verification of a manifest, for daily integrity checks of datasets too big to be fully verified
+
+    Every entry is checked for existence, readability and empty vs non empty size, then a random sample of
+    files is hashed. Each file is sampled with the same probability, which is computed either
+    - from a confidence target: enough files are sampled to detect at least one corrupted file with
+      given confidence when corruption_rate of the files are corrupted, ie 459 files for 99% / 1%
+    - or from a byte budget: files are sampled so the expected amount of sampled data is byte_budget
+    The size check can only detect empty vs non empty files, since manifests don't record sizes
+    Sampled files having a merkle tree sidecar only get merkle_ranges random chunks verified instead of
+    being fully read, when the sidecar was created with create_merkle_tree(file_algorithm=...) and its whole
+    file digest matches the manifest entry, so the tree describes the expected content
+    Files with sidecars that are unbound, don't match or can't be read are fully hashed
+    Sampling only depends on the seed and the manifest, so a run can be reproduced with the seed of its report
+
+    Example:
+    result = quick_verify_manifest('/archive/MANIFEST', byte_budget=10 * 1024 ** 3, workers=4)
+    print(result['success'], result['seed'], result['bytes'])
+
+    :param manifest_file: (str) path to manifest file
+    :param root: (str) directory relative paths in manifest refer to, defaults to manifest directory
+    :param confidence: (float) probability to detect corruption affecting corruption_rate of the files
+    :param corruption_rate: (float) smallest fraction of corrupted files we want to detect
+    :param byte_budget: (int) expected amount of bytes to hash, overrides confidence based sampling
+    :param seed: (int) random seed, a random one is used and reported when not given
+    :param workers: (int) number of concurrent hashing threads
+    :param algorithm: (str) hash algorithm, read from manifest header when not given
+    :param merkle_ranges: (int) number of random chunks to verify in files having a merkle sidecar,
+                          0 always hashes sampled files entirely
+    :param fn_on_result: (callable) optional function called with (path, status) for every flagged or sampled
+                         entry, status being OK, FAILED, MISSING or UNREADABLE
+    :param nocache: (bool) don't pollute page cache while hashing, see _hash_file()
+    :param bandwidth_limit: (BandwidthLimiter/int) max total read throughput of all workers in bytes per second
+    :return: (dict) verification report, see verify_manifest(), with sample details
+    """
+    start_time = time.monotonic()
+    if root is None:
+        root = os.path.dirname(os.path.abspath(manifest_file))
+    if algorithm is None:
+        algorithm = get_manifest_algorithm(manifest_file)
+    if not 0 < confidence < 1 or not 0 < corruption_rate < 1:
+        raise ValueError("confidence and corruption_rate must be between 0 and 1")
+    if seed is None:
+        seed = random.SystemRandom().randrange(2**32)
+    empty_digest = _new_hasher(algorithm).hexdigest()
+    bandwidth_limit = _open_limiter(bandwidth_limit)
+    report = {
+        "algorithm": algorithm,
+        "seed": seed,
+        "total": 0,
+        "sampled": 0,
+        "sample_rate": 0.0,
+        "ok": 0,
+        "missing": [],
+        "mismatched": [],
+        "unreadable": [],
+        "total_bytes": 0,
+        "bytes": 0,
+        "confidence": 0.0,
+        "elapsed": 0,
+        "throughput": 0,
+        "success": False,
+    }
+    flagged = set()
+
+    def _flag(path, status, category):
+        flagged.add(path)
+        report[category].append(path)
+        if fn_on_result is not None:
+            fn_on_result(path, status)
+
+    # Metadata pass, every entry gets checked
+    candidates = 0
+    for digest, path in read_manifest(manifest_file):
+        report["total"] += 1
+        problem, stat = _check_manifest_entry_metadata(
+            os.path.join(root, path), digest, empty_digest
+        )
+        if problem:
+            _flag(path, *problem)
+        else:
+            candidates += 1
+            report["total_bytes"] += stat.st_size
+
+    if byte_budget is not None:
+        sample_rate = byte_budget / float(max(report["total_bytes"], 1))
+    else:
+        sample_size = math.ceil(
+            math.log(1 - confidence) / math.log(1 - corruption_rate)
+        )
+        sample_rate = sample_size / float(max(candidates, 1))
+    report["sample_rate"] = min(sample_rate, 1.0)
+
+    def _check(entry):
+        # type: (tuple) -> Tuple[str, int]
+        digest, path = entry
+        full_path = os.path.join(root, path)
+        tree = None
+        tree_file = full_path + MERKLE_SIDECAR_EXTENSION
+        if merkle_ranges and os.path.isfile(tree_file):
+            try:
+                tree = load_merkle_tree(tree_file)
+            except (IOError, OSError, ValueError, KeyError, TypeError) as exc:
+                logger.debug(
+                    'Ignoring merkle tree file "{}": {}'.format(tree_file, exc)
+                )
+        try:
+            if (
+                tree is not None
+                and tree.get("file_algorithm") == algorithm.lower()
+                and tree.get("file_digest") == digest
+                and tree["size"] == os.path.getsize(full_path)
+                and len(tree["leaves"]) > merkle_ranges
+            ):
+                # Per file random generator, so chosen chunks don't depend on worker scheduling
+                chunks = random.Random("{}:{}".format(seed, path)).sample(
+                    range(len(tree["leaves"])), merkle_ranges
+                )
+                checked_bytes = 0
+                for chunk in chunks:
+                    if verify_merkle_range(
+                        full_path,
+                        tree,
+                        chunk * tree["chunk_size"],
+                        tree["chunk_size"],
+                    ):
+                        return "FAILED", checked_bytes
+                    checked_bytes += min(
+                        tree["chunk_size"],
+                        tree["size"] - chunk * tree["chunk_size"],
+                    )
+                return "OK", checked_bytes
+            hasher = _new_hasher(algorithm)
+            size = _hash_file(
+                full_path,
+                [hasher],
+                nocache=nocache,
+                bandwidth_limit=bandwidth_limit,
+            )
+        except (IOError, OSError, ValueError):
+            return "UNREADABLE", 0
+        return ("OK" if hasher.hexdigest() == digest else "FAILED"), size
+
+    def _sample():
+        rng = random.Random(seed)
+        for entry in read_manifest(manifest_file):
+            # Draw for every entry so the sample doesn't depend on which entries were flagged
+            if rng.random() < sample_rate and entry[1] not in flagged:
+                yield entry
+
+    # Content pass on sampled entries
+    for (_, path), (status, size) in hash_files_ordered(
+        _sample(), hash_fn=_check, workers=workers
+    ):
+        report["sampled"] += 1
+        report["bytes"] += size
+        if status == "OK":
+            report["ok"] += 1
+            if fn_on_result is not None:
+                fn_on_result(path, status)
+        else:
+            _flag(
+                path, status, "unreadable" if status == "UNREADABLE" else "mismatched"
+            )
+
+    report["confidence"] = 1 - (1 - corruption_rate) ** report["sampled"]
+    report["elapsed"] = time.monotonic() - start_time
+    if report["elapsed"] > 0:
+        report["throughput"] = report["bytes"] / report["elapsed"]
+    report["success"] = not (
+        report["missing"] or report["mismatched"] or report["unreadable"]
+    )
+    return report
@@ -0,0 +1,335 @@
+#! /usr/bin/env python
+#  -*- coding: utf-8 -*-
+#
+# This file is part of ofunctions package
+
+"""
+ofunctions is a general library for basic repetitive tasks that should be no brainers :)
+
+Versioning semantics:
+    Major version: backward compatibility breaking changes
+    Minor version: New functionality
+    Patch version: Backwards compatible bug fixes
+
+Command line interface for ofunctions.checksums
+
+Usage:
+    python -m ofunctions.checksums create /data -o /data/SHA256SUMS --workers 8 --cache /var/cache/sums.db
+    python -m ofunctions.checksums verify /data/SHA256SUMS --workers 8
+    python -m ofunctions.checksums diff /backup/SHA256SUMS.1 /backup/SHA256SUMS.2
+
+Manifests can be checked with sha256sum -c, and verify output mimics sha256sum -c output
+Statistics are written to stderr, so stdout can be redirected
+"""
+
+__intname__ = "ofunctions.checksums.__main__"
+__author__ = "Orsiris de Jong"
+__copyright__ = "Copyright (C) 2026 Orsiris de Jong"
+__licence__ = "BSD 3 Clause"
+__build__ = "2026101901"
+
+
+import os
+import sys
+import shutil
+import tempfile
+import time
+from argparse import ArgumentParser
+from ofunctions.checksums import (
+    BandwidthLimiter,
+    create_manifest_from_dir,
+    diff_manifests,
+    get_hash_algorithms,
+    quick_verify_manifest,
+    read_manifest,
+    verify_manifest,
+)
+
+try:
+    from typing import List, Optional
+except ImportError:
+    pass
+
+
+PROG_NAME = "ofunctions.checksums"
+
+
+def _print_stats(action, files, size, elapsed):
+    # type: (str, int, int, float) -> None
+    sys.stderr.write(
+        "{}: {} {} files, {:.1f} MiB in {:.2f}s, {:.1f} MiB/s\n".format(
+            PROG_NAME,
+            action,
+            files,
+            size / 1048576.0,
+            elapsed,
+            size / 1048576.0 / elapsed if elapsed > 0 else 0,
+        )
+    )
+
+
+def _create(args):
+    # type: (...) -> int
+    start_time = time.monotonic()
+    path = os.path.abspath(args.path)
+    to_stdout = args.output == "-"
+    if to_stdout:
+        # Manifest is written to a temporary file, which is then streamed to stdout
+        file_descriptor, manifest_file = tempfile.mkstemp()
+        os.close(file_descriptor)
+    else:
+        manifest_file = args.output
+    try:
+        create_manifest_from_dir(
+            manifest_file,
+            path,
+            remove_prefixes=None if args.absolute else [path],
+            f_exclude_list=args.exclude_file,
+            d_exclude_list=args.exclude_dir,
+            workers=args.workers,
+            cache=args.cache,
+            paranoid=args.paranoid,
+            algorithm=args.algorithm,
+            nocache=args.nocache,
+            bandwidth_limit=args.bwlimit,
+        )
+        files = 0
+        size = 0
+        for _, file in read_manifest(manifest_file):
+            files += 1
+            try:
+                size += os.path.getsize(os.path.join(path, file))
+            except OSError:
+                pass
+        if to_stdout:
+            with open(manifest_file, "r", encoding="utf-8") as file_handle:
+                shutil.copyfileobj(file_handle, sys.stdout)
+            sys.stdout.flush()
+    finally:
+        if to_stdout:
+            os.remove(manifest_file)
+    _print_stats("hashed", files, size, time.monotonic() - start_time)
+    return 0
+
+
+def _verify(args):
+    # type: (...) -> int
+    def _on_result(path, status):
+        if status == "OK":
+            if not args.quiet:
+                sys.stdout.write("{}: OK\n".format(path))
+        elif status in ["MISSING", "UNREADABLE"]:
+            sys.stdout.write("{}: FAILED open or read\n".format(path))
+        elif status == "EXTRA":
+            sys.stdout.write("{}: EXTRA\n".format(path))
+        else:
+            sys.stdout.write("{}: {}\n".format(path, status))
+
+    if args.quick:
+        result = quick_verify_manifest(
+            args.manifest,
+            root=args.root,
+            confidence=args.confidence,
+            corruption_rate=args.corruption_rate,
+            byte_budget=args.byte_budget,
+            seed=args.seed,
+            workers=args.workers,
+            fn_on_result=_on_result,
+            nocache=args.nocache,
+            bandwidth_limit=args.bwlimit,
+        )
+        sys.stderr.write(
+            "{}: sampled {} of {} files with seed {}, detection confidence {:.4f}\n".format(
+                PROG_NAME,
+                result["sampled"],
+                result["total"],
+                result["seed"],
+                result["confidence"],
+            )
+        )
+        checked = result["sampled"]
+    else:
+        result = verify_manifest(
+            args.manifest,
+            root=args.root,
+            workers=args.workers,
+            fail_fast=args.fail_fast,
+            check_extra=args.check_extra,
+            fn_on_result=_on_result,
+            nocache=args.nocache,
+            bandwidth_limit=args.bwlimit,
+        )
+        checked = result["total"]
+    sys.stdout.flush()
+
+    unreadable = len(result["missing"]) + len(result["unreadable"])
+    if unreadable:
+        sys.stderr.write(
+            "{}: WARNING: {} listed file{} could not be read\n".format(
+                PROG_NAME, unreadable, "s" if unreadable > 1 else ""
+            )
+        )
+    if result["mismatched"]:
+        sys.stderr.write(
+            "{}: WARNING: {} computed checksum{} did NOT match\n".format(
+                PROG_NAME,
+                len(result["mismatched"]),
+                "s" if len(result["mismatched"]) > 1 else "",
+            )
+        )
+    if result.get("extra"):
+        sys.stderr.write(
+            "{}: WARNING: {} file{} not listed in manifest\n".format(
+                PROG_NAME, len(result["extra"]), "s" if len(result["extra"]) > 1 else ""
+            )
+        )
+    _print_stats("verified", checked, result["bytes"], result["elapsed"])
+    return 0 if result["success"] else 1
+
+
+def _diff(args):
+    # type: (...) -> int
+    start_time = time.monotonic()
+    differences = 0
+    # Same letters as git diff --name-status
+    actions = {"added": "A", "removed": "D", "modified": "M"}
+    for entry in diff_manifests(
+        args.old_manifest,
+        args.new_manifest,
+        detect_renames=not args.no_renames,
+        temp_dir=args.temp_dir,
+    ):
+        differences += 1
+        if entry["action"] == "renamed":
+            sys.stdout.write("R\t{}\t{}\n".format(entry["old_path"], entry["path"]))
+        else:
+            sys.stdout.write("{}\t{}\n".format(actions[entry["action"]], entry["path"]))
+    sys.stdout.flush()
+    sys.stderr.write(
+        "{}: {} differences found in {:.2f}s\n".format(
+            PROG_NAME, differences, time.monotonic() - start_time
+        )
+    )
+    # Like diff, exit code 1 means manifests differ
+    return 1 if differences else 0
+
+
+def _bandwidth(value):
+    # type: (str) -> BandwidthLimiter
+    """
+    Parses bandwidth values like 50M or 1G (bytes per second)
+    """
+    units = {"K": 1024, "M": 1024**2, "G": 1024**3}
+    multiplier = units.get(value[-1:].upper(), 1)
+    if multiplier > 1:
+        value = value[:-1]
+    return BandwidthLimiter(int(float(value) * multiplier))
+
+
+def get_parser():
+    # type: () -> ArgumentParser
+    parser = ArgumentParser(
+        prog="python -m " + PROG_NAME,
+        description="Parallel and incremental sha256sum compatible manifest tool",
+    )
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    io_parser = ArgumentParser(add_help=False)
+    io_parser.add_argument(
+        "-w", "--workers", type=int, default=os.cpu_count() or 1, help="Hash threads"
+    )
+    io_parser.add_argument(
+        "--nocache", action="store_true", help="Don't pollute page cache"
+    )
+    io_parser.add_argument(
+        "--bwlimit",
+        type=_bandwidth,
+        default=None,
+        help="Max read throughput in bytes per second, K/M/G suffixes allowed",
+    )
+
+    create_parser = subparsers.add_parser(
+        "create", parents=[io_parser], help="Create a manifest of a directory"
+    )
+    create_parser.add_argument("path", help="Directory to create manifest for")
+    create_parser.add_argument(
+        "-o", "--output", default="-", help="Manifest file, defaults to stdout"
+    )
+    create_parser.add_argument(
+        "-a",
+        "--algorithm",
+        default="sha256",
+        choices=get_hash_algorithms(),
+        help="Hash algorithm",
+    )
+    create_parser.add_argument(
+        "--cache", help="SQLite hash cache, so unchanged files aren't read again"
+    )
+    create_parser.add_argument(
+        "--paranoid", action="store_true", help="Rehash cached files anyway"
+    )
+    create_parser.add_argument(
+        "--exclude-file", action="append", help="File name exclude pattern, repeatable"
+    )
+    create_parser.add_argument(
+        "--exclude-dir",
+        action="append",
+        help="Directory path exclude pattern, repeatable",
+    )
+    create_parser.add_argument(
+        "--absolute",
+        action="store_true",
+        help="Keep absolute paths instead of paths relative to directory",
+    )
+
+    verify_parser = subparsers.add_parser(
+        "verify", parents=[io_parser], help="Verify files against a manifest"
+    )
+    verify_parser.add_argument("manifest", help="Manifest file")
+    verify_parser.add_argument(
+        "-r",
+        "--root",
+        help="Base directory of manifest paths, defaults to manifest dir",
+    )
+    verify_parser.add_argument(
+        "-q", "--quiet", action="store_true", help="Don't print OK for each file"
+    )
+    verify_parser.add_argument(
+        "--fail-fast", action="store_true", help="Stop on first failure"
+    )
+    verify_parser.add_argument(
+        "--check-extra", action="store_true", help="Report files not in manifest"
+    )
+    verify_parser.add_argument(
+        "--quick", action="store_true", help="Only hash a random sample of files"
+    )
+    verify_parser.add_argument("--confidence", type=float, default=0.99)
+    verify_parser.add_argument("--corruption-rate", type=float, default=0.01)
+    verify_parser.add_argument(
+        "--byte-budget", type=int, help="Bytes to hash in quick mode"
+    )
+    verify_parser.add_argument("--seed", type=int, help="Quick mode random seed")
+
+    diff_parser = subparsers.add_parser("diff", help="Compare two manifests")
+    diff_parser.add_argument("old_manifest")
+    diff_parser.add_argument("new_manifest")
+    diff_parser.add_argument(
+        "--no-renames", action="store_true", help="Don't detect renamed files"
+    )
+    diff_parser.add_argument("--temp-dir", help="Directory for external sort files")
+    return parser
+
+
+def main(argv=None):
+    # type: (Optional[List[str]]) -> int
+    args = get_parser().parse_args(argv)
+    try:
+        return {"create": _create, "verify": _verify, "diff": _diff}[args.command](args)
+    except (IOError, OSError, ValueError) as exc:
+        sys.stderr.write("{}: {}\n".format(PROG_NAME, exc))
+        return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
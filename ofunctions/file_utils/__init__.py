@@ -18,11 +18,15 @@ __author__ = "Orsiris de Jong"
 __copyright__ = "Copyright (C) 2017-2024 Orsiris de Jong"
 __description__ = "File/dir/permissions/time handling"
 __licence__ = "BSD 3 Clause"
-__version__ = "1.2.5"
-__build__ = "2026031601"
+__version__ = "1.3.0"
+__build__ = "2026101901"
 __compat__ = "python2.7+"
 
+import errno
 import json
+import select
+import stat
+import time
 import logging
 import os
 import sys
@@ -31,10 +35,16 @@ import shutil
 from ofunctions import random
 from contextlib import contextmanager
 from datetime import datetime
-from fnmatch import fnmatch
+from fnmatch import fnmatch, translate
 from itertools import chain
 from threading import Lock
 
+# Python 2.7 compat fixes
+try:
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+except ImportError:
+    pass
+
 # Python 2.7 compat fixes
 try:
     from typing import Callable, Iterable, Union, Optional
@@ -237,6 +247,18 @@ def remove_dir(
             shutil.rmtree(path)
 
 
+def _copy_without_metadata(
+    source,  # type: str
+    dest,  # type: str
+):
+    # type: (...) -> None
+    """
+    shutil.copy equivalent (content and permission bits) which keeps sparse files sparse
+    """
+    copy_file(source, dest, preserve_metadata=False)
+    shutil.copymode(source, dest)
+
+
 def move_file(
     source,  # type: str
     dest,  # type: str
@@ -246,7 +268,7 @@ def move_file(
     with _file_lock():
         # Using copy function because we don't want metadata, permissions, buffer nor anything else
         if sys.version_info[0] >= 3:
-            shutil.move(source, dest, copy_function=shutil.copy)
+            shutil.move(source, dest, copy_function=_copy_without_metadata)
         else:
             shutil.move(source, dest)
 
@@ -466,6 +488,599 @@ def get_files_recursive(
     )
 
 
+def _copy_fd(
+    source_fd,  # type: int
+    dest_fd,  # type: int
+    offset,  # type: int
+    count,  # type: int
+):
+    # type: (...) -> int
+    """
+    Copies count bytes from offset of source_fd to the same offset in dest_fd
+    Tries kernel side copies first (copy_file_range allows reflinks / server side copies, sendfile avoids
+    userspace buffers), and falls back to a plain buffered copy when the kernel refuses
+
+    :return: (int) number of copied bytes
+    """
+    copied = 0
+    end = offset + count
+    if hasattr(os, "copy_file_range"):
+        try:
+            while offset < end:
+                sent = os.copy_file_range(
+                    source_fd, dest_fd, end - offset, offset, offset
+                )
+                if sent == 0:
+                    break
+                offset += sent
+                copied += sent
+        except OSError as exc:
+            if exc.errno not in (
+                errno.EXDEV,
+                errno.ENOSYS,
+                errno.EINVAL,
+                errno.EOPNOTSUPP,
+                errno.EBADF,
+                errno.EPERM,
+            ):
+                raise
+    if offset < end and hasattr(os, "sendfile") and os.name != "nt":
+        try:
+            os.lseek(dest_fd, offset, os.SEEK_SET)
+            while offset < end:
+                sent = os.sendfile(dest_fd, source_fd, offset, end - offset)
+                if sent == 0:
+                    break
+                offset += sent
+                copied += sent
+        except OSError as exc:
+            if exc.errno not in (errno.EINVAL, errno.ENOSYS, errno.ENOTSOCK):
+                raise
+    if offset < end:
+        os.lseek(source_fd, offset, os.SEEK_SET)
+        os.lseek(dest_fd, offset, os.SEEK_SET)
+        while offset < end:
+            data = os.read(source_fd, min(1048576, end - offset))
+            if not data:
+                break
+            os.write(dest_fd, data)
+            offset += len(data)
+            copied += len(data)
+    return copied
+
+
+def get_file_extents(
+    fd,  # type: int
+    size=None,  # type: Optional[int]
+):
+    # type: (...) -> Iterable[tuple]
+    """
+    Yields (offset, length, is_data) tuples describing data and hole ranges of a file descriptor
+    using SEEK_DATA / SEEK_HOLE
+    Platforms or filesystems that don't support hole detection yield a single data range
+
+    :param fd: (int) file descriptor opened for reading
+    :param size: (int) optional file size, fstat is used when not given
+    :return: iterator of (offset, length, is_data) tuples
+    """
+    if size is None:
+        size = os.fstat(fd).st_size
+    if size == 0:
+        return
+    if not hasattr(os, "SEEK_DATA") or not hasattr(os, "SEEK_HOLE"):
+        yield 0, size, True
+        return
+
+    offset = 0
+    while offset < size:
+        try:
+            data_start = os.lseek(fd, offset, os.SEEK_DATA)
+        except OSError as exc:
+            if exc.errno == errno.ENXIO:
+                # No more data after offset, the rest of the file is a hole
+                yield offset, size - offset, False
+                break
+            if offset == 0 and exc.errno in (errno.EINVAL, errno.ENOTSUP):
+                # Filesystem doesn't support hole detection
+                yield 0, size, True
+                break
+            raise
+        data_start = min(data_start, size)
+        if data_start > offset:
+            yield offset, data_start - offset, False
+        if data_start >= size:
+            break
+        try:
+            hole_start = min(os.lseek(fd, data_start, os.SEEK_HOLE), size)
+        except OSError as exc:
+            if exc.errno != errno.ENXIO:
+                raise
+            hole_start = size
+        yield data_start, hole_start - data_start, True
+        offset = hole_start
+    os.lseek(fd, 0, os.SEEK_SET)
+
+
+def copy_file(
+    source,  # type: str
+    dest,  # type: str
+    preserve_metadata=True,  # type: bool
+    sparse=True,  # type: bool
+):
+    # type: (...) -> int
+    """
+    Copies a file using zero-copy kernel functions when available
+    Holes of sparse files are skipped so the destination file stays sparse
+
+    :param source: (str) path of source file
+    :param dest: (str) path of destination file, will be overwritten
+    :param preserve_metadata: (bool) copy permission bits and timestamps like shutil.copy2 does
+    :param sparse: (bool) detect holes in source file and keep them in destination
+    :return: (int) number of copied data bytes
+    """
+    copied = 0
+    with open(source, "rb") as source_handle:
+        source_fd = source_handle.fileno()
+        size = os.fstat(source_fd).st_size
+        with open(dest, "wb") as dest_handle:
+            dest_fd = dest_handle.fileno()
+            if sparse:
+                for offset, length, is_data in get_file_extents(source_fd, size):
+                    if is_data:
+                        copied += _copy_fd(source_fd, dest_fd, offset, length)
+                # Trailing holes need the file size to be set explicitly
+                os.ftruncate(dest_fd, size)
+            else:
+                copied = _copy_fd(source_fd, dest_fd, 0, size)
+    if preserve_metadata:
+        shutil.copystat(source, dest)
+    return copied
+
+
+def _scan_dir(
+    path,  # type: str
+):
+    # type: (...) -> dict
+    """
+    Lists a directory and returns {name: (is_dir, size, mtime_ns, link_target)}
+    Symlinks are never followed, link_target being None for anything but symlinks
+    Non existing directories return an empty dict
+    """
+    entries = {}
+    try:
+        for entry in os.scandir(path):
+            try:
+                if entry.is_symlink():
+                    entries[entry.name] = (False, 0, 0, os.readlink(entry.path))
+                elif entry.is_dir(follow_symlinks=False):
+                    entries[entry.name] = (True, 0, 0, None)
+                elif entry.is_file(follow_symlinks=False):
+                    stat = entry.stat(follow_symlinks=False)
+                    entries[entry.name] = (
+                        False,
+                        stat.st_size,
+                        stat.st_mtime_ns,
+                        None,
+                    )
+            except OSError:
+                # Entry vanished or broken symlink
+                pass
+    except FileNotFoundError:
+        pass
+    return entries
+
+
+def compare_trees(
+    source,  # type: str
+    dest,  # type: str
+    checksum=False,  # type: bool
+    delete=True,  # type: bool
+    mtime_tolerance=0,  # type: float
+    d_exclude_list=None,  # type: list
+    f_exclude_list=None,  # type: list
+    fn_on_perm_error=None,  # type: Callable
+):
+    # type: (...) -> Iterable[dict]
+    """
+    Walks a source and a destination tree side by side and yields a plan to make dest a mirror of source
+    Both directory listings of a given level are done concurrently, so two different volumes are read in parallel
+
+    Files are matched by size and modification time
+    With checksum=True, files of identical size are compared with their sha256 sums, so files that only differ
+    by their modification time will only get a metadata update
+
+    Plan entries are dicts like {"action": "copy", "path": "relative/path"}, actions being:
+    - mkdir: create directory in dest
+    - copy: copy file from source to dest
+    - delete: remove file or directory tree from dest
+    - metadata: update dest file timestamps / permissions from source
+    - symlink: create symlink in dest with the same target as source symlink
+
+    Symlinks are never followed, they are compared by target and recreated as symlinks
+
+    Example:
+
+    plan = compare_trees('/mnt/volume1', '/mnt/volume2', d_exclude_list=['lost+found'])
+    apply_sync_plan(plan, '/mnt/volume1', '/mnt/volume2', workers=8)
+
+    :param source: (str) path of reference tree
+    :param dest: (str) path of tree to synchronize
+    :param checksum: (bool) verify file contents with sha256 sums instead of trusting modification times
+    :param delete: (bool) plan deletion of dest entries that don't exist in source
+    :param mtime_tolerance: (float) allowed modification time difference in seconds, useful for FAT filesystems
+    :param d_exclude_list: (list) list of root relative directory paths to exclude, glob wildcards allowed
+    :param f_exclude_list: (list) list of filenames without paths to exclude, glob wildcards allowed
+    :param fn_on_perm_error: (function) Optional function called with path on permission errors
+    :return: iterator of plan entries
+    """
+    if not os.path.isdir(source):
+        raise FileNotFoundError("{} is not a directory.".format(source))
+    source = os.path.normpath(source)
+    dest = os.path.normpath(dest)
+    if d_exclude_list is not None:
+        d_exclude_list = [os.path.normpath(dir) for dir in d_exclude_list]
+    tolerance_ns = int(mtime_tolerance * 1000000000)
+
+    if checksum:
+        # Late import since checksums depends on file_utils
+        from ofunctions.checksums import sha256sum
+
+    def _files_differ(rel_path, source_entry, dest_entry):
+        # type: (str, tuple, tuple) -> Optional[str]
+        mtime_differs = abs(source_entry[2] - dest_entry[2]) > tolerance_ns
+        if source_entry[1] != dest_entry[1]:
+            return "copy"
+        if checksum:
+            if sha256sum(os.path.join(source, rel_path)) != sha256sum(
+                os.path.join(dest, rel_path)
+            ):
+                return "copy"
+            return "metadata" if mtime_differs else None
+        return "copy" if mtime_differs else None
+
+    executor = ThreadPoolExecutor(max_workers=1)
+    try:
+        # Stack of (relative dir path, does the directory exist in dest)
+        dirs = [("", True)]
+        while dirs:
+            rel_dir, dest_exists = dirs.pop()
+            source_dir = os.path.join(source, rel_dir)
+            dest_future = (
+                executor.submit(_scan_dir, os.path.join(dest, rel_dir))
+                if dest_exists
+                else None
+            )
+            try:
+                source_entries = _scan_dir(source_dir)
+            except PermissionError:
+                if fn_on_perm_error is not None:
+                    fn_on_perm_error(source_dir)
+                else:
+                    log_perm_error(source_dir)
+                if dest_future is not None:
+                    dest_future.cancel()
+                continue
+            try:
+                dest_entries = dest_future.result() if dest_future else {}
+            except PermissionError:
+                dest_dir = os.path.join(dest, rel_dir)
+                if fn_on_perm_error is not None:
+                    fn_on_perm_error(dest_dir)
+                else:
+                    log_perm_error(dest_dir)
+                continue
+
+            sub_dirs = []
+            for name in sorted(set(source_entries) | set(dest_entries)):
+                rel_path = os.path.join(rel_dir, name) if rel_dir else name
+                source_entry = source_entries.get(name)
+                dest_entry = dest_entries.get(name)
+                is_dir = (source_entry or dest_entry)[0]
+                if (
+                    is_dir
+                    and d_exclude_list
+                    and glob_path_match(rel_path, d_exclude_list)
+                ):
+                    continue
+                if (
+                    not is_dir
+                    and f_exclude_list
+                    and glob_path_match(name, f_exclude_list)
+                ):
+                    continue
+
+                if source_entry is None:
+                    if delete:
+                        yield {"action": "delete", "path": rel_path}
+                    continue
+                if dest_entry is not None and (
+                    dest_entry[0] != source_entry[0]
+                    or (dest_entry[3] is None) != (source_entry[3] is None)
+                ):
+                    # Type changed between file, directory and symlink
+                    yield {"action": "delete", "path": rel_path}
+                    dest_entry = None
+
+                if source_entry[3] is not None:
+                    if dest_entry is None:
+                        yield {"action": "symlink", "path": rel_path}
+                    elif dest_entry[3] != source_entry[3]:
+                        yield {"action": "delete", "path": rel_path}
+                        yield {"action": "symlink", "path": rel_path}
+                elif source_entry[0]:
+                    if dest_entry is None:
+                        yield {"action": "mkdir", "path": rel_path}
+                    sub_dirs.append((rel_path, dest_entry is not None))
+                elif dest_entry is None:
+                    yield {"action": "copy", "path": rel_path}
+                else:
+                    action = _files_differ(rel_path, source_entry, dest_entry)
+                    if action:
+                        yield {"action": action, "path": rel_path}
+            # Keep alphabetical walk order since stack is LIFO
+            dirs.extend(reversed(sub_dirs))
+    finally:
+        executor.shutdown(wait=False)
+
+
+def apply_sync_plan(
+    plan,  # type: Iterable[dict]
+    source,  # type: str
+    dest,  # type: str
+    workers=4,  # type: int
+):
+    # type: (...) -> dict
+    """
+    Executes a plan given by compare_trees()
+    Directory creations and deletions are done in plan order, file copies and metadata updates
+    are dispatched to a pool of workers using zero-copy file copies
+
+    Errors do not stop the execution, they are logged and returned
+
+    :param plan: (iterable) plan entries as given by compare_trees()
+    :param source: (str) path of reference tree
+    :param dest: (str) path of tree to synchronize
+    :param workers: (int) number of concurrent copy workers
+    :return: (dict) counters per action, copied bytes and list of (path, error) tuples
+    """
+    stats = {
+        "mkdir": 0,
+        "copy": 0,
+        "delete": 0,
+        "metadata": 0,
+        "symlink": 0,
+        "bytes": 0,
+        "errors": [],
+    }
+    # Bound pending copies so huge plans don't end up in memory
+    max_pending = max(workers, 1) * 4
+
+    def _run(action, rel_path):
+        # type: (str, str) -> int
+        source_path = os.path.join(source, rel_path)
+        dest_path = os.path.join(dest, rel_path)
+        if action == "copy":
+            return copy_file(source_path, dest_path)
+        shutil.copystat(source_path, dest_path)
+        return 0
+
+    def _collect(futures):
+        for future in futures:
+            action, rel_path = pending.pop(future)
+            try:
+                stats["bytes"] += future.result()
+                stats[action] += 1
+            except (IOError, OSError) as exc:
+                logger.warning('Cannot {} "{}": {}'.format(action, rel_path, exc))
+                stats["errors"].append((rel_path, exc))
+
+    if not os.path.isdir(dest):
+        make_path(dest)
+    pending = {}
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        for entry in plan:
+            action = entry["action"]
+            rel_path = entry["path"]
+            if action in ("copy", "metadata"):
+                if len(pending) >= max_pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    _collect(done)
+                pending[executor.submit(_run, action, rel_path)] = (action, rel_path)
+                continue
+            dest_path = os.path.join(dest, rel_path)
+            try:
+                if action == "mkdir":
+                    os.makedirs(dest_path, exist_ok=True)
+                elif action == "symlink":
+                    os.symlink(os.readlink(os.path.join(source, rel_path)), dest_path)
+                elif action == "delete":
+                    if os.path.isdir(dest_path) and not os.path.islink(dest_path):
+                        shutil.rmtree(dest_path)
+                    else:
+                        os.remove(dest_path)
+                else:
+                    raise ValueError("Unknown plan action {}".format(action))
+                stats[action] += 1
+            except (IOError, OSError) as exc:
+                logger.warning('Cannot {} "{}": {}'.format(action, rel_path, exc))
+                stats["errors"].append((rel_path, exc))
+        _collect(list(pending))
+    return stats
+
+
+def _compile_glob_pattern(
+    pattern,  # type: str
+):
+    # type: (...) -> tuple
+    """
+    Splits a glob pattern into segments, every segment being either:
+    - "**" which matches any number of directories
+    - a plain string for literal names
+    - a compiled regex for names containing wildcards
+    """
+    segments = []
+    flags = re.IGNORECASE if os.name == "nt" else 0
+    for segment in pattern.replace(os.sep, "/").split("/"):
+        if segment in ("", "."):
+            continue
+        if segment == "**":
+            # Consecutive ** are equivalent to a single one
+            if not segments or segments[-1] != "**":
+                segments.append(segment)
+        elif any(char in segment for char in "*?["):
+            segments.append(re.compile(translate(segment), flags))
+        else:
+            segments.append(segment)
+    return tuple(segments)
+
+
+def glob_paths(
+    root,  # type: str
+    patterns,  # type: Union[str, list]
+    exclude_dirs=False,  # type: bool
+    exclude_files=False,  # type: bool
+    fn_on_perm_error=None,  # type: Callable
+):
+    # type: (...) -> Iterable[str]
+    """
+    Yields paths under root matching root relative glob patterns
+    Patterns support fnmatch wildcards per path segment, and ** which matches zero or more directories,
+    ex: 'var/log/**/app-*.log'
+
+    Patterns are run as a state machine while walking, so directories that cannot match any pattern are
+    never listed: literal path segments are resolved with a single stat instead of a directory listing,
+    and subtrees are pruned as soon as no pattern can match below them
+    Symlinked directories are matched, but only walked through when a literal pattern segment names them
+
+    Example:
+
+    for file in glob_paths('/', ['var/log/**/app-*.log', 'etc/*.conf'], exclude_dirs=True):
+        print(file)
+
+    :param root: (str) path to explore
+    :param patterns: (str/list) root relative glob pattern(s)
+    :param exclude_dirs: (bool) Exclude directories from results
+    :param exclude_files: (bool) Exclude files from results
+    :param fn_on_perm_error: (function) Optional function to pass, which argument will be the directory that
+           has permission errors so it can be handled
+           If not given, permission errors are logged
+    :return: iterator of matching paths
+    """
+    if os.path.isdir(root):
+        root = os.path.normpath(root)
+    else:
+        raise FileNotFoundError("{} is not a directory.".format(root))
+    if not isinstance(patterns, (list, tuple, set)):
+        patterns = [patterns]
+    compiled_patterns = [_compile_glob_pattern(pattern) for pattern in patterns]
+    case_insensitive = os.name == "nt"
+
+    def _closure(states):
+        # type: (set) -> frozenset
+        # ** may match zero directories, so the next segment is reachable too
+        result = set()
+        for pattern_index, segment_index in states:
+            segments = compiled_patterns[pattern_index]
+            while True:
+                result.add((pattern_index, segment_index))
+                if segment_index < len(segments) and segments[segment_index] == "**":
+                    segment_index += 1
+                else:
+                    break
+        return frozenset(result)
+
+    def _advance(states, name):
+        # type: (frozenset, str) -> frozenset
+        next_states = set()
+        for pattern_index, segment_index in states:
+            segments = compiled_patterns[pattern_index]
+            if segment_index >= len(segments):
+                continue
+            segment = segments[segment_index]
+            if segment == "**":
+                next_states.add((pattern_index, segment_index))
+            elif isinstance(segment, str):
+                if (
+                    segment.lower() == name.lower()
+                    if case_insensitive
+                    else segment == name
+                ):
+                    next_states.add((pattern_index, segment_index + 1))
+            elif segment.match(name):
+                next_states.add((pattern_index, segment_index + 1))
+        return _closure(next_states)
+
+    def _literal_names(states):
+        # type: (frozenset) -> Optional[set]
+        # Returns the set of possible child names when no wildcard is involved at this level
+        names = set()
+        for pattern_index, segment_index in states:
+            segments = compiled_patterns[pattern_index]
+            if segment_index >= len(segments):
+                continue
+            segment = segments[segment_index]
+            if not isinstance(segment, str) or segment == "**":
+                return None
+            names.add(segment)
+        return names
+
+    def _children(directory, states):
+        # type: (str, frozenset) -> Iterable[tuple]
+        # Yields (name, is_dir, may_descend) tuples of directory entries that are worth looking at
+        # Literal segments are finite so they may go through symlinked directories, but listed
+        # symlinked directories are never walked, otherwise ** would loop on symlinks to parents
+        literal_names = _literal_names(states)
+        if literal_names is not None:
+            for name in sorted(literal_names):
+                try:
+                    mode = os.stat(os.path.join(directory, name)).st_mode
+                except OSError:
+                    continue
+                yield name, stat.S_ISDIR(mode), stat.S_ISDIR(mode)
+            return
+        try:
+            entries = sorted(os.scandir(directory), key=lambda entry: entry.name)
+        except PermissionError:
+            if fn_on_perm_error is not None:
+                fn_on_perm_error(directory)
+            else:
+                log_perm_error(directory)
+            return
+        except OSError:
+            return
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+                yield entry.name, is_dir, is_dir and not entry.is_symlink()
+            except OSError:
+                continue
+
+    initial_states = _closure(
+        set((pattern_index, 0) for pattern_index in range(len(compiled_patterns)))
+    )
+    stack = [(root, initial_states)]
+    while stack:
+        directory, states = stack.pop()
+        sub_dirs = []
+        for name, is_dir, may_descend in _children(directory, states):
+            next_states = _advance(states, name)
+            if not next_states:
+                continue
+            path = os.path.join(directory, name)
+            if any(
+                segment_index == len(compiled_patterns[pattern_index])
+                for pattern_index, segment_index in next_states
+            ):
+                if (is_dir and not exclude_dirs) or (not is_dir and not exclude_files):
+                    yield path
+            if may_descend and any(
+                segment_index < len(compiled_patterns[pattern_index])
+                for pattern_index, segment_index in next_states
+            ):
+                sub_dirs.append((path, next_states))
+        stack.extend(reversed(sub_dirs))
+
+
 def replace_in_file(
     source_file,  # type: str
     text_to_search,  # type: str
@@ -775,6 +1390,218 @@ def grep(
     return result
 
 
+# inotify constants from sys/inotify.h
+_IN_MODIFY = 0x00000002
+_IN_ATTRIB = 0x00000004
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+
+
+def _inotify_watch_dir(
+    directory,  # type: str
+):
+    # type: (...) -> Optional[int]
+    """
+    Returns a non blocking inotify file descriptor watching a directory for file changes
+    or None if inotify isn't available
+    """
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        import ctypes
+        import ctypes.util
+
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        inotify_fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if inotify_fd < 0:
+            return None
+        watch = libc.inotify_add_watch(
+            inotify_fd,
+            os.fsencode(directory),
+            _IN_MODIFY
+            | _IN_ATTRIB
+            | _IN_MOVED_FROM
+            | _IN_MOVED_TO
+            | _IN_CREATE
+            | _IN_DELETE,
+        )
+        if watch < 0:
+            os.close(inotify_fd)
+            return None
+        return inotify_fd
+    except (OSError, AttributeError):
+        return None
+
+
+def follow_file(
+    file,  # type: str
+    from_beginning=False,  # type: bool
+    encoding="utf-8",  # type: str
+    errors="replace",  # type: str
+    timeout=None,  # type: Optional[float]
+    poll_interval=0.1,  # type: float
+    max_poll_interval=1.0,  # type: float
+    buffer_size=65536,  # type: int
+    use_inotify=True,  # type: bool
+):
+    # type: (...) -> Iterable[str]
+    """
+    tail -F emulation: yields lines as they get appended to a file
+    Follows file rotation (rename / recreate like RotatingFileHandler does) by checking inode changes,
+    and truncation by checking file size
+
+    Waits for changes with inotify when available, otherwise uses polling which interval doubles up to
+    max_poll_interval while the file stays idle
+    Data is read into a single reusable buffer, lines keep their trailing newline like file iteration does
+    A last line without trailing newline is yielded once the file gets rotated or timeout is reached
+
+    Example:
+
+    for line in follow_file('/var/log/myapp.log', timeout=3600):
+        print(line, end='')
+
+    :param file: (str) path to file to follow, doesn't need to exist yet
+    :param from_beginning: (bool) read existing file content instead of starting at its end
+    :param encoding: (str) file encoding
+    :param errors: (str) decoding error handler
+    :param timeout: (float) stop following after timeout seconds without new data, None = follow forever
+    :param poll_interval: (float) initial polling interval in seconds
+    :param max_poll_interval: (float) maximum polling interval in seconds, also used as safety
+                              wakeup when inotify is used
+    :param buffer_size: (int) read buffer size
+    :param use_inotify: (bool) use inotify when available
+    :return: iterator of lines
+    """
+    file = os.path.abspath(file)
+    inotify_fd = (
+        _inotify_watch_dir(os.path.dirname(file) or os.curdir) if use_inotify else None
+    )
+    buffer = bytearray(buffer_size)
+    buffer_view = memoryview(buffer)
+    pending = bytearray()
+    file_handle = None
+    file_inode = None
+    position = 0
+    skip_to_end = not from_beginning
+    wait_time = poll_interval
+    last_data_time = time.monotonic()
+
+    def _open():
+        # type: () -> bool
+        nonlocal file_handle, file_inode, position, skip_to_end
+        try:
+            file_handle = open(file, "rb", buffering=0)
+        except (FileNotFoundError, PermissionError):
+            # A file that doesn't exist yet will be read from its beginning once created
+            skip_to_end = False
+            return False
+        stat = os.fstat(file_handle.fileno())
+        file_inode = (stat.st_dev, stat.st_ino)
+        position = file_handle.seek(0, os.SEEK_END) if skip_to_end else 0
+        # Files created or rotated after we started are always read from their beginning
+        skip_to_end = False
+        return True
+
+    def _lines():
+        # type: () -> Iterable[str]
+        nonlocal position
+        while True:
+            read_bytes = file_handle.readinto(buffer)
+            if not read_bytes:
+                return
+            position += read_bytes
+            pending.extend(buffer_view[:read_bytes])
+            end = pending.rfind(b"\n")
+            if end < 0:
+                continue
+            start = 0
+            with memoryview(pending) as pending_view:
+                while start <= end:
+                    line_end = pending.find(b"\n", start) + 1
+                    yield str(pending_view[start:line_end], encoding, errors)
+                    start = line_end
+            del pending[: end + 1]
+
+    def _leftover():
+        # type: () -> Iterable[str]
+        # Last line of a file without trailing newline
+        if pending:
+            line = pending.decode(encoding, errors)
+            del pending[:]
+            yield line
+
+    def _rotated():
+        # type: () -> bool
+        nonlocal position
+        try:
+            stat = os.stat(file)
+        except (FileNotFoundError, PermissionError):
+            # File is being rotated, keep reading the old one until the new one appears
+            return False
+        if (stat.st_dev, stat.st_ino) != file_inode:
+            return True
+        if stat.st_size < position:
+            # Truncated file, restart from beginning
+            file_handle.seek(0)
+            position = 0
+            del pending[:]
+        return False
+
+    try:
+        while True:
+            got_data = False
+            if file_handle is None:
+                _open()
+            if file_handle is not None:
+                for line in _lines():
+                    got_data = True
+                    yield line
+                if _rotated():
+                    # Drain what has been written to the old file before rotation
+                    for line in _lines():
+                        yield line
+                    for line in _leftover():
+                        yield line
+                    file_handle.close()
+                    file_handle = None
+                    got_data = _open()
+
+            if got_data:
+                wait_time = poll_interval
+                last_data_time = time.monotonic()
+                continue
+            if timeout is not None and time.monotonic() - last_data_time >= timeout:
+                for line in _leftover():
+                    yield line
+                return
+            if inotify_fd is not None:
+                wait_time = max_poll_interval
+                if timeout is not None:
+                    wait_time = min(
+                        wait_time, timeout - (time.monotonic() - last_data_time)
+                    )
+                readable, _, _ = select.select([inotify_fd], [], [], wait_time)
+                if readable:
+                    try:
+                        # We don't need event details, just drain the queue
+                        while os.read(inotify_fd, 65536):
+                            pass
+                    except BlockingIOError:
+                        pass
+            else:
+                time.sleep(wait_time)
+                wait_time = min(wait_time * 2, max_poll_interval)
+    finally:
+        if file_handle is not None:
+            file_handle.close()
+        if inotify_fd is not None:
+            os.close(inotify_fd)
+
+
 def hide_windows_file(
     file,  # type: str
     hidden=True,  # type: bool
@@ -877,4 +1704,4 @@ def sanitize_filename(file: str) -> str:
     """
     Sanitizes a filename so we're sure it can be used on all platforms
     """
-    return "".join(x if x.isalnum() else "_" for x in file)
\ No newline at end of file
+    return "".join(x if x.isalnum() else "_" for x in file)
@@ -18,14 +18,23 @@ __author__ = "Orsiris de Jong"
 __copyright__ = "Copyright (C) 2014-2024 Orsiris de Jong"
 __description__ = "Network diagnostics, MTU probing, Public IP discovery, HTTP/HTTPS internet connectivity tests, ping, name resolution..."
 __licence__ = "BSD 3 Clause"
-__version__ = "1.6.3"
-__build__ = "2025051601"
+__version__ = "1.7.0"
+__build__ = "2026101901"
 __compat__ = "python2.7+"
 
 import logging
+import math
 import os
+import random
+import re
+import select
 import socket
+import struct
+import sys
+import threading
 import warnings
+from array import array
+from concurrent.futures import as_completed, wait
 from ipaddress import IPv4Address, IPv6Address, AddressValueError
 import time
 import psutil
@@ -35,7 +44,6 @@ from command_runner import command_runner
 from requests import get
 import urllib3.util.connection as requests_connection
 
-from ofunctions import bisection
 from ofunctions.threading import threaded, wait_for_threaded_result
 from ofunctions.misc import BytesConverter
 
@@ -49,6 +57,353 @@ except ImportError:
 
 logger = logging.getLogger(__intname__)
 
+# How often (seconds) running ping processes check whether they should be stopped
+PING_CHECK_INTERVAL = 0.05
+
+# MTUs probed first by probe_mtu()
+COMMON_MTUS = [1492, 1500, 9000]
+# Number of MTUs probed concurrently per probe_mtu() round
+MTU_PROBE_CANDIDATES = 16
+# Seconds probe_mtu() results are cached per destination
+MTU_CACHE_TTL = 600
+
+# (target, source_interface, min, max): (mtu, monotonic timestamp)
+_mtu_cache = {}
+_mtu_cache_lock = threading.Lock()
+
+ICMP_ECHO_REPLY = 0
+ICMP_ECHO_REQUEST = 8
+ICMPV6_ECHO_REQUEST = 128
+ICMPV6_ECHO_REPLY = 129
+
+# Linux setsockopt values which aren't exposed by socket module
+IP_MTU_DISCOVER = 10
+IPV6_MTU_DISCOVER = 23
+IP_PMTUDISC_DO = 2
+# macOS equivalent
+IP_DONTFRAG = 28
+
+
+def _icmp_checksum(data):
+    # type: (bytes) -> int
+    """
+    RFC 1071 internet checksum
+    One's complement sum does not depend on byte order, so we can sum native 16 bits words
+    """
+    if len(data) % 2:
+        data += b"\x00"
+    checksum = sum(array("H", data))
+    checksum = (checksum >> 16) + (checksum & 0xFFFF)
+    checksum += checksum >> 16
+    return ~checksum & 0xFFFF
+
+
+def _icmp_echo_packet(family, identifier, sequence, payload_size):
+    # type: (int, int, int, int) -> bytes
+    """
+    Builds an ICMP (or ICMPv6) echo request with a payload_size bytes payload
+    ICMPv6 checksums are computed by the kernel since they include the IPv6 pseudo header
+    """
+    payload = (bytes(range(256)) * (payload_size // 256 + 1))[:payload_size]
+    if family == socket.AF_INET6:
+        return (
+            struct.pack("!BBHHH", ICMPV6_ECHO_REQUEST, 0, 0, identifier, sequence)
+            + payload
+        )
+    header = struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, 0, identifier, sequence)
+    checksum = _icmp_checksum(header + payload)
+    # checksum was computed on native words, so it must be packed in native order
+    return header[:2] + struct.pack("H", checksum) + header[4:] + payload
+
+
+def _resolve_icmp_target(target, ip_type=None):
+    # type: (Union[str, IPv4Address, IPv6Address], Optional[int]) -> Tuple[int, tuple]
+    """
+    Returns address family and socket address of target
+    Raises socket.gaierror when target cannot be resolved
+    """
+    if ip_type == 4:
+        family = socket.AF_INET
+    elif ip_type == 6:
+        family = socket.AF_INET6
+    else:
+        family = socket.AF_UNSPEC
+    address_info = socket.getaddrinfo(
+        str(target), None, family, socket.SOCK_RAW, socket.IPPROTO_ICMP
+    )
+    return address_info[0][0], address_info[0][4]
+
+
+def _set_do_not_fragment(sock, family):
+    # type: (socket.socket, int) -> None
+    if sys.platform.startswith("linux"):
+        if family == socket.AF_INET6:
+            sock.setsockopt(socket.IPPROTO_IPV6, IPV6_MTU_DISCOVER, IP_PMTUDISC_DO)
+        else:
+            sock.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER, IP_PMTUDISC_DO)
+    elif family == socket.AF_INET6:
+        sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_DONTFRAG, 1)
+    else:
+        sock.setsockopt(socket.IPPROTO_IP, IP_DONTFRAG, 1)
+
+
+def _open_icmp_socket(family, do_not_fragment=False, source_interface=None):
+    # type: (int, bool, Optional[str]) -> Tuple[socket.socket, bool]
+    """
+    Opens an unprivileged ICMP datagram socket (Linux with net.ipv4.ping_group_range, macOS)
+    or a raw socket when privileged
+
+    Returns socket and whether it is a raw socket
+    Raises OSError when no ICMP socket can be opened, so callers can fallback to ping subprocesses
+    """
+    protocol = (
+        socket.IPPROTO_ICMPV6 if family == socket.AF_INET6 else socket.IPPROTO_ICMP
+    )
+    try:
+        sock = socket.socket(family, socket.SOCK_DGRAM, protocol)
+        raw = False
+    except OSError:
+        sock = socket.socket(family, socket.SOCK_RAW, protocol)
+        raw = True
+    try:
+        if do_not_fragment:
+            _set_do_not_fragment(sock, family)
+        if source_interface:
+            try:
+                (
+                    IPv4Address(source_interface)
+                    if family == socket.AF_INET
+                    else IPv6Address(source_interface)
+                )
+                sock.bind((source_interface, 0))
+            except ValueError:
+                sock.setsockopt(
+                    socket.SOL_SOCKET,
+                    socket.SO_BINDTODEVICE,
+                    source_interface.encode("utf-8"),
+                )
+    except (OSError, AttributeError) as exc:
+        sock.close()
+        raise OSError("Cannot set ICMP socket options: {}".format(exc)) from exc
+    return sock, raw
+
+
+def _parse_icmp_reply(family, data):
+    # type: (int, bytes) -> Optional[Tuple[int, int]]
+    """
+    Returns identifier and sequence of an echo reply, or None if data isn't an echo reply
+    IPv4 raw sockets (and macOS datagram sockets) also give us the IP header
+    """
+    if family == socket.AF_INET and data and data[0] >> 4 == 4:
+        data = data[(data[0] & 0x0F) * 4 :]
+    if len(data) < 8:
+        return None
+    icmp_type, _, _, identifier, sequence = struct.unpack("!BBHHH", data[:8])
+    if icmp_type != (
+        ICMPV6_ECHO_REPLY if family == socket.AF_INET6 else ICMP_ECHO_REPLY
+    ):
+        return None
+    return identifier, sequence
+
+
+def icmp_echo(
+    target,  # type: Union[str, IPv4Address, IPv6Address]
+    payload_sizes=56,  # type: Union[int, List[int]]
+    timeout=4,  # type: float
+    interval=1,  # type: float
+    ip_type=None,  # type: Optional[int]
+    do_not_fragment=False,  # type: bool
+    source_interface=None,  # type: Optional[str]
+    first_reply_only=False,  # type: bool
+    stop_event=None,  # type: Optional[threading.Event]
+):
+    # type: (...) -> List[Optional[float]]
+    """
+    Native ICMP echo without ping subprocesses
+
+    Sends one echo request per payload size from a single socket, interval seconds apart,
+    and matches replies by identifier / sequence
+    Datagram ICMP sockets get their identifier rewritten by the kernel, which already
+    filters replies per socket, so we only match sequence numbers for those
+
+    payload_sizes: ICMP payload size, or list of payload sizes, one per echo request
+    timeout: seconds to wait for each reply
+    first_reply_only: return as soon as one reply is received
+    stop_event: optional threading.Event which aborts probing once set
+
+    Returns list of round trip times in milliseconds, None for lost probes
+    Raises OSError when no ICMP socket can be opened (unprivileged without ping_group_range, Windows...)
+    """
+    if not isinstance(payload_sizes, list):
+        payload_sizes = [payload_sizes]
+    rtts = [None] * len(payload_sizes)  # type: List[Optional[float]]
+
+    try:
+        family, address = _resolve_icmp_target(target, ip_type)
+    except (socket.gaierror, UnicodeError) as exc:
+        logger.debug("Cannot resolve ICMP target {}: {}".format(target, exc))
+        return rtts
+
+    sock, raw = _open_icmp_socket(family, do_not_fragment, source_interface)
+    try:
+        identifier = random.getrandbits(16)
+        first_sequence = random.getrandbits(16)
+        # sequence: (send time, probe index)
+        pending = {}
+        index = 0
+        next_send = time.perf_counter()
+        deadline = None
+        while True:
+            if stop_event is not None and stop_event.is_set():
+                break
+            now = time.perf_counter()
+            sending = index < len(payload_sizes)
+            if not sending and (not pending or now >= deadline):
+                break
+            wait = (next_send if sending else deadline) - now
+            if stop_event is not None:
+                wait = min(wait, PING_CHECK_INTERVAL)
+            # Replies are always read before sending next request, so bursts of large
+            # echo replies don't overflow the socket receive buffer
+            readable, _, _ = select.select([sock], [], [], max(wait, 0))
+            if readable:
+                try:
+                    data, source = sock.recvfrom(65535)
+                except OSError:
+                    continue
+                receive_time = time.perf_counter()
+                reply = _parse_icmp_reply(family, data)
+                if (
+                    reply is None
+                    or (raw and reply[0] != identifier)
+                    or reply[1] not in pending
+                    or source[0] != address[0]
+                ):
+                    continue
+                send_time, probe_index = pending.pop(reply[1])
+                if receive_time - send_time <= timeout:
+                    rtts[probe_index] = (receive_time - send_time) * 1000
+                    if first_reply_only:
+                        break
+                continue
+            if sending and time.perf_counter() >= next_send:
+                sequence = (first_sequence + index) & 0xFFFF
+                packet = _icmp_echo_packet(
+                    family, identifier, sequence, payload_sizes[index]
+                )
+                now = time.perf_counter()
+                try:
+                    sock.sendto(packet, address)
+                    pending[sequence] = (now, index)
+                except OSError as exc:
+                    # Message too long with DF set, network unreachable...
+                    logger.debug(
+                        "Cannot send ICMP echo to {} with {} bytes payload: {}".format(
+                            target, payload_sizes[index], exc
+                        )
+                    )
+                index += 1
+                next_send = now + interval
+                deadline = now + timeout
+    finally:
+        sock.close()
+    return rtts
+
+
+def _get_ping_command(
+    target,  # type: Union[str, IPv4Address, IPv6Address]
+    count,  # type: int
+    payload_size,  # type: int
+    timeout,  # type: float
+    interval,  # type: float
+    ip_type,  # type: Optional[int]
+    do_not_fragment,  # type: bool
+    source_interface,  # type: Optional[str]
+):
+    # type: (...) -> Tuple[str, str]
+    """
+    Builds platform specific ping command sending count echo requests
+    Returns command and its output encoding
+    """
+    if is_macos:
+        # -c ...: number of packets to send
+        # -s ...: packet size to send
+        # -i ...: interval (s), only root can set less than .2 seconds
+        # -W ...: timeout (s)
+        # -I ...: optional source interface name
+        # -D ...: do not fragment
+        if ip_type == 6:
+            command = "ping6 -c {} -s {} -i {}".format(count, payload_size, interval)
+        else:
+            command = "ping -c {} -s {} -W {} -i {}".format(
+                count, payload_size, timeout, interval
+            )
+            if do_not_fragment:
+                command += " -D"
+
+        encoding = "utf-8"
+    elif os.name == "nt":
+        # -4/-6: IPType
+        # -n ...: number of packets to send
+        # -f: do not fragment
+        # -l ...: packet size to send
+        # -w ...: timeout (ms)
+        # -S ...: optional source addr (IP) (which binds to source interface)
+        command = "ping -n {} -l {} -w {}".format(
+            count, payload_size, int(timeout * 1000)
+        )
+
+        # IPv6 does not allow to set fragmentation
+        if do_not_fragment and ip_type != 6:
+            command += " -f"
+        encoding = "cp437"
+    else:
+        # -4/-6: IPType
+        # -c ...: number of packets to send
+        # -M do: do not fragment
+        # -s ...: packet size to send
+        # -i ...: interval (s), only root can set less than .2 seconds
+        # -W ...: timeout (s)
+        # -I ...: optional source interface name
+        command = "ping -c {} -s {} -W {} -i {}".format(
+            count, payload_size, timeout, interval
+        )
+
+        # IPv6 does not allow to set fragmentation
+        if do_not_fragment and ip_type != 6:
+            command += " -M do"
+        encoding = "utf-8"
+
+    # Add ip_type if specified
+    if ip_type and not is_macos:
+        command += " -{}".format(ip_type)
+
+    if source_interface:
+        # Try to detect what kind of source we're dealing with, IP address or interface name
+        try:
+            IPv6Address(source_interface)
+            source_type = "ip"
+        except ValueError:
+            try:
+                IPv4Address(source_interface)
+                source_type = "ip"
+            except ValueError:
+                source_type = "iface"
+
+        if source_type == "ip":
+            if os.name != "nt":
+                raise ValueError("Source address does only work on Windows platform")
+            # -S
+            command += " -S {}".format(source_interface)
+
+        if source_type == "iface":
+            if os.name == "nt":
+                raise ValueError("Source interface does not work on Windows platform")
+            command += " -I {}".format(source_interface)
+
+    command += " {}".format(target)
+    return command, encoding
+
 
 def ping(
     targets=None,
@@ -61,17 +416,26 @@ def ping(
     do_not_fragment=False,  # type: bool
     all_targets_must_succeed=False,  # type: bool
     source_interface=None,  # type : str
+    method="auto",  # type: str
 ):
     # type: (...) -> bool
     """
     Tests if ICMP ping works
     IF all targets_must_succeed is False, at least one good result gives a positive result
 
+    All targets are pinged concurrently. In any target mode, remaining pings are cancelled
+    on first success, and with all_targets_must_succeed they are cancelled on first failure,
+    so a call takes at most one target worth of retries * timeout
+
     targets: can be a list of targets, or a single targets
     timeout: is in seconds
     interval: is in seconds seconds, linux only
+    method: "native" uses ICMP sockets, "subprocess" runs ping command, "auto" uses ICMP sockets
+            when allowed to open them, and falls back to ping command otherwise
 
     """
+    if method not in ["auto", "native", "subprocess"]:
+        raise ValueError("Unknown ping method {}.".format(method))
 
     icmp_overhead = 8 + 20
     mtu_encapsulated = mtu - icmp_overhead
@@ -79,8 +443,6 @@ def ping(
     # Let's have a maximum process timeout for subprocess of 5 seconds extra on top of the ping timeout
     # timeout is in seconds (int)
     command_timeout = int(timeout + 5)
-    # windows uses timeout in milliseconds
-    windows_timeout = timeout * 1000
 
     if mtu_encapsulated < 0:
         raise ValueError("MTU cannot be lower than {}.".format(icmp_overhead))
@@ -90,112 +452,226 @@ def ping(
         targets = ["1.1.1.1", "8.8.8.8", "208.67.222.222"]
 
     def _ping_host(target, retries, source_interface):
-        if is_macos:
-            # -c ...: number of packets to send
-            # -s ...: packet size to send
-            # -i ...: interval (s), only root can set less than .2 seconds
-            # -W ...: timeout (s)
-            # -I ...: optional source interface name
-            # -D ...: do not fragment
-            if ip_type == 6:
-                command = "ping6 -c 1 -s {} -i {}".format(mtu_encapsulated, interval)
-            else:
-                command = "ping -c 1 -s {} -W {} -i {}".format(
-                    mtu_encapsulated, timeout, interval
-                )
-                if do_not_fragment:
-                    command += " -D"
-
-            encoding = "utf-8"
-        elif os.name == "nt":
-            # -4/-6: IPType
-            # -n ...: number of packets to send
-            # -f: do not fragment
-            # -l ...: packet size to send
-            # -w ...: timeout (ms)
-            # -S ...: optional source addr (IP) (which binds to source interface)
-            command = "ping -n 1 -l {} -w {}".format(mtu_encapsulated, windows_timeout)
-
-            # IPv6 does not allow to set fragmentation
-            if do_not_fragment and ip_type != 6:
-                command += " -f"
-            encoding = "cp437"
-        else:
-            # -4/-6: IPType
-            # -c ...: number of packets to send
-            # -M do: do not fragment
-            # -s ...: packet size to send
-            # -i ...: interval (s), only root can set less than .2 seconds
-            # -W ...: timeout (s)
-            # -I ...: optional source interface name
-            command = "ping -c 1 -s {} -W {} -i {}".format(
-                mtu_encapsulated, timeout, interval
-            )
-
-            # IPv6 does not allow to set fragmentation
-            if do_not_fragment and ip_type != 6:
-                command += " -M do"
-            encoding = "utf-8"
-
-        # Add ip_type if specified
-        if ip_type and not is_macos:
-            command += " -{}".format(ip_type)
-
-        if source_interface:
-            # Try to detect what kind of source we're dealing with, IP address or interface name
+        if method != "subprocess":
             try:
-                IPv6Address(source_interface)
-                source_type = "ip"
-            except ValueError:
-                try:
-                    IPv4Address(source_interface)
-                    source_type = "ip"
-                except ValueError:
-                    source_type = "iface"
-
-            if source_type == "ip":
-                if os.name != "nt":
-                    raise ValueError(
-                        "Source address does only work on Windows platform"
-                    )
-                # -S
-                command += " -S {}".format(source_interface)
-
-            if source_type == "iface":
-                if os.name == "nt":
-                    raise ValueError(
-                        "Source interface does not work on Windows platform"
+                # Retries are sent interval seconds apart from the same socket, first reply wins
+                rtts = icmp_echo(
+                    target,
+                    [mtu_encapsulated] * retries,
+                    timeout=timeout,
+                    interval=interval,
+                    ip_type=ip_type,
+                    do_not_fragment=do_not_fragment,
+                    source_interface=source_interface,
+                    first_reply_only=True,
+                    stop_event=stop_event,
+                )
+                return any(rtt is not None for rtt in rtts)
+            except OSError as exc:
+                if method == "native":
+                    raise
+                logger.debug(
+                    "Cannot use native ICMP, falling back to ping command: {}".format(
+                        exc
                     )
-                command += " -I {}".format(source_interface)
+                )
 
-        command += " {}".format(target)
-        result = False
-        while retries > 0 and not result:
+        command, encoding = _get_ping_command(
+            target,
+            1,
+            mtu_encapsulated,
+            timeout,
+            interval,
+            ip_type,
+            do_not_fragment,
+            source_interface,
+        )
+        while retries > 0 and not stop_event.is_set():
+            # stop_on allows to kill running ping processes once the overall result is known
             exit_code, output = command_runner(
-                command, timeout=command_timeout, encoding=encoding
+                command,
+                timeout=command_timeout,
+                encoding=encoding,
+                stop_on=stop_event.is_set,
+                check_interval=PING_CHECK_INTERVAL,
             )
             if exit_code == 0:
                 return True
             retries -= 1
         return False
 
-    if all_targets_must_succeed:
-        all_ping_results = True
-    else:
-        all_ping_results = False
-
     # Handle the case when a user gives a single target instead of a list
-    for target in targets if isinstance(targets, list) else [targets]:
-        if _ping_host(target, retries, source_interface):
-            if not all_targets_must_succeed:
-                all_ping_results = True
-                break
+    if not isinstance(targets, list):
+        targets = [targets]
+
+    # All targets are pinged concurrently, the first result that decides the overall
+    # result (first success, or first failure when all targets must succeed) stops the others
+    stop_event = threading.Event()
+    thread_list = [
+        threaded(_ping_host)(target, retries, source_interface) for target in targets
+    ]
+    try:
+        for thread in as_completed(thread_list):
+            if thread.result():
+                if not all_targets_must_succeed:
+                    return True
+            else:
+                if all_targets_must_succeed:
+                    return False
+    finally:
+        stop_event.set()
+    return all_targets_must_succeed
+
+
+def _parse_ping_output(output, count):
+    # type: (str, int) -> List[Optional[float]]
+    """
+    Extracts per probe round trip times (ms) from ping command output, None for lost probes
+    Windows ping does not print sequence numbers, so its replies are assigned in order
+    Windows ping output is localized, so its reply lines are found by their TTL= field, or for IPv6
+    replies which have no TTL field by their single value in ms (statistics lines have three)
+    Round trip time is the first value in ms, ie time=12ms, temps<1ms or Zeit=3ms
+    """
+    rtts = [None] * count  # type: List[Optional[float]]
+    # macOS ping sequences start at 0, linux ping sequences start at 1
+    first_sequence = 0 if is_macos else 1
+    reply_index = 0
+    for line in (output or "").splitlines():
+        sequence = re.search(r"icmp_seq=(\d+)", line)
+        if sequence:
+            values = re.findall(r"time[=<]\s*([\d.]+)\s*ms", line)
+            index = int(sequence.group(1)) - first_sequence
         else:
-            if all_targets_must_succeed:
-                all_ping_results = False
-                break
+            values = re.findall(r"[=<]\s*(\d+(?:[.,]\d+)?)\s*ms", line)
+            if "TTL=" not in line.upper() and len(values) != 1:
+                continue
+            index = reply_index
+        if not values:
+            continue
+        reply_index += 1
+        # Duplicate replies are ignored
+        if 0 <= index < count and rtts[index] is None:
+            rtts[index] = float(values[0].replace(",", "."))
+    return rtts
+
+
+def _get_ping_statistics(target, rtts):
+    # type: (Union[str, IPv4Address, IPv6Address], List[Optional[float]]) -> dict
+    """
+    Computes ping like statistics from a round trip time list
+    mdev is computed the same way linux ping does, sqrt(mean(rtt²) - mean(rtt)²)
+    """
+    replies = [rtt for rtt in rtts if rtt is not None]
+    statistics = {
+        "target": str(target),
+        "sent": len(rtts),
+        "received": len(replies),
+        "loss": 100.0 * (len(rtts) - len(replies)) / len(rtts) if rtts else 100.0,
+        "min": None,
+        "avg": None,
+        "max": None,
+        "mdev": None,
+        # Packed doubles, lost probes are NaN
+        "rtts": array("d", (float("nan") if rtt is None else rtt for rtt in rtts)),
+    }
+    if replies:
+        average = sum(replies) / len(replies)
+        square_average = sum(rtt * rtt for rtt in replies) / len(replies)
+        statistics["min"] = min(replies)
+        statistics["avg"] = average
+        statistics["max"] = max(replies)
+        statistics["mdev"] = math.sqrt(max(square_average - average * average, 0))
+    return statistics
+
+
+def ping_stats(
+    targets=None,
+    # type: Union[Iterable[Union[str, IPv4Address, IPv6Address]], Union[str, IPv4Address, IPv6Address]]
+    count=10,  # type: int
+    mtu=84,  # type: int
+    timeout=4,  # type: float
+    interval=1,  # type: float
+    ip_type=None,  # type: int
+    do_not_fragment=False,  # type: bool
+    source_interface=None,  # type: str
+    method="auto",  # type: str
+):
+    # type: (...) -> Union[dict, List[dict]]
+    """
+    Sends count ICMP echo requests per target in a single session (one socket or one ping process)
+    and returns ping like statistics instead of a bool
+
+    Targets are probed concurrently
+    Default mtu of 84 bytes gives the usual 56 bytes ping payload
+
+    Returns a dict for a single target, or a list of dicts for a target list, with keys
+        target, sent, received, loss (percent), min / avg / max / mdev (ms, None without replies)
+        rtts: array('d') of per probe round trip times in ms, NaN for lost probes
+    """
+    if method not in ["auto", "native", "subprocess"]:
+        raise ValueError("Unknown ping method {}.".format(method))
+
+    icmp_overhead = 8 + 20
+    mtu_encapsulated = mtu - icmp_overhead
+
+    if mtu_encapsulated < 0:
+        raise ValueError("MTU cannot be lower than {}.".format(icmp_overhead))
+    if count < 1:
+        raise ValueError("At least one probe is required.")
+
+    if targets is None:
+        # Cloudflare, Google and OpenDNS dns servers
+        targets = ["1.1.1.1", "8.8.8.8", "208.67.222.222"]
+
+    @threaded
+    def _ping_host_stats(target):
+        if method != "subprocess":
+            try:
+                rtts = icmp_echo(
+                    target,
+                    [mtu_encapsulated] * count,
+                    timeout=timeout,
+                    interval=interval,
+                    ip_type=ip_type,
+                    do_not_fragment=do_not_fragment,
+                    source_interface=source_interface,
+                )
+                return _get_ping_statistics(target, rtts)
+            except OSError as exc:
+                if method == "native":
+                    raise
+                logger.debug(
+                    "Cannot use native ICMP, falling back to ping command: {}".format(
+                        exc
+                    )
+                )
+
+        command, encoding = _get_ping_command(
+            target,
+            count,
+            mtu_encapsulated,
+            timeout,
+            interval,
+            ip_type,
+            do_not_fragment,
+            source_interface,
+        )
+        # Give the ping process enough time to send all probes and wait for the last reply
+        exit_code, output = command_runner(
+            command,
+            timeout=int(count * interval + timeout + 5),
+            encoding=encoding,
+        )
+        # command_runner exit code when the command cannot be found, which must not look like packet loss
+        if exit_code == -253:
+            raise OSError("Cannot run ping command: {}".format(output))
+        return _get_ping_statistics(target, _parse_ping_output(output, count))
 
-    return all_ping_results
+    if isinstance(targets, list):
+        thread_list = [_ping_host_stats(target) for target in targets]
+        wait(thread_list)
+        return [thread.result() for thread in thread_list]
+    return _ping_host_stats(targets).result()
 
 
 def resolve_hostname(host):
@@ -443,13 +919,92 @@ def get_public_hostname(ip=None):
     return None
 
 
+def _probe_mtu_candidates(
+    target,  # type: Union[str, IPv4Address, IPv6Address]
+    candidates,  # type: List[int]
+    ip_type,  # type: int
+    source_interface,  # type: Optional[str]
+    interval,  # type: float
+    timeout,  # type: float
+    retries,  # type: int
+    native,  # type: bool
+):
+    # type: (...) -> List[int]
+    """
+    Concurrently probes all candidate MTUs with do not fragment bit set
+    Returns MTUs which got at least one reply
+
+    Native probes are sent as one burst of echo requests per retry, retry bursts being
+    started interval seconds apart, so a round takes about timeout seconds regardless
+    of candidate count
+    """
+    icmp_overhead = 8 + 20
+
+    @threaded
+    def _native_burst(delay):
+        time.sleep(delay)
+        return icmp_echo(
+            target,
+            [mtu - icmp_overhead for mtu in candidates],
+            timeout=timeout,
+            interval=0,
+            ip_type=ip_type,
+            do_not_fragment=True,
+            source_interface=source_interface,
+        )
+
+    @threaded
+    def _ping_candidate(mtu):
+        return ping(
+            target,
+            mtu,
+            retries,
+            timeout,
+            interval,
+            ip_type,
+            True,
+            False,
+            source_interface,
+            method="subprocess",
+        )
+
+    if native:
+        thread_list = [_native_burst(retry * interval) for retry in range(retries)]
+        wait(thread_list)
+        bursts = [thread.result() for thread in thread_list]
+        return [
+            mtu
+            for index, mtu in enumerate(candidates)
+            if any(burst[index] is not None for burst in bursts)
+        ]
+    thread_list = [_ping_candidate(mtu) for mtu in candidates]
+    wait(thread_list)
+    return [mtu for mtu, thread in zip(candidates, thread_list) if thread.result()]
+
+
+def clear_mtu_cache():
+    # type: () -> None
+    """
+    Forgets all MTU values found by probe_mtu()
+    """
+    with _mtu_cache_lock:
+        _mtu_cache.clear()
+
+
 def probe_mtu(
-    target, method="ICMP", min=1100, max=9000, source_interface=None, interval=0.2
+    target,
+    method="ICMP",
+    min=1100,
+    max=9000,
+    source_interface=None,
+    interval=0.2,
+    timeout=4,
+    cache_ttl=MTU_CACHE_TTL,
 ):
-    # type: (Union[str, IPv4Address, IPv6Address], str, int, int, str) -> int
+    # type: (Union[str, IPv4Address, IPv6Address], str, int, int, str, float, float, Optional[float]) -> int
     """
     Detects MTU to target
-    Probing can take up to 15-20 seconds
+    Probing usually takes a few seconds, or instantly when result is cached
 
     MTU 65536 bytes is maxiumal value
     Standard values are
@@ -459,45 +1014,117 @@ def probe_mtu(
       13xx for ethernet over 3G/4G
 
     Optional source when using ICMP can be interface or IPaddress
+
+    Common MTUs and range bounds are probed first, then each round concurrently probes
+    MTU_PROBE_CANDIDATES sizes evenly spread between largest working and smallest failing MTU
+    Native ICMP sockets are used when available, concurrent ping subprocesses otherwise
+
+    interval: seconds between retry probes of a candidate MTU
+    timeout: seconds to wait for an echo reply
+    cache_ttl: seconds a found MTU is kept per destination, 0 or None disables cache
     """
 
     if not target:
         raise ValueError("No valid target given.")
 
-    if method == "ICMP":
-        # Let's always keep 2 retries just to make sure we don't get false positives
-        # timeout = 4, interval = 1, ip_type is detected
-        ip_type = 4
-        try:
-            IPv6Address(target)
-            ip_type = 6
-        except AddressValueError:
-            # Let's assume it's IPv4:
-            pass
+    if method != "ICMP":
+        raise ValueError("Method {} not implemented yet.".format(method))
+
+    icmp_overhead = 8 + 20
+    if min < icmp_overhead:
+        raise ValueError("MTU cannot be lower than {}.".format(icmp_overhead))
+    if max < min:
+        raise ValueError("Maximal MTU cannot be lower than minimal MTU.")
+
+    cache_key = (str(target), source_interface, min, max)
+    if cache_ttl:
+        with _mtu_cache_lock:
+            cached = _mtu_cache.get(cache_key)
+        if cached and time.monotonic() - cached[1] < cache_ttl:
+            return cached[0]
 
-        ping_args = [
-            (target, mtu, 2, 4, interval, ip_type, True, False, source_interface)
-            for mtu in range(min, max + 1)
+    ip_type = 4
+    try:
+        IPv6Address(target)
+        ip_type = 6
+    except AddressValueError:
+        # Let's assume it's IPv4:
+        pass
+
+    # Let's always keep 2 retries just to make sure we don't get false positives
+    retries = 2
+    try:
+        # Opening a socket tells us whether native ICMP is usable
+        family, _ = _resolve_icmp_target(target, ip_type)
+        _open_icmp_socket(family, True, source_interface)[0].close()
+        native = True
+    except (socket.gaierror, UnicodeError):
+        # Unresolvable targets are reported once probing fails
+        native = True
+    except OSError as exc:
+        logger.debug(
+            "Cannot use native ICMP, falling back to ping command: {}".format(exc)
+        )
+        native = False
+
+    # Largest known working MTU and smallest known failing MTU
+    working_mtu = None
+    failing_mtu = max + 1
+    candidates = sorted(
+        set([min, max] + [mtu for mtu in COMMON_MTUS if min <= mtu <= max])
+    )
+    while candidates:
+        working_mtus = _probe_mtu_candidates(
+            target,
+            candidates,
+            ip_type,
+            source_interface,
+            interval,
+            timeout,
+            retries,
+            native,
+        )
+        # Candidates are sorted, so are working MTUs
+        if working_mtus:
+            working_mtu = working_mtus[-1]
+        # A lost reply below a working MTU is packet loss, not an MTU limit
+        failing_mtus = [
+            mtu
+            for mtu in candidates
+            if mtu not in working_mtus and (working_mtu is None or mtu > working_mtu)
         ]
+        if failing_mtus and failing_mtus[0] < failing_mtu:
+            failing_mtu = failing_mtus[0]
+        if working_mtu is None:
+            break
+        step = (failing_mtu - working_mtu) / float(MTU_PROBE_CANDIDATES + 1)
+        candidates = sorted(
+            set(
+                int(working_mtu + step * index)
+                for index in range(1, MTU_PROBE_CANDIDATES + 1)
+            )
+            - set([working_mtu])
+        )
 
-        # Bisect will return argument, list, let's just return the MTU
-        try:
-            return bisection.bisect(ping, ping_args, allow_all_expected=True)[1]
-        except ValueError as exc:
-            # Bisection failed, let's check if at least ping works to target
-            result = ping(target, 28, 2, 4, 1, ip_type, False, False, source_interface)
-            if not result:
-                raise ValueError(
-                    'ICMP request on target "{}" failed. Cannot determine MTU. Is your host reachable ?'.format(
-                        target
-                    )
-                ) from exc
-            else:
-                raise ValueError(
-                    "Unable to determine MTU via defined method: {}".format(exc)
-                ) from exc
-    else:
-        raise ValueError("Method {} not implemented yet.".format(method))
+    if working_mtu is None:
+        # Probing failed, let's check if at least ping works to target
+        result = ping(target, 28, 2, 4, 1, ip_type, False, False, source_interface)
+        if not result:
+            raise ValueError(
+                'ICMP request on target "{}" failed. Cannot determine MTU. Is your host reachable ?'.format(
+                    target
+                )
+            )
+        raise ValueError(
+            "Unable to determine MTU via defined method: no MTU between {} and {} works".format(
+                min, max
+            )
+        )
+
+    if cache_ttl:
+        with _mtu_cache_lock:
+            _mtu_cache[cache_key] = (working_mtu, time.monotonic())
+    return working_mtu
 
 
 class IOInterface:
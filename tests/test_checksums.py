@@ -16,8 +16,18 @@ __copyright__ = "Copyright (C) 2020-2024 Orsiris de Jong"
 __licence__ = "BSD 3 Clause"
 __build__ = "2021020901"
 
+import asyncio
+import contextlib
+import hashlib
+import io
+import random
+import socket
+import tarfile
+import threading
+import time
+import zipfile
 from ofunctions.checksums import *
-from ofunctions.file_utils import remove_file
+from ofunctions.file_utils import remove_file, remove_dir
 from ofunctions.random import random_string
 
 
@@ -48,6 +58,52 @@ def test_sha256sum():
     remove_file(test_file)
 
 
+def test_sha256sum_sparse():
+    test_file = prepare_temp_file()
+    with open(test_file, "wb") as fp:
+        fp.write(b"head")
+        fp.seek(3 * 1048576)
+        fp.write(b"middle")
+        # Trailing hole
+        fp.truncate(5 * 1048576 + 12)
+    assert sha256sum(test_file, sparse=True) == sha256sum(
+        test_file
+    ), "Sparse aware checksum differs from plain checksum"
+    remove_file(test_file)
+
+
+def test_sha256sum_block_sizes():
+    test_file = prepare_temp_file()
+    # A failing assertion must not leave a 3MiB file behind
+    try:
+        with open(test_file, "wb") as fp:
+            fp.write(os.urandom(3 * 1048576 + 123))
+        with open(test_file, "rb") as fp:
+            reference = sha256sum_data(fp.read())
+        for block_size in [1, 4096, 65536, 1048576, 8 * 1048576]:
+            if block_size == 1:
+                # Only hash a small file byte per byte
+                assert sha256sum(__file__, block_size=1) == sha256sum(__file__)
+                continue
+            assert (
+                sha256sum(test_file, block_size=block_size) == reference
+            ), "Bogus checksum with block size {}".format(block_size)
+
+        # Force mmap usage for our small file
+        import ofunctions.checksums
+
+        mmap_threshold = ofunctions.checksums.MMAP_THRESHOLD
+        ofunctions.checksums.MMAP_THRESHOLD = 0
+        try:
+            assert (
+                sha256sum(test_file, use_mmap=True) == reference
+            ), "Bogus mmap checksum"
+        finally:
+            ofunctions.checksums.MMAP_THRESHOLD = mmap_threshold
+    finally:
+        remove_file(test_file)
+
+
 def test_check_file_hash():
     test_file = create_test_file()
     result = check_file_hash(
@@ -103,9 +159,820 @@ def test_create_manifest_from_dir():
     remove_file(test_file)
 
 
+def create_test_tree(files=30):
+    """
+    Creates a directory with subdirectories and files of various sizes
+    """
+    root = prepare_temp_file() + ".dir"
+    for index in range(files):
+        directory = os.path.join(root, "sub{}".format(index % 3))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(os.path.join(directory, "file{}".format(index)), "wb") as fp:
+            fp.write(random_string(index * 1000 + 1).encode("utf-8"))
+    return root
+
+
+def test_create_manifest_from_dir_workers():
+    root = create_test_tree()
+    manifest_file = prepare_temp_file()
+    create_manifest_from_dir(manifest_file, root)
+    with open(manifest_file, "r") as fp:
+        single_worker_data = fp.read()
+    create_manifest_from_dir(manifest_file, root, workers=4)
+    with open(manifest_file, "r") as fp:
+        multi_worker_data = fp.read()
+    assert (
+        single_worker_data == multi_worker_data
+    ), "Parallel manifest is not identical to sequential one"
+    assert len(multi_worker_data.splitlines()) >= 30
+    remove_file(manifest_file)
+    remove_dir(root)
+
+
+def test_hash_cache():
+    test_file = create_test_file()
+    real_sum = "4c77f1bd193cac476cea5af2225e8c0177d5a009390aa6e119c211a00cf325c9"
+    cache_file = prepare_temp_file()
+
+    backends = ["sqlite"]
+    if hasattr(os, "setxattr"):
+        try:
+            os.setxattr(test_file, "user.ofunctions.test", b"test")
+            os.removexattr(test_file, "user.ofunctions.test")
+            backends.append("xattr")
+        except OSError:
+            print("Filesystem does not support user xattrs")
+
+    for backend in backends:
+        with HashCache(cache_file if backend == "sqlite" else None, backend) as cache:
+            assert sha256sum(test_file, cache=cache) == real_sum
+            assert cache.misses == 1
+            assert sha256sum(test_file, cache=cache) == real_sum
+            assert cache.hits == 1, "Cached hash not reused with {}".format(backend)
+            # Make sure we really read the digest from cache
+            cache.set(test_file, "bogus")
+            assert sha256sum(test_file, cache=cache) == "bogus"
+            assert sha256sum(test_file, cache=cache, paranoid=True) == real_sum
+            # Changing file must invalidate cache
+            cache.set(test_file, "bogus")
+            with open(test_file, "ab") as fp:
+                fp.write(b"more")
+            assert sha256sum(test_file, cache=cache) == sha256sum(test_file)
+        with open(test_file, "wb") as fp:
+            fp.write(b"haxx0r3000")
+
+    # Cache survives between runs
+    root = create_test_tree(5)
+    manifest_file = prepare_temp_file()
+    create_manifest_from_dir(manifest_file, root, cache=cache_file, workers=2)
+    with HashCache(cache_file) as cache:
+        create_manifest_from_dir(manifest_file, root, cache=cache)
+        assert cache.hits == 5 and cache.misses == 0, "Manifest did not use cache"
+    remove_file(manifest_file)
+    remove_file(cache_file)
+    remove_file(test_file)
+    remove_dir(root)
+
+
+def test_hash_file_multiple_algorithms():
+    test_file = create_test_file()
+    digests = hash_file(test_file, ["sha256", "md5", "blake2b"])
+    assert digests == {
+        "sha256": hashlib.sha256(b"haxx0r3000").hexdigest(),
+        "md5": hashlib.md5(b"haxx0r3000").hexdigest(),
+        "blake2b": hashlib.blake2b(b"haxx0r3000").hexdigest(),
+    }, "Bogus multi algorithm digests"
+    assert hash_file(test_file, "sha256") == sha256sum(test_file)
+    assert check_file_hash(test_file, digests["md5"], algorithm="md5") is True
+
+    class ByteCounter:
+        def __init__(self):
+            self.count = 0
+
+        def update(self, data):
+            self.count += len(data)
+
+        def hexdigest(self):
+            return "%08x" % self.count
+
+    register_hash_algorithm("bytecounter", ByteCounter)
+    try:
+        assert "bytecounter" in get_hash_algorithms()
+        assert hash_file(test_file, "bytecounter") == "0000000a"
+    finally:
+        assert unregister_hash_algorithm("bytecounter")
+    assert "bytecounter" not in get_hash_algorithms()
+    assert not unregister_hash_algorithm("bytecounter")
+
+    manifest_file = prepare_temp_file()
+    root = create_test_tree(3)
+    create_manifest_from_dir(manifest_file, root, algorithm="blake2b")
+    with open(manifest_file, "r") as fp:
+        lines = fp.read().splitlines()
+    assert lines[0] == "# Algorithm: blake2b", "Manifest header lacks algorithm"
+    digest, file = lines[1].split("  ", 1)
+    assert digest == hash_file(file, "blake2b")
+
+    remove_file(manifest_file)
+    remove_file(test_file)
+    remove_dir(root)
+
+
+def test_verify_manifest():
+    root = create_test_tree(12)
+    manifest_file = os.path.join(root, "MANIFEST")
+    create_manifest_from_dir(manifest_file, root, remove_prefixes=[root])
+    # Manifest is created in root, hence lists itself with a partial checksum
+    entries = [
+        entry for entry in read_manifest(manifest_file) if entry[1] != "MANIFEST"
+    ]
+    create_manifest_from_dict(
+        manifest_file, {digest: path for digest, path in entries}, algorithm="sha256"
+    )
+    assert get_manifest_algorithm(manifest_file) == "sha256"
+
+    result = verify_manifest(manifest_file, workers=4)
+    print(result)
+    assert result["success"] is True, "Manifest verification failed"
+    assert result["ok"] == 12 and result["total"] == 12
+
+    # Now break some files
+    files = [path for _, path in entries]
+    with open(os.path.join(root, files[0]), "ab") as fp:
+        fp.write(b"corruption")
+    with open(os.path.join(root, files[1]), "wb") as fp:
+        # Truncated file gets flagged without reading content
+        pass
+    remove_file(os.path.join(root, files[2]))
+    with open(os.path.join(root, "extra_file"), "w") as fp:
+        fp.write("extra")
+
+    results = {}
+    result = verify_manifest(
+        manifest_file,
+        workers=4,
+        check_extra=True,
+        fn_on_result=lambda path, status: results.update({path: status}),
+    )
+    print(result)
+    assert result["success"] is False
+    assert sorted(result["mismatched"]) == sorted([files[0], files[1]])
+    assert result["missing"] == [files[2]]
+    assert result["extra"] == ["extra_file"]
+    assert result["ok"] == 9
+    assert results[files[0]] == "FAILED" and results[files[3]] == "OK"
+
+    result = verify_manifest(manifest_file, workers=4, fail_fast=True)
+    assert len(result["mismatched"] + result["missing"]) == 1, "fail_fast didn't stop"
+    remove_dir(root)
+
+
+def test_merkle_tree():
+    test_file = prepare_temp_file()
+    chunk_size = 65536
+    with open(test_file, "wb") as fp:
+        for index in range(10):
+            fp.write(bytes([index]) * chunk_size)
+        fp.write(b"tail")
+    tree_file = test_file + MERKLE_SIDECAR_EXTENSION
+
+    tree = create_merkle_tree(test_file, chunk_size=chunk_size, tree_file=tree_file)
+    print(tree["root"])
+    assert len(tree["leaves"]) == 11
+    parallel_tree = create_merkle_tree(test_file, chunk_size=chunk_size, workers=4)
+    assert parallel_tree == tree, "Parallel hashing should give the same tree"
+    assert load_merkle_tree(tree_file) == tree
+    assert verify_merkle_range(test_file, tree_file) == []
+
+    # Change a byte in chunk 3
+    with open(test_file, "r+b") as fp:
+        fp.seek(3 * chunk_size + 10)
+        fp.write(b"X")
+    assert verify_merkle_range(test_file, tree, workers=2) == [3]
+    assert verify_merkle_range(test_file, tree, 0, 3 * chunk_size) == []
+    assert verify_merkle_range(test_file, tree, 4 * chunk_size - 1, 2) == [3]
+
+    # Only rehash changed chunk and compare with a full rehash
+    updated_tree = update_merkle_tree(
+        test_file, tree, changed_ranges=[(3 * chunk_size + 10, 1)]
+    )
+    assert updated_tree["root"] != tree["root"]
+    assert updated_tree == create_merkle_tree(test_file, chunk_size=chunk_size)
+
+    # Growing file
+    with open(test_file, "ab") as fp:
+        fp.write(b"Y" * chunk_size)
+    updated_tree = update_merkle_tree(test_file, updated_tree, changed_ranges=[])
+    assert updated_tree == create_merkle_tree(test_file, chunk_size=chunk_size)
+
+    # Shrinking file, new last chunk is partial
+    with open(test_file, "r+b") as fp:
+        fp.truncate(2 * chunk_size + 100)
+    updated_tree = update_merkle_tree(test_file, updated_tree, changed_ranges=[])
+    assert updated_tree == create_merkle_tree(test_file, chunk_size=chunk_size)
+    assert verify_merkle_range(test_file, updated_tree) == []
+
+    # Empty files still have a root
+    with open(test_file, "wb") as fp:
+        pass
+    assert len(create_merkle_tree(test_file)["leaves"]) == 1
+    remove_file(tree_file)
+    remove_file(test_file)
+
+
+def test_chunk_file_and_dedup():
+    test_file = prepare_temp_file()
+    random.seed(42)
+    data = bytes(random.getrandbits(8) for _ in range(600000))
+    with open(test_file, "wb") as fp:
+        fp.write(data)
+
+    chunks = list(chunk_file(test_file, use_numpy=False))
+    assert sum(length for _, length, _ in chunks) == len(data)
+    assert all(CDC_MIN_SIZE <= length <= CDC_MAX_SIZE for _, length, _ in chunks[:-1])
+    assert chunks[1][2] == sha256sum_data(
+        data[chunks[1][0] : chunks[1][0] + chunks[1][1]]
+    )
+    try:
+        import numpy
+    except ImportError:
+        pass
+    else:
+        assert (
+            list(chunk_file(test_file, use_numpy=True)) == chunks
+        ), "numpy and python chunkers must give identical chunks"
+
+    index_file = test_file + ".chunks.db"
+    with ChunkIndex(index_file) as index:
+        result = dedup_file(test_file, index)
+        print(result)
+        assert result["new_bytes"] == len(data) and result["dedup_ratio"] == 0
+
+        # Insert data at the beginning, only first chunk should change
+        with open(test_file, "wb") as fp:
+            fp.write(b"inserted data" + data)
+        result = dedup_file(test_file, index)
+        print(result)
+        assert result["new_chunks"] == 1
+        assert result["dedup_ratio"] > 0.9
+        assert len(index) == len(chunks) + 1
+    remove_file(index_file)
+    remove_file(test_file)
+
+
+def test_hash_stream():
+    test_file = create_test_file()
+    expected = sha256sum(test_file)
+
+    with open(test_file, "rb") as fp:
+        assert hash_stream(fp) == expected, "readinto() source failed"
+    with open(test_file, "r") as fp:
+        assert hash_stream(fp.buffer.raw) == expected
+    with open(test_file, "rb") as fp:
+        data = fp.read()
+    assert hash_stream(data) == expected
+    assert hash_stream(iter([data[:3], b"", data[3:]])) == expected
+    assert hash_stream(
+        (data[index : index + 2] for index in range(0, len(data), 2)),
+        ["sha256", "md5"],
+    ) == {"sha256": expected, "md5": hashlib.md5(data).hexdigest()}
+
+    # Socket source with tee and progress
+    progress = []
+    copy_path = test_file + ".copy"
+    reader, writer = socket.socketpair()
+    writer.sendall(data * 1000)
+    writer.close()
+    with open(copy_path, "wb") as fp:
+        result = hash_stream(
+            reader,
+            tee=fp,
+            block_size=1024,
+            progress_callback=lambda done, speed: progress.append((done, speed)),
+        )
+    reader.close()
+    assert result == sha256sum_data(data * 1000)
+    assert sha256sum(copy_path) == result, "Tee copy differs"
+    assert progress[-1][0] == len(data) * 1000 and progress[-1][1] > 0
+
+    # Callables may keep the blocks they're given, even when the read buffer is reused
+    blocks = []
+    assert hash_stream(io.BytesIO(data), tee=blocks.append, block_size=3) == expected
+    assert b"".join(blocks) == data, "Tee callable got overwritten blocks"
+
+    # Sockets are given as tee through their sendall method
+    reader, writer = socket.socketpair()
+    with open(test_file, "rb") as fp:
+        assert hash_stream(fp, tee=writer.sendall) == expected
+    writer.close()
+    assert reader.recv(len(data) + 1) == data, "Tee to socket failed"
+    reader.close()
+    remove_file(copy_path)
+    remove_file(test_file)
+
+
+def test_manifest_index():
+    manifest_file = prepare_temp_file()
+    index_file = manifest_file + ".db"
+    entries = {
+        "dir/file{}".format(index): sha256sum_data(str(index).encode("utf-8"))
+        for index in range(500)
+    }
+    entries["dir/strange\\name\nwith newline"] = sha256sum_data(b"strange")
+    entries["dir/file_duplicate"] = entries["dir/file1"]
+    with open(manifest_file, "w", encoding="utf-8") as fp:
+        fp.write("# Algorithm: sha256\n")
+        for path, digest in entries.items():
+            fp.write(
+                "\\{}  {}\n".format(
+                    digest, path.replace("\\", "\\\\").replace("\n", "\\n")
+                )
+                if "\n" in path
+                else "{}  {}\n".format(digest, path)
+            )
+
+    with ManifestIndex(index_file) as index:
+        assert index.import_manifest(manifest_file) == len(entries)
+        assert len(index) == len(entries)
+        assert index.algorithm == "sha256"
+        assert index.get("dir/file42") == entries["dir/file42"]
+        assert index.get("dir/not_existing") is None
+        assert "dir/strange\\name\nwith newline" in index
+        assert index.find(entries["dir/file1"]) == ["dir/file1", "dir/file_duplicate"]
+        paths = [path for _, path in index]
+        assert paths == sorted(entries), "Iteration should be sorted by path"
+        assert len(list(index.iter_entries(prefix="dir/file4"))) == 111
+        assert index.remove("dir/file0") and not index.remove("dir/file0")
+
+    # Round trip through text format
+    with ManifestIndex(index_file) as index:
+        assert index.export_manifest(manifest_file) == len(entries) - 1
+    del entries["dir/file0"]
+    assert (
+        dict((path, digest) for digest, path in read_manifest(manifest_file)) == entries
+    )
+    remove_file(index_file)
+    remove_file(manifest_file)
+
+
+def test_diff_manifests():
+    old_manifest = prepare_temp_file()
+    new_manifest = prepare_temp_file()
+    old_entries = {
+        "file{:03d}".format(index): sha256sum_data(str(index).encode("utf-8"))
+        for index in range(100)
+    }
+    new_entries = dict(old_entries)
+    new_entries["file001"] = sha256sum_data(b"modified")
+    new_entries["renamed/file002"] = new_entries.pop("file002")
+    del new_entries["file003"]
+    new_entries["added"] = sha256sum_data(b"added")
+    # Same content at two new paths, one of them is a rename, the other one an addition
+    new_entries["renamed/file004"] = new_entries.pop("file004")
+    new_entries["copied/file004"] = new_entries["renamed/file004"]
+    create_manifest_from_dict(
+        old_manifest, {digest: path for path, digest in old_entries.items()}
+    )
+    # create_manifest_from_dict() can't have duplicate digests
+    with open(new_manifest, "w") as fp:
+        for path, digest in new_entries.items():
+            fp.write("{}  {}\n".format(digest, path))
+
+    for run_size in [EXTERNAL_SORT_RUN_SIZE, 7]:
+        diff = list(diff_manifests(old_manifest, new_manifest, run_size=run_size))
+        print(diff)
+        actions = sorted((entry["action"], entry["path"]) for entry in diff)
+        assert actions == [
+            ("added", "added"),
+            ("added", "renamed/file004"),
+            ("modified", "file001"),
+            ("removed", "file003"),
+            ("renamed", "copied/file004"),
+            ("renamed", "renamed/file002"),
+        ], "Bogus diff with run size {}".format(run_size)
+
+    diff = list(diff_manifests(old_manifest, new_manifest, detect_renames=False))
+    assert len([entry for entry in diff if entry["action"] == "removed"]) == 3
+
+    index_file = old_manifest + ".db"
+    with ManifestIndex(index_file) as index:
+        index.import_manifest(old_manifest)
+        assert list(diff_manifests(index, old_manifest)) == []
+    remove_file(index_file)
+    remove_file(old_manifest)
+    remove_file(new_manifest)
+
+
+def test_async_hashing():
+    root = create_test_tree(20)
+    files = sorted(
+        get_paths_recursive(root, exclude_dirs=True), key=lambda path: path[::-1]
+    )
+
+    async def _hash():
+        digest = await async_sha256sum(files[0])
+        assert digest == sha256sum(files[0])
+        digests = await async_hash_file(files[0], ["sha256", "md5"])
+        assert digests == hash_file(files[0], ["sha256", "md5"])
+        results = await async_hash_files(files, concurrency=3)
+        assert results == [(file, sha256sum(file)) for file in files], "Bad order"
+
+        manifest_file = root + ".async_manifest"
+        sync_manifest_file = root + ".sync_manifest"
+        await async_create_manifest_from_dir(
+            manifest_file, root, remove_prefixes=[root], concurrency=3
+        )
+        create_manifest_from_dir(sync_manifest_file, root, remove_prefixes=[root])
+        assert sha256sum(manifest_file) == sha256sum(sync_manifest_file)
+
+        # Same options as synchronous manifest creation
+        await async_create_manifest_from_dir(
+            manifest_file,
+            root,
+            remove_prefixes=[root],
+            nocache=True,
+            bandwidth_limit=BandwidthLimiter(1048576),
+        )
+        assert sha256sum(manifest_file) == sha256sum(sync_manifest_file)
+        remove_file(manifest_file)
+        remove_file(sync_manifest_file)
+
+    asyncio.run(_hash())
+
+    # Cancelling a task must not wait for the whole file to be hashed
+    import ofunctions.checksums
+
+    big_file = root + ".big"
+    with open(big_file, "wb") as fp:
+        fp.write(b"0" * 16777216)
+    step_size = ofunctions.checksums.ASYNC_STEP_SIZE
+    ofunctions.checksums.ASYNC_STEP_SIZE = 1024
+
+    async def _cancel():
+        task = asyncio.ensure_future(async_sha256sum(big_file, block_size=1024))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            return True
+        return False
+
+    try:
+        start_time = time.monotonic()
+        assert asyncio.run(_cancel()) is True, "Task should have been cancelled"
+        assert time.monotonic() - start_time < 2
+    finally:
+        ofunctions.checksums.ASYNC_STEP_SIZE = step_size
+    remove_file(big_file)
+    remove_dir(root)
+
+
+def test_nocache_and_bandwidth_limit():
+    test_file = prepare_temp_file()
+    with open(test_file, "wb") as fp:
+        fp.write(os.urandom(3 * 1048576))
+    expected = sha256sum(test_file)
+    assert sha256sum(test_file, nocache=True) == expected
+    assert hash_file(test_file, ["sha256"], nocache=True)["sha256"] == expected
+
+    # 3MiB at 6MiB/s with a small burst should take about half a second
+    start_time = time.monotonic()
+    limiter = BandwidthLimiter(6 * 1048576, burst=BLOCK_SIZE)
+    assert sha256sum(test_file, bandwidth_limit=limiter) == expected
+    elapsed = time.monotonic() - start_time
+    print("Limited hashing took {}s".format(elapsed))
+    assert 0.4 < elapsed < 3, "Bandwidth limit not honored"
+
+    # Limit is shared between workers
+    root = create_test_tree(6)
+    for file in get_paths_recursive(root, exclude_dirs=True):
+        with open(file, "wb") as fp:
+            fp.write(os.urandom(524288))
+    manifest_file = root + ".manifest"
+    start_time = time.monotonic()
+    create_manifest_from_dir(
+        manifest_file,
+        root,
+        workers=3,
+        nocache=True,
+        bandwidth_limit=BandwidthLimiter(6 * 1048576, burst=BLOCK_SIZE),
+    )
+    assert time.monotonic() - start_time > 0.4, "Workers don't share bandwidth limit"
+    assert verify_manifest(manifest_file, root="/", nocache=True)["success"]
+
+    # Async hashing waits for bandwidth in its thread pool
+    start_time = time.monotonic()
+    digest = asyncio.run(
+        async_sha256sum(
+            test_file,
+            nocache=True,
+            bandwidth_limit=BandwidthLimiter(6 * 1048576, burst=BLOCK_SIZE),
+        )
+    )
+    assert digest == expected
+    assert time.monotonic() - start_time > 0.4, "Async bandwidth limit not honored"
+    remove_file(manifest_file)
+    remove_dir(root)
+    remove_file(test_file)
+
+
+def test_hash_archive_members():
+    root = create_test_tree(9)
+    files = sorted(get_paths_recursive(root, exclude_dirs=True))
+    expected = {os.path.relpath(file, root): sha256sum(file) for file in files}
+
+    archives = []
+    for mode, extension in [("w", ".tar"), ("w:gz", ".tar.gz"), ("w:xz", ".tar.xz")]:
+        archive = root + extension
+        with tarfile.open(archive, mode) as tar_file:
+            tar_file.add(root, arcname=".")
+        archives.append(archive)
+    archive = root + ".zip"
+    with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as zip_file:
+        for file in files:
+            zip_file.write(file, os.path.relpath(file, root))
+    archives.append(archive)
+
+    for archive in archives:
+        result = dict(hash_archive_members(archive))
+        assert result == expected, "Bogus member digests for {}".format(archive)
+        remove_file(archive)
+
+    # Tar archives ending with a zip member are not mistaken for that zip
+    inner_zip = root + ".inner.zip"
+    with zipfile.ZipFile(inner_zip, "w") as zip_file:
+        zip_file.writestr("inner.txt", "inner")
+    archive = root + ".tar"
+    with tarfile.open(archive, "w") as tar_file:
+        tar_file.add(root, arcname=".")
+        tar_file.add(inner_zip, arcname="inner.zip")
+    tar_expected = dict(expected, **{"inner.zip": sha256sum(inner_zip)})
+    assert dict(hash_archive_members(archive)) == tar_expected
+    with open(archive, "rb") as fp:
+        assert dict(hash_archive_members(fp)) == tar_expected
+    remove_file(archive)
+    remove_file(inner_zip)
+
+    # Tar archives can be hashed from non seekable streams
+    archive = root + ".tar.bz2"
+    with tarfile.open(archive, "w:bz2") as tar_file:
+        tar_file.add(root, arcname="prefix")
+    reader, writer = socket.socketpair()
+    with open(archive, "rb") as fp:
+        sender = threading.Thread(
+            target=lambda: (writer.sendall(fp.read()), writer.close())
+        )
+        sender.start()
+        manifest_file = root + ".manifest"
+        with reader.makefile("rb") as stream:
+            assert create_manifest_from_archive(
+                manifest_file, stream, remove_prefixes=["prefix"]
+            ) == len(files)
+        sender.join()
+    reader.close()
+    assert {path: digest for digest, path in read_manifest(manifest_file)} == expected
+    assert verify_manifest(manifest_file, root=root)["success"]
+    remove_file(manifest_file)
+    remove_file(archive)
+    remove_dir(root)
+
+
+def test_directory_digest():
+    root = create_test_tree(9)
+    cache_file = root + ".cache.db"
+    assert directory_digest(root)["digest"] == directory_digest(root)["digest"]
+
+    with HashCache(cache_file) as cache:
+        first = directory_digest(root, cache=cache)
+        assert first["changed"] == [], "First run has nothing to compare to"
+        assert directory_digest(root, cache=cache) == first
+        assert cache.hits == 9, "Unchanged files should not be rehashed"
+
+        # Modify a file in place, add a file and remove another one
+        with open(os.path.join(root, "sub1", "file1"), "ab") as fp:
+            fp.write(b"modified")
+        with open(os.path.join(root, "sub2", "new_file"), "w") as fp:
+            fp.write("new")
+        remove_file(os.path.join(root, "sub0", "file0"))
+        result = directory_digest(root, cache=cache)
+        print(result)
+        assert result["digest"] != first["digest"]
+        assert result["changed"] == [
+            os.path.join("sub0", "file0"),
+            os.path.join("sub1", "file1"),
+            os.path.join("sub2", "new_file"),
+        ]
+        assert (
+            result["digest"] == directory_digest(root)["digest"]
+        ), "Cache changed digest"
+
+        # Trusting directory mtime skips walking unchanged directories
+        hits = cache.hits
+        assert directory_digest(root, cache=cache, trust_dir_mtime=True) == {
+            "digest": result["digest"],
+            "changed": [],
+        }
+        assert cache.hits == hits, "Files should not have been looked at"
+
+        # Changes deep below an unchanged directory are still found
+        os.makedirs(os.path.join(root, "sub0", "a", "b"))
+        result = directory_digest(root, cache=cache, trust_dir_mtime=True)
+        assert result["changed"] == [os.path.join("sub0", "a")]
+        with open(os.path.join(root, "sub0", "a", "b", "new"), "w") as fp:
+            fp.write("new")
+        deep_result = directory_digest(root, cache=cache, trust_dir_mtime=True)
+        print(deep_result)
+        assert deep_result["changed"] == [os.path.join("sub0", "a", "b", "new")]
+        assert deep_result["digest"] != result["digest"]
+        assert (
+            deep_result["digest"] == directory_digest(root)["digest"]
+        ), "Trusted directory mtime changed digest"
+    remove_file(cache_file)
+    remove_dir(root)
+
+
+def test_quick_verify_manifest():
+    root = create_test_tree(60)
+    manifest_file = root + ".manifest"
+    create_manifest_from_dir(manifest_file, root, remove_prefixes=[root])
+
+    # Small datasets get fully verified with default confidence
+    result = quick_verify_manifest(manifest_file, root=root)
+    print(result)
+    assert result["success"] and result["sampled"] == 60 and result["sample_rate"] == 1
+
+    samples = []
+    for _ in range(2):
+        sampled = []
+        result = quick_verify_manifest(
+            manifest_file,
+            root=root,
+            byte_budget=result["total_bytes"] // 4,
+            seed=1234,
+            workers=3,
+            fn_on_result=lambda path, status: sampled.append(path),
+        )
+        assert result["success"] and 0 < result["sampled"] < 60
+        samples.append(sampled)
+    assert samples[0] == samples[1], "Same seed should give same sample"
+
+    # Missing files are always found, corrupted ones when sampled
+    file = sorted(get_paths_recursive(root, exclude_dirs=True))[0]
+    remove_file(file)
+    for path in get_paths_recursive(root, exclude_dirs=True):
+        with open(path, "ab") as fp:
+            fp.write(b"corruption")
+    result = quick_verify_manifest(
+        manifest_file, root=root, confidence=0.9, corruption_rate=0.5, seed=1
+    )
+    print(result)
+    assert result["missing"] == [os.path.relpath(file, root)]
+    assert len(result["mismatched"]) == result["sampled"] > 0
+    assert result["confidence"] >= 0.9
+    remove_file(manifest_file)
+    remove_dir(root)
+
+    # Files with merkle sidecars only get some chunks verified
+    root = create_test_tree(0)
+    os.makedirs(root)
+    big_file = os.path.join(root, "big_file")
+    with open(big_file, "wb") as fp:
+        fp.write(os.urandom(16 * 65536))
+    tree_file = big_file + MERKLE_SIDECAR_EXTENSION
+    create_manifest_from_dict(manifest_file, {sha256sum(big_file): "big_file"})
+
+    # Sidecars not bound to the manifest digest, or unreadable ones, get full hashes
+    create_merkle_tree(big_file, chunk_size=65536, tree_file=tree_file)
+    result = quick_verify_manifest(manifest_file, root=root, merkle_ranges=2)
+    assert result["success"] and result["bytes"] == 16 * 65536
+    with open(tree_file, "w") as fp:
+        fp.write("{corrupted")
+    result = quick_verify_manifest(manifest_file, root=root, merkle_ranges=2)
+    assert result["success"] and result["bytes"] == 16 * 65536
+
+    tree = create_merkle_tree(
+        big_file, chunk_size=65536, tree_file=tree_file, file_algorithm="sha256"
+    )
+    assert tree["file_digest"] == sha256sum(big_file)
+    result = quick_verify_manifest(manifest_file, root=root, merkle_ranges=2)
+    assert result["success"] and result["bytes"] == 2 * 65536
+    with open(big_file, "wb") as fp:
+        fp.write(os.urandom(16 * 65536))
+    result = quick_verify_manifest(manifest_file, root=root, merkle_ranges=2)
+    assert result["mismatched"] == ["big_file"]
+
+    # A sidecar recreated from corrupted content doesn't hide the corruption
+    create_merkle_tree(
+        big_file, chunk_size=65536, tree_file=tree_file, file_algorithm="sha256"
+    )
+    result = quick_verify_manifest(manifest_file, root=root, merkle_ranges=2)
+    assert result["mismatched"] == ["big_file"] and result["bytes"] == 16 * 65536
+    remove_file(manifest_file)
+    remove_dir(root)
+
+
+def test_command_line():
+    from ofunctions.checksums.__main__ import main
+
+    root = create_test_tree(9)
+    manifest_file = os.path.join(root, "SHA256SUMS")
+    assert main(["create", root, "-o", manifest_file, "--workers", "3"]) == 0
+    paths = [path for _, path in read_manifest(manifest_file)]
+    assert len(paths) == 9 and "SHA256SUMS" not in paths
+
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        assert main(["verify", manifest_file, "--workers", "3"]) == 0
+    assert sorted(output.getvalue().splitlines()) == sorted(
+        "{}: OK".format(path) for path in paths
+    ), "Output should be the same as sha256sum -c"
+
+    with open(os.path.join(root, paths[0]), "ab") as fp:
+        fp.write(b"corruption")
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        assert main(["verify", manifest_file, "--quiet"]) == 1
+    assert output.getvalue() == "{}: FAILED\n".format(paths[0])
+
+    new_manifest_file = root + ".new_manifest"
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        assert main(["create", root, "--exclude-file", "SHA256SUMS"]) == 0
+    with open(new_manifest_file, "w", encoding="utf-8") as fp:
+        fp.write(output.getvalue())
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        assert main(["diff", manifest_file, new_manifest_file]) == 1
+    assert output.getvalue() == "M\t{}\n".format(paths[0])
+
+    # Filenames with newlines and backslashes are escaped like sha256sum does
+    odd_names = ["new\nline.txt", "back\\slash.txt"]
+    for name in odd_names:
+        with open(os.path.join(root, name), "w") as fp:
+            fp.write(name)
+    assert main(["create", root, "-o", new_manifest_file]) == 0
+    with open(new_manifest_file, "r", encoding="utf-8") as fp:
+        lines = fp.read().splitlines()
+    assert (
+        "\\{}  new\\nline.txt".format(sha256sum(os.path.join(root, odd_names[0])))
+        in lines
+    )
+    assert (
+        "\\{}  back\\\\slash.txt".format(sha256sum(os.path.join(root, odd_names[1])))
+        in lines
+    )
+    assert all(
+        name in [path for _, path in read_manifest(new_manifest_file)]
+        for name in odd_names
+    )
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        assert main(["verify", new_manifest_file, "--root", root, "--quiet"]) == 0
+    async_manifest_file = root + ".async_manifest"
+    asyncio.run(
+        async_create_manifest_from_dir(
+            async_manifest_file, root, remove_prefixes=[root]
+        )
+    )
+    assert sha256sum(async_manifest_file) == sha256sum(new_manifest_file)
+    remove_file(async_manifest_file)
+
+    # Only the manifest itself is excluded, not other files with the same name
+    sub_manifest_file = os.path.join(root, "sub1", "SHA256SUMS")
+    assert main(["create", root, "-o", sub_manifest_file]) == 0
+    paths = [path for _, path in read_manifest(sub_manifest_file)]
+    assert "SHA256SUMS" in paths
+    assert os.path.join("sub1", "SHA256SUMS") not in paths
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        assert main(["verify", sub_manifest_file, "--root", root, "--quiet"]) == 0
+    remove_file(sub_manifest_file)
+    remove_file(new_manifest_file)
+    remove_dir(root)
+
+
 if __name__ == "__main__":
     print("Example code for %s, %s" % (__intname__, __build__))
     test_sha256sum()
+    test_sha256sum_sparse()
+    test_sha256sum_block_sizes()
     test_check_file_hash()
     test_create_sha256sum_file()
     test_create_manifest_from_dir()
+    test_create_manifest_from_dir_workers()
+    test_hash_cache()
+    test_hash_file_multiple_algorithms()
+    test_verify_manifest()
+    test_merkle_tree()
+    test_chunk_file_and_dedup()
+    test_hash_stream()
+    test_manifest_index()
+    test_diff_manifests()
+    test_async_hashing()
+    test_nocache_and_bandwidth_limit()
+    test_hash_archive_members()
+    test_directory_digest()
+    test_quick_verify_manifest()
+    test_command_line()
@@ -18,6 +18,7 @@ __licence__ = "BSD 3 Clause"
 __build__ = "2021052601"
 
 import sys
+import threading
 from time import sleep
 
 from ofunctions.file_utils import *
@@ -233,6 +234,203 @@ def test_hide_file():
     remove_file(path)
 
 
+def _write_test_file(path, content):
+    make_path(os.path.dirname(path))
+    with open(path, "w") as fp:
+        fp.write(content)
+
+
+def test_compare_trees_and_apply_sync_plan():
+    test_directory = os.path.abspath(os.path.dirname(__file__))
+    source = os.path.join(
+        test_directory, "ofunctions.test_sync_src." + random_string(8)
+    )
+    dest = os.path.join(test_directory, "ofunctions.test_sync_dst." + random_string(8))
+
+    _write_test_file(os.path.join(source, "same.txt"), "same")
+    _write_test_file(os.path.join(source, "changed.txt"), "new content")
+    _write_test_file(os.path.join(source, "touched.txt"), "touched")
+    _write_test_file(os.path.join(source, "sub", "deep", "new.txt"), "new")
+    _write_test_file(os.path.join(source, "excluded", "file.txt"), "excluded")
+    _write_test_file(os.path.join(dest, "same.txt"), "same")
+    _write_test_file(os.path.join(dest, "changed.txt"), "old content")
+    _write_test_file(os.path.join(dest, "touched.txt"), "touched")
+    _write_test_file(os.path.join(dest, "obsolete", "file.txt"), "obsolete")
+    shutil.copystat(os.path.join(source, "same.txt"), os.path.join(dest, "same.txt"))
+    os.utime(os.path.join(dest, "touched.txt"), (1000000000, 1000000000))
+
+    plan = list(compare_trees(source, dest, checksum=True, d_exclude_list=["excluded"]))
+    print(plan)
+    assert {"action": "copy", "path": "changed.txt"} in plan
+    assert {"action": "metadata", "path": "touched.txt"} in plan
+    assert {"action": "delete", "path": "obsolete"} in plan
+    assert {"action": "mkdir", "path": "sub"} in plan
+    assert {"action": "copy", "path": os.path.join("sub", "deep", "new.txt")} in plan
+    assert not [entry for entry in plan if entry["path"] == "same.txt"]
+    assert not [entry for entry in plan if entry["path"].startswith("excluded")]
+
+    stats = apply_sync_plan(plan, source, dest, workers=2)
+    print(stats)
+    assert stats["copy"] == 2 and stats["metadata"] == 1 and not stats["errors"]
+    assert not os.path.exists(os.path.join(dest, "obsolete"))
+    with open(os.path.join(dest, "sub", "deep", "new.txt")) as fp:
+        assert fp.read() == "new", "Synced file content is bogus"
+
+    # Now both trees should be identical, without checksums too
+    assert list(compare_trees(source, dest, d_exclude_list=["excluded"])) == []
+
+    if os.name != "nt":
+        # Symlinks pointing up the tree must not be followed
+        os.symlink("..", os.path.join(source, "sub", "loop"))
+        os.symlink("same.txt", os.path.join(dest, "same_link"))
+        os.symlink("same.txt", os.path.join(source, "same_link"))
+        os.symlink("changed.txt", os.path.join(source, "other_link"))
+        os.symlink("same.txt", os.path.join(dest, "other_link"))
+        plan = list(compare_trees(source, dest, d_exclude_list=["excluded"]))
+        print(plan)
+        assert plan == [
+            {"action": "delete", "path": "other_link"},
+            {"action": "symlink", "path": "other_link"},
+            {"action": "symlink", "path": os.path.join("sub", "loop")},
+        ]
+        stats = apply_sync_plan(plan, source, dest)
+        assert stats["symlink"] == 2 and not stats["errors"]
+        assert os.readlink(os.path.join(dest, "sub", "loop")) == ".."
+        assert os.readlink(os.path.join(dest, "other_link")) == "changed.txt"
+        assert list(compare_trees(source, dest, d_exclude_list=["excluded"])) == []
+
+    remove_dir(source)
+    remove_dir(dest)
+
+
+def test_copy_file_sparse():
+    test_directory = os.path.abspath(os.path.dirname(__file__))
+    source = os.path.join(test_directory, "ofunctions.test_sparse." + random_string(8))
+    dest = source + ".copy"
+    with open(source, "wb") as fp:
+        fp.seek(1048576)
+        fp.write(b"data")
+        fp.truncate(4 * 1048576)
+
+    with open(source, "rb") as fp:
+        extents = list(get_file_extents(fp.fileno()))
+    print(extents)
+    assert sum(extent[1] for extent in extents) == 4 * 1048576, "Bogus extent list"
+    assert [extent for extent in extents if extent[2]], "No data extent found"
+
+    copy_file(source, dest)
+    with open(source, "rb") as fp_source, open(dest, "rb") as fp_dest:
+        assert fp_source.read() == fp_dest.read(), "Sparse copy content differs"
+    if os.name != "nt" and len(extents) > 1:
+        # Source filesystem supports holes, so should the copy
+        assert os.stat(dest).st_blocks <= os.stat(source).st_blocks
+
+    move_file(dest, source + ".moved")
+    assert os.path.getsize(source + ".moved") == 4 * 1048576
+    remove_file(source)
+    remove_file(source + ".moved")
+
+
+def test_follow_file():
+    test_directory = os.path.abspath(os.path.dirname(__file__))
+    path = os.path.join(test_directory, "ofunctions.test_follow." + random_string(8))
+    with open(path, "w") as fp:
+        fp.write("existing line\n")
+
+    def _writer():
+        sleep(0.1)
+        with open(path, "a") as fp:
+            fp.write("line 1\nline ")
+            fp.flush()
+            sleep(0.05)
+            fp.write("2\npartial")
+        sleep(0.1)
+        # Rotate like RotatingFileHandler does
+        os.rename(path, path + ".1")
+        with open(path, "w") as fp:
+            fp.write("line 3\nlast")
+
+    for use_inotify in [True, False]:
+        thread = threading.Thread(target=_writer)
+        thread.start()
+        lines = list(
+            follow_file(
+                path,
+                timeout=0.3,
+                poll_interval=0.01,
+                max_poll_interval=0.05,
+                use_inotify=use_inotify,
+            )
+        )
+        thread.join()
+        print(lines)
+        assert lines == [
+            "line 1\n",
+            "line 2\n",
+            "partial",
+            "line 3\n",
+            "last",
+        ], "follow_file failed with use_inotify={}".format(use_inotify)
+        remove_file(path + ".1")
+        with open(path, "w") as fp:
+            fp.write("existing line\n")
+
+    lines = list(follow_file(path, from_beginning=True, timeout=0.1))
+    assert lines == ["existing line\n"], "follow_file failed to read from beginning"
+    remove_file(path)
+
+
+def test_glob_paths():
+    test_directory = os.path.abspath(os.path.dirname(__file__))
+    root = os.path.join(test_directory, "ofunctions.test_glob." + random_string(8))
+    for path in [
+        "var/log/app-1.log",
+        "var/log/nested/deeper/app-2.log",
+        "var/log/nested/other.log",
+        "var/lib/app-3.log",
+        "etc/app.conf",
+        "etc/sub/app.conf",
+    ]:
+        _write_test_file(os.path.join(root, *path.split("/")), "test")
+
+    def _glob(patterns, **kwargs):
+        return sorted(
+            os.path.relpath(path, root).replace(os.sep, "/")
+            for path in glob_paths(root, patterns, **kwargs)
+        )
+
+    result = _glob("var/log/**/app-*.log")
+    assert result == [
+        "var/log/app-1.log",
+        "var/log/nested/deeper/app-2.log",
+    ], "glob_paths failed with ** pattern"
+
+    result = _glob(["etc/*.conf", "var/*/app-3.log"])
+    assert result == ["etc/app.conf", "var/lib/app-3.log"], "glob_paths failed"
+
+    result = _glob("**/nested", exclude_files=True)
+    assert result == ["var/log/nested"], "glob_paths failed with directory pattern"
+
+    result = _glob("var/log/**", exclude_dirs=True)
+    assert len(result) == 3, "glob_paths failed with trailing ** pattern"
+
+    assert _glob("nonexistent/**/*.log") == [], "glob_paths found ghosts"
+
+    if os.name != "nt":
+        # Symlinks to parent directories must not make ** loop
+        os.symlink("..", os.path.join(root, "var", "log", "nested", "up"))
+        result = _glob("var/**/app-*.log")
+        assert result == [
+            "var/lib/app-3.log",
+            "var/log/app-1.log",
+            "var/log/nested/deeper/app-2.log",
+        ], "glob_paths followed symlinked directory with ** pattern"
+        assert _glob("**/up", exclude_files=True) == ["var/log/nested/up"]
+        # Literal segments may still go through symlinked directories
+        assert _glob("var/log/nested/up/app-*.log") == ["var/log/nested/up/app-1.log"]
+    remove_dir(root)
+
+
 if __name__ == "__main__":
     print("Example code for %s, %s" % (__intname__, __build__))
     test_check_path_access()
@@ -242,3 +440,7 @@ if __name__ == "__main__":
     test_get_file_time()
     test_check_file_timestamp_delta()
     test_hide_file()
+    test_compare_trees_and_apply_sync_plan()
+    test_copy_file_sparse()
+    test_follow_file()
+    test_glob_paths()
@@ -10,7 +10,6 @@ Versioning semantics:
     Patch version: Backwards compatible bug fixes
 """
 
-
 __intname__ = "tests.ofunctions.network"
 __author__ = "Orsiris de Jong"
 __copyright__ = "Copyright (C) 2020-2024 Orsiris de Jong"
@@ -20,6 +19,7 @@ __build__ = "2023122801"
 
 # Use logging so we se actual output of probe_mtu
 import os
+import time
 from ofunctions.network import *
 
 
@@ -29,7 +29,7 @@ def running_on_github_actions():
           env:
         RUNNING_ON_GITHUB_ACTIONS: true
     """
-    return os.environ.get("RUNNING_ON_GITHUB_ACTIONS").lower() == "true"
+    return os.environ.get("RUNNING_ON_GITHUB_ACTIONS", "").lower() == "true"
 
 
 def test_ping():
@@ -92,6 +92,140 @@ def test_ping():
     ), "Failing hosts should make all_targets_must_succeed=True ping fail"
 
 
+def test_ping_concurrent_targets():
+    # ping does not work on GH
+    if running_on_github_actions():
+        return None
+
+    # TEST-NET-2 and TEST-NET-3 addresses should never answer, so each one takes a full timeout
+    targets = ["198.51.100.1", "198.51.100.2", "203.0.113.1"]
+    start_time = time.monotonic()
+    result = ping(targets, retries=1, timeout=3)
+    elapsed = time.monotonic() - start_time
+    print("Ping multiple unreachable hosts result: %s in %.2fs" % (result, elapsed))
+    assert result is False, "TEST-NET hosts should not be pingable"
+    assert elapsed < 2 * 3, "Targets should be pinged concurrently"
+
+    # First failure should cancel other targets when all targets must succeed
+    start_time = time.monotonic()
+    result = ping(
+        ["198.51.100.1", "127.0.0.1", "203.0.113.1"],
+        retries=1,
+        timeout=3,
+        all_targets_must_succeed=True,
+    )
+    elapsed = time.monotonic() - start_time
+    print("Ping with one unreachable host result: %s in %.2fs" % (result, elapsed))
+    assert result is False, "One failing host should make the whole ping fail"
+    assert elapsed < 2 * 3, "Targets should be pinged concurrently"
+
+
+def test_icmp_echo():
+    # ping does not work on GH
+    if running_on_github_actions():
+        return None
+
+    result = icmp_echo("127.0.0.1", [56, 1000, 8972], interval=0)
+    print("Native ICMP echo to localhost: %s" % result)
+    assert len(result) == 3, "There should be one result per payload size"
+    assert all(rtt is not None and rtt >= 0 for rtt in result), "Localhost should reply"
+
+    # 65507 is the maximal IPv4 ICMP payload size
+    result = icmp_echo("127.0.0.1", [65507, 65508], interval=0, do_not_fragment=True)
+    print("Native ICMP echo to localhost with maximal payloads: %s" % result)
+    assert result[0] is not None, "Localhost MTU should allow maximal payload"
+    assert result[1] is None, "Payload over maximal size cannot be sent"
+
+    result = icmp_echo("example.not.existing", 56)
+    assert result == [None], "Not existing host should not reply"
+
+    result = icmp_echo("127.0.0.1", [56] * 5, interval=0.5, first_reply_only=True)
+    assert result[0] is not None, "First reply should be recorded"
+    assert result[1:] == [None] * 4, "No other probes should be sent after first reply"
+
+    assert ping("127.0.0.1", method="native") is True, "Native ping should work"
+    assert ping(["127.0.0.1", "::1"], all_targets_must_succeed=True, method="native")
+    assert ping("127.0.0.1", mtu=9000, do_not_fragment=True, method="native")
+    assert ping("example.not.existing", method="native") is False
+
+    try:
+        ping("127.0.0.1", method="UDP")
+    except ValueError:
+        assert True, "Unknown method"
+    else:
+        assert False, "Unknown ping method did not raise an exception"
+
+
+def test_ping_stats():
+    # ping does not work on GH
+    if running_on_github_actions():
+        return None
+
+    result = ping_stats("127.0.0.1", count=5, interval=0.1)
+    print("Localhost ping statistics: %s" % result)
+    assert result["sent"] == 5 and result["received"] == 5, "Localhost should reply"
+    assert result["loss"] == 0
+    assert result["min"] <= result["avg"] <= result["max"]
+    assert result["mdev"] >= 0
+    assert result["rtts"].typecode == "d" and len(result["rtts"]) == 5
+
+    result = ping_stats(["127.0.0.1", "198.51.100.1"], count=2, interval=0.1, timeout=1)
+    print("Ping statistics: %s" % result)
+    assert result[0]["target"] == "127.0.0.1" and result[0]["loss"] == 0
+    assert result[1]["target"] == "198.51.100.1", "Results should keep target order"
+    assert result[1]["loss"] == 100 and result[1]["avg"] is None
+    assert all(rtt != rtt for rtt in result[1]["rtts"]), "Lost probes should be NaN"
+
+
+def test_parse_ping_output():
+    from ofunctions.network import _parse_ping_output
+
+    # Localized Windows ping output, replies are assigned in order
+    output = "\n".join(
+        [
+            "Envoi d'une requête 'Ping'  192.168.1.1 avec 32 octets de données :",
+            "Réponse de 192.168.1.1 : octets=32 temps<1ms TTL=64",
+            "Antwort von 192.168.1.1: Bytes=32 Zeit=12ms TTL=64",
+            "Reply from 192.168.1.1: bytes=32 time=3 ms TTL=64",
+            "Délai d'attente de la demande dépassé.",
+        ]
+    )
+    assert _parse_ping_output(output, 4) == [1.0, 12.0, 3.0, None]
+
+    # Windows IPv6 replies have no TTL field
+    output = "\n".join(
+        [
+            "Pinging ::1 with 32 bytes of data:",
+            "Reply from ::1: time<1ms",
+            "Réponse de ::1 : temps=2 ms",
+            "",
+            "Ping statistics for ::1:",
+            "    Packets: Sent = 2, Received = 2, Lost = 0 (0% loss),",
+            "Approximate round trip times in milli-seconds:",
+            "    Minimum = 0ms, Maximum = 2ms, Average = 1ms",
+        ]
+    )
+    assert _parse_ping_output(output, 3) == [1.0, 2.0, None]
+
+    first_sequence = 0 if is_macos else 1
+    output = "64 bytes from 127.0.0.1: icmp_seq={} ttl=64 time=0.045 ms".format(
+        first_sequence + 1
+    )
+    assert _parse_ping_output(output, 2) == [None, 0.045]
+
+    # A missing ping command must not look like packet loss
+    path = os.environ.get("PATH", "")
+    os.environ["PATH"] = ""
+    try:
+        ping_stats("127.0.0.1", count=1, method="subprocess")
+    except OSError as exc:
+        print("Missing ping command: %s" % exc)
+    else:
+        assert False, "Missing ping command did not raise an exception"
+    finally:
+        os.environ["PATH"] = path
+
+
 def test_test_http_internet():
     # Hopefully these addresses don't exist
     result = check_http_internet(
@@ -187,11 +321,46 @@ def test_probe_mtu():
         assert False, "Unknown MTU probe method did not raise an exception"
 
 
+def test_probe_mtu_cache():
+    # ping does not work on GH
+    if running_on_github_actions():
+        return None
+
+    clear_mtu_cache()
+    start_time = time.monotonic()
+    result = probe_mtu("127.0.0.1", min=1400, max=70000)
+    elapsed = time.monotonic() - start_time
+    print("Localhost maximal MTU: %s in %.2fs" % (result, elapsed))
+    assert 9000 <= result <= 65535, "Localhost MTU should allow maximal IP packets"
+
+    start_time = time.monotonic()
+    assert probe_mtu("127.0.0.1", min=1400, max=70000) == result
+    assert time.monotonic() - start_time < 0.1, "Second probe should be cached"
+
+    # Other bounds are not cached yet
+    assert probe_mtu("127.0.0.1", min=1400, max=1500, cache_ttl=0) == 1500
+
+    clear_mtu_cache()
+    assert probe_mtu("127.0.0.1", min=1400, max=9000) == 9000
+
+    try:
+        probe_mtu("127.0.0.1", min=1500, max=1400)
+    except ValueError:
+        assert True, "Maximal MTU lower than minimal MTU"
+    else:
+        assert False, "Inverted MTU bounds did not raise an exception"
+
+
 if __name__ == "__main__":
     print("Example code for %s, %s" % (__intname__, __build__))
     logger.addHandler(logging.StreamHandler())
     logger.setLevel(logging.INFO)
     test_ping()
+    test_ping_concurrent_targets()
+    test_icmp_echo()
+    test_ping_stats()
+    test_parse_ping_output()
     test_test_http_internet()
     test_get_public_ip()
     test_probe_mtu()
+    test_probe_mtu_cache()